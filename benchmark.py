@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+# オフラインのエンドツーエンドベンチマーク
+# Twitter検索APIとGemini APIをローカルのスタブサーバーに置き換え、Firestoreエミュレーターに対して
+# search_recent_tweets → process_tweet → handle_tweet_data を合成したバーストで実行する。
+#
+# firebase emulators:start --only firestore
+# export FIRESTORE_EMULATOR_HOST="127.0.0.1:8080"
+# python3 benchmark.py --bursts 10 100 1000 --gemini-latency 0.8 --error-rate 0.02
+
+import os
+import sys
+import json
+import time
+import re
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+TWITTER_EPOCH_MS = 1288834974657
+PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "scrapcast-c94cc")
+
+
+def snowflake_id(timestamp_ms, sequence):
+    """指定時刻のTwitter Snowflake IDを作る（validate_tweet_id_ageを通るように）"""
+    return str(((timestamp_ms - TWITTER_EPOCH_MS) << 22) | (sequence & 0x3FFFFF))
+
+
+# --- Stub Servers ---
+
+class StubBehavior:
+    """スタブサーバーの遅延・エラー率・レート制限の設定と呼び出し回数"""
+
+    def __init__(self, latency, error_rate, rate_limit, rate_window):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.calls = 0
+        self._window_start = time.time()
+        self._window_calls = 0
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """呼び出しを1回数え、(レート制限超過か, 残り回数, リセット時刻) を返す"""
+        with self._lock:
+            self.calls += 1
+            now = time.time()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_calls = 0
+            self._window_calls += 1
+            reset = int(self._window_start + self.rate_window)
+            if self.rate_limit and self._window_calls > self.rate_limit:
+                return True, 0, reset
+            remaining = max(0, self.rate_limit - self._window_calls) if self.rate_limit else 1000
+            return False, remaining, reset
+
+    def sleep(self):
+        if self.latency:
+            # 平均latency、ばらつき±50%
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+
+class FakeTwitter:
+    """recent search のスタブ。合成したツイートを新しい順にページングして返す"""
+
+    def __init__(self, behavior):
+        self.behavior = behavior
+        self.tweets = []          # 新しい順
+        self.quoted_tweets = {}
+        self.users = {"1": {"id": "1", "username": "bench_user"}}
+
+    def add_burst(self, count, quoted_pool):
+        now_ms = int(time.time() * 1000)
+        quoted_ids = [snowflake_id(now_ms - 60_000, sequence) for sequence in range(quoted_pool)]
+        for quoted_id in quoted_ids:
+            self.quoted_tweets[quoted_id] = {
+                "id": quoted_id,
+                "text": f"ベンチマーク用の引用元ツイート {quoted_id} https://example.com/{quoted_id}",
+            }
+        burst = []
+        for sequence in range(count):
+            tweet_id = snowflake_id(now_ms, sequence)
+            burst.append({
+                "id": tweet_id,
+                "text": f"@ScrapCastGoGo ベンチマーク {sequence}",
+                "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                "author_id": "1",
+                "referenced_tweets": [{"type": "quoted", "id": random.choice(quoted_ids)}],
+            })
+        self.tweets = list(reversed(burst)) + self.tweets
+        return [tweet["id"] for tweet in burst]
+
+    def search(self, params):
+        since_id = params.get("since_id", [None])[0]
+        max_results = int(params.get("max_results", ["10"])[0])
+        offset = int(params.get("pagination_token", ["0"])[0])
+        matching = [tweet for tweet in self.tweets if not since_id or int(tweet["id"]) > int(since_id)]
+        page = matching[offset:offset + max_results]
+        body = {"meta": {"result_count": len(page)}}
+        if page:
+            quoted_ids = {ref["id"] for tweet in page for ref in tweet["referenced_tweets"]}
+            body["data"] = page
+            body["includes"] = {
+                "tweets": [self.quoted_tweets[quoted_id] for quoted_id in quoted_ids],
+                "users": list(self.users.values()),
+            }
+        if offset + max_results < len(matching):
+            body["meta"]["next_token"] = str(offset + max_results)
+        return body
+
+
+class FakeGemini:
+    """generateContent のスタブ。JSONモードなら入力件数分の配列、そうでなければ4行テキストを返す"""
+
+    def __init__(self, behavior):
+        self.behavior = behavior
+
+    def generate(self, request):
+        prompt = request["contents"][0]["parts"][0]["text"]
+        config = request.get("generationConfig", {})
+        if config.get("responseMimeType") == "application/json":
+            count = len(re.findall(r"^\[\d+\]$", prompt, flags=re.MULTILINE))
+            items = [
+                {"index": index, "title": f"ベンチ要約{index}", "summary": "ベンチマーク用の要約です", "urls": []}
+                for index in range(count)
+            ]
+            text = json.dumps(items, ensure_ascii=False)
+        else:
+            text = "### 2025-01-01 00:00 ベンチ要約\nベンチマーク用の要約です\nhttps://twitter.com/i/web/status/0\n"
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+def start_stub_server(fake_twitter, fake_gemini):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body=None, headers=None):
+            payload = json.dumps(body or {}, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            behavior = fake_twitter.behavior
+            limited, remaining, reset = behavior.admit()
+            headers = {"x-rate-limit-remaining": str(remaining), "x-rate-limit-reset": str(reset)}
+            behavior.sleep()
+            if limited:
+                return self._reply(429, {"title": "Too Many Requests"}, headers)
+            if behavior.should_fail():
+                return self._reply(503, {"title": "Service Unavailable"}, headers)
+            self._reply(200, fake_twitter.search(parse_qs(url.query)), headers)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            behavior = fake_gemini.behavior
+            limited, _, reset = behavior.admit()
+            behavior.sleep()
+            if limited:
+                retry_after = str(max(1, int(reset - time.time())))
+                return self._reply(429, {"error": {"status": "RESOURCE_EXHAUSTED"}}, {"Retry-After": retry_after})
+            if behavior.should_fail():
+                return self._reply(500, {"error": {"status": "INTERNAL"}})
+            self._reply(200, fake_gemini.generate(request))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Benchmark ---
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, int(len(ordered) * percent / 100 + 0.999999) - 1)
+    return ordered[index]
+
+
+def clear_emulator():
+    """Firestoreエミュレーターのデータを全て削除する"""
+    host = os.environ["FIRESTORE_EMULATOR_HOST"]
+    url = f"http://{host}/emulator/v1/projects/{PROJECT_ID}/databases/(default)/documents"
+    requests.delete(url, timeout=10).raise_for_status()
+
+
+class TriggerSimulator:
+    """
+    scrapcast_tweets への追加を on_snapshot で検知して handle_tweet_data を実行する
+    （Cloud Functionsの onCreate トリガーの代わり）
+    """
+
+    def __init__(self, db, handle_tweet_data, workers):
+        self._db = db
+        self._handle = handle_tweet_data
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="trigger")
+        self._expected = set()
+        self._completed = {}
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._initial = threading.Event()
+        self._watch = db.collection("scrapcast_tweets").on_snapshot(self._on_snapshot)
+        self._initial.wait(timeout=30)
+
+    def expect(self, tweet_ids):
+        with self._lock:
+            self._expected = set(tweet_ids)
+            self._completed = {}
+            self._done.clear()
+
+    def _on_snapshot(self, col_snapshot, changes, read_time):
+        if not self._initial.is_set():
+            self._initial.set()
+            return
+        for change in changes:
+            if change.type.name == "ADDED":
+                self._pool.submit(self._run, change.document.id, change.document.to_dict())
+
+    def _run(self, doc_id, doc_data):
+        self._handle(self._db, doc_id, doc_data)
+        with self._lock:
+            # ドキュメントキーはハッシュを前置きしたものなので、ツイートIDは id フィールドから取る
+            self._completed[doc_data["id"]] = time.perf_counter()
+            if self._expected and self._expected.issubset(self._completed):
+                self._done.set()
+
+    def wait(self, timeout):
+        self._done.wait(timeout=timeout)
+        with self._lock:
+            return dict(self._completed)
+
+    def close(self):
+        self._watch.unsubscribe()
+        self._pool.shutdown(wait=True)
+
+
+def run_burst(tw, fake_twitter, fake_gemini, trigger, burst_size, quoted_pool, timeout):
+    tw.metrics.reset()
+    search_calls = fake_twitter.behavior.calls
+    gemini_calls = fake_gemini.behavior.calls
+
+    tweet_ids = fake_twitter.add_burst(burst_size, quoted_pool)
+    trigger.expect(tweet_ids)
+
+    start = time.perf_counter()
+    tw.search_recent_tweets()
+    watcher_done = time.perf_counter()
+    completed = trigger.wait(timeout)
+    end = max(completed.values()) if completed else time.perf_counter()
+
+    latencies = [completed[tweet_id] - start for tweet_id in tweet_ids if tweet_id in completed]
+    api_calls = (fake_twitter.behavior.calls - search_calls) + (fake_gemini.behavior.calls - gemini_calls)
+    elapsed = end - start
+    return {
+        "burst": burst_size,
+        "completed": len(latencies),
+        "elapsed_seconds": round(elapsed, 3),
+        "watcher_seconds": round(watcher_done - start, 3),
+        "tweets_per_second": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_p50_seconds": round(percentile(latencies, 50), 3),
+        "latency_p95_seconds": round(percentile(latencies, 95), 3),
+        "latency_p99_seconds": round(percentile(latencies, 99), 3),
+        "search_calls": fake_twitter.behavior.calls - search_calls,
+        "gemini_calls": fake_gemini.behavior.calls - gemini_calls,
+        "api_calls_per_tweet": round(api_calls / burst_size, 3),
+        "watcher_metrics": tw.metrics.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ScrapCast パイプラインのオフラインベンチマーク")
+    parser.add_argument("--bursts", type=int, nargs="+", default=[10, 100, 1000, 10000], help="バーストの件数")
+    parser.add_argument("--quoted-ratio", type=float, default=0.5, help="引用元ツイートの種類数 / バースト件数")
+    parser.add_argument("--twitter-latency", type=float, default=0.3, help="検索APIの平均遅延（秒）")
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="Gemini APIの平均遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="スタブが5xxを返す確率")
+    parser.add_argument("--twitter-rate-limit", type=int, default=450, help="検索APIのウィンドウあたりの上限（0で無制限）")
+    parser.add_argument("--gemini-rate-limit", type=int, default=0, help="Gemini APIのウィンドウあたりの上限（0で無制限）")
+    parser.add_argument("--rate-window", type=float, default=900, help="レート制限のウィンドウ（秒）")
+    parser.add_argument("--trigger-workers", type=int, default=8, help="handle_tweet_data を並行実行する数")
+    parser.add_argument("--timeout", type=float, default=600, help="1バーストあたりの待ち時間の上限（秒）")
+    parser.add_argument("--output", help="結果をJSONで書き出すファイル")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        print("Error: The FIRESTORE_EMULATOR_HOST environment variable is not set.")
+        print("Please set it to your Firestore emulator's address (e.g., 127.0.0.1:8080)")
+        sys.exit(1)
+
+    fake_twitter = FakeTwitter(StubBehavior(args.twitter_latency, args.error_rate, args.twitter_rate_limit, args.rate_window))
+    fake_gemini = FakeGemini(StubBehavior(args.gemini_latency, args.error_rate, args.gemini_rate_limit, args.rate_window))
+    server = start_stub_server(fake_twitter, fake_gemini)
+    stub_url = f"http://127.0.0.1:{server.server_port}"
+    print(f"🧪 スタブサーバーを起動しました: {stub_url}")
+
+    # tweet_watcher の読み込み前にスタブとエミュレーター向けの設定をしておく
+    output_path = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="scrapcast-bench-")
+    os.chdir(workdir)
+    os.environ.update({
+        "BEARER_TOKEN": "benchmark",
+        "GEMINI_API_KEY": "benchmark",
+        "TWITTER_SEARCH_URL": f"{stub_url}/2/tweets/search/recent",
+        "GEMINI_API_BASE": f"{stub_url}/v1beta",
+        "CHECKPOINT_BACKEND": "file",
+        "GOOGLE_CLOUD_PROJECT": PROJECT_ID,
+    })
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(repo_dir, "firebase_works", "functions"))
+    sys.path.insert(0, repo_dir)
+    import tweet_watcher as tw
+    from main import handle_tweet_data
+
+    clear_emulator()
+    db = tw.initialize_firebase()
+    # 初回はsince_idなしだと1ページで打ち切られるので、現在時刻のIDを起点にしておく
+    tw.checkpoint_store.commit(snowflake_id(int(time.time() * 1000) - 1000, 0))
+    trigger = TriggerSimulator(db, handle_tweet_data, args.trigger_workers)
+
+    results = []
+    try:
+        for burst_size in args.bursts:
+            print(f"\n🚀 バースト {burst_size} 件を実行します")
+            quoted_pool = max(1, int(burst_size * args.quoted_ratio))
+            results.append(run_burst(tw, fake_twitter, fake_gemini, trigger, burst_size, quoted_pool, args.timeout))
+    finally:
+        trigger.close()
+        server.shutdown()
+
+    print("\n========== ベンチマーク結果 ==========")
+    print(f"{'burst':>7} {'done':>7} {'tweets/s':>9} {'p50(s)':>8} {'p95(s)':>8} {'p99(s)':>8} {'calls/tweet':>12}")
+    for result in results:
+        print(f"{result['burst']:>7} {result['completed']:>7} {result['tweets_per_second']:>9} "
+              f"{result['latency_p50_seconds']:>8} {result['latency_p95_seconds']:>8} "
+              f"{result['latency_p99_seconds']:>8} {result['api_calls_per_tweet']:>12}")
+    print("=====================================")
+
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"📊 結果を {output_path} に書き出しました")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# process_tweet のコールドスタート計測
+# 毎回新しいPythonプロセスで main.py を読み込み、Firestoreエミュレーターに対して
+# プロセスを起動してから最初のイベント（handle_tweet_data）を処理し終えるまでの時間を測る。
+# --mode eager は読み込み直後にクライアントを初期化する従来の挙動を再現した比較用。
+# 遅延初期化ではクライアントの初期化が最初のイベントに移るだけなので、両モードは cold_total_ms で比べる。
+# 計測に使うドキュメントは親プロセスで作っておき、子プロセスの時間に含めない。
+#
+# firebase emulators:start --only firestore
+# export FIRESTORE_EMULATOR_HOST="127.0.0.1:8080"
+# python3 cold_start_benchmark.py --runs 20
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+PROJECT_ID = os.environ.get("GOOGLE_CLOUD_PROJECT", "scrapcast-c94cc")
+
+# 子プロセスで実行する計測コード（1回のコールドスタートに相当）
+CHILD_SCRIPT = """
+import json, sys, time
+# 親プロセスがプロセスを起動した時刻（インタープリタの起動も含めて測る）
+launched = float(sys.argv[3])
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+if sys.argv[1] == "eager":
+    main.get_db()
+ready = time.perf_counter()
+
+tweet_id = sys.argv[2]
+tweet_data = json.loads(sys.argv[4])
+
+event_start = time.perf_counter()
+main.handle_tweet_data(main.get_db(), tweet_id, tweet_data)
+first_event = time.perf_counter()
+cold_total = time.time() - launched
+main.handle_tweet_data(main.get_db(), tweet_id, tweet_data)
+second_event = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "init_ms": (ready - imported) * 1000,
+    "first_event_ms": (first_event - event_start) * 1000,
+    "warm_event_ms": (second_event - first_event) * 1000,
+    "cold_total_ms": cold_total * 1000,
+}))
+"""
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def get_seed_db():
+    """計測用ドキュメントを作る親プロセス側のFirestoreクライアント"""
+    import firebase_admin
+    from firebase_admin import firestore
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(options={"projectId": PROJECT_ID})
+    return firestore.client()
+
+
+def seed_tweet(db, tweet_id):
+    """process_tweet が受け取るのと同じドキュメントを作り、その内容を返す"""
+    tweet_data = {"id": tweet_id, "url": f"https://twitter.com/bench/status/{tweet_id}",
+                  "author_username": "cold_start_bench", "processed": False}
+    db.collection("scrapcast_tweets").document(tweet_id).set(tweet_data)
+    return tweet_data
+
+
+def run_once(db, mode, run_index):
+    """新しいプロセスで1回計測する"""
+    env = dict(os.environ, GOOGLE_CLOUD_PROJECT=PROJECT_ID)
+    tweet_id = f"cold_start_{mode}_{run_index}"
+    tweet_data = seed_tweet(db, tweet_id)
+    launched = time.time()
+    completed = subprocess.run([sys.executable, "-c", CHILD_SCRIPT, mode, tweet_id, repr(launched),
+                                json.dumps(tweet_data)],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env, capture_output=True, text=True, check=True)
+    # ログ行が混ざるので最後の行だけを結果として読む
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    summary = {}
+    # cold_total_ms: プロセスを起動してから最初のイベントを処理し終えるまで（両モードの比較はこれで行う）
+    for key in ("import_ms", "init_ms", "first_event_ms", "warm_event_ms", "cold_total_ms"):
+        values = [sample[key] for sample in samples]
+        summary[key] = {"p50": round(statistics.median(values), 1), "p95": round(percentile(values, 95), 1)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="process_tweet のコールドスタート計測")
+    parser.add_argument("--runs", type=int, default=10, help="モードごとの計測回数")
+    parser.add_argument("--mode", choices=["lazy", "eager", "both"], default="both", help="計測するモード")
+    parser.add_argument("--output", help="結果をJSONで書き出すファイル")
+    args = parser.parse_args()
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        print("Error: The FIRESTORE_EMULATOR_HOST environment variable is not set.")
+        print("Please set it to your Firestore emulator's address (e.g., 127.0.0.1:8080)")
+        sys.exit(1)
+
+    modes = ["lazy", "eager"] if args.mode == "both" else [args.mode]
+    db = get_seed_db()
+    results = {}
+    for mode in modes:
+        print(f"🚀 {mode} モードを {args.runs} 回計測します")
+        samples = [run_once(db, mode, i) for i in range(args.runs)]
+        results[mode] = summarize(samples)
+
+    print("\n========== コールドスタート計測結果 ==========")
+    print(f"{'mode':>6} {'stage':>15} {'p50(ms)':>9} {'p95(ms)':>9}")
+    for mode, summary in results.items():
+        for stage, values in summary.items():
+            print(f"{mode:>6} {stage:>15} {values['p50']:>9} {values['p95']:>9}")
+    print("=============================================")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"📊 結果を {args.output} に書き出しました")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+# ScrapCast GitHub Markdown writer
+# Collects summaries per user/repository and appends them with a single commit
+# through the Git Data API (blobs → trees → commits → refs).
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+from firebase_admin import firestore
+from firebase_functions import logger
+
+from reply_dispatcher import REPLY_OUTBOX_COLLECTION, outbox_entry, summary_title
+from retry_scheduler import fail_stage, renew_leases, stage_completed_fields
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_PAT = os.environ.get("GITHUB_PAT")
+# How long pending summaries are collected before they are committed together
+GITHUB_COMMIT_WINDOW_SECONDS = float(os.environ.get("GITHUB_COMMIT_WINDOW_SECONDS", "10"))
+GITHUB_COMMIT_MAX_RETRIES = int(os.environ.get("GITHUB_COMMIT_MAX_RETRIES", "5"))
+GITHUB_REQUEST_TIMEOUT = 30
+# Attempts at recording a landed commit in Firestore; the commit is never appended again after it lands
+GITHUB_STATUS_MAX_RETRIES = int(os.environ.get("GITHUB_STATUS_MAX_RETRIES", "3"))
+# "single" appends to github_file_path; "sharded" writes monthly shards and keeps
+# github_file_path as a generated index. Users can override it with github_layout.
+GITHUB_LAYOUT = os.environ.get("GITHUB_LAYOUT", "single")
+# A shard rolls over to the next file of the same month once it would exceed this size
+GITHUB_SHARD_MAX_BYTES = int(os.environ.get("GITHUB_SHARD_MAX_BYTES", str(256 * 1024)))
+# Firestore accepts at most this many writes per batch
+FIRESTORE_BATCH_LIMIT = 500
+
+JST = timezone(timedelta(hours=9))
+SHARD_NAME_PATTERN = re.compile(r"^(\d{4}-\d{2})(?:-(\d+))?\.md$")
+INDEX_MARKER = "<!-- scrapcast:index -->"
+ARCHIVE_SHARD_NAME = "archive.md"
+
+class NonFastForwardError(Exception):
+    """The branch moved while the commit was being built."""
+
+class GitHubMarkdownWriter:
+    """
+    Buffers summaries per (owner, repo, file path) and writes each group in one commit.
+    On a non-fast-forward ref update the commit is rebuilt on top of the new head and retried.
+    Before the branch is moved, each tweet records the commit in processing_status.github_pending_commit,
+    so a retry after a lost status write can find the landed commit instead of appending again.
+    """
+
+    def __init__(self, db: firestore.Client, token: str | None = None,
+                 window_seconds: float = GITHUB_COMMIT_WINDOW_SECONDS,
+                 max_retries: int = GITHUB_COMMIT_MAX_RETRIES):
+        self._db = db
+        self._token = token or GITHUB_PAT
+        self._window_seconds = window_seconds
+        self._max_retries = max_retries
+        self._session = requests.Session()
+        self._pending: dict[tuple[str, str, str], list[tuple[str, str, dict | None]]] = {}
+        self._default_branches: dict[tuple[str, str], str] = {}
+        self._layouts: dict[tuple[str, str, str], str] = {}
+        self._landed: dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+
+    # --- Buffering ---
+
+    def add(self, tweet_id: str, user_settings: dict, markdown: str, reply_to: dict | None = None) -> None:
+        """
+        Queue a summary. With a window, the group is committed when the window closes.
+        reply_to ({tweet_id, author_username}) queues a completion reply once the commit lands.
+        """
+        key = (user_settings["github_owner"], user_settings["github_repo"], user_settings["github_file_path"])
+        with self._lock:
+            self._pending.setdefault(key, []).append((tweet_id, markdown, reply_to))
+            self._layouts[key] = user_settings.get("github_layout") or GITHUB_LAYOUT
+            if self._window_seconds > 0 and self._timer is None:
+                self._timer = threading.Timer(self._window_seconds, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> dict[tuple[str, str, str], list[str]]:
+        """Commit every pending group now. Returns the tweet IDs committed per group."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            layouts = {key: self._layouts.pop(key) for key in pending}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        committed = {}
+        for (owner, repo, path), entries in pending.items():
+            tweet_ids = [tweet_id for tweet_id, _, _ in entries]
+            try:
+                # Renew the GitHub stage leases right before committing; entries whose lease expired
+                # and was taken over by another worker are dropped so each summary is committed once
+                held = renew_leases(self._db, tweet_ids, 'github')
+                if len(held) < len(entries):
+                    logger.warn(f"⚠️ リースを失った {len(entries) - len(held)} 件は他のワーカーに任せます")
+                    entries = [entry for entry in entries if entry[0] in held]
+                    tweet_ids = [tweet_id for tweet_id, _, _ in entries]
+                    if not entries:
+                        continue
+                commit_sha, written_path = self._commit_entries(owner, repo, path, layouts[(owner, repo, path)],
+                                                                [markdown for _, markdown, _ in entries], tweet_ids)
+            except Exception as error:
+                logger.error(f"❌ {owner}/{repo}:{path} へのコミットに失敗しました: {error}")
+                self._mark_failed(tweet_ids, error)
+                continue
+            logger.info(f"✅ {owner}/{repo}:{written_path} に {len(entries)} 件を1コミットで追記しました: {commit_sha}")
+            committed[(owner, repo, path)] = tweet_ids
+            # The summaries are in the file now: a failed status write must not reschedule the stage
+            replies = {tweet_id: {**reply_to, 'title': summary_title(markdown)}
+                       for tweet_id, markdown, reply_to in entries if reply_to}
+            self._record_saved(tweet_ids, owner, repo, written_path, commit_sha, replies)
+        return committed
+
+    def recover_committed(self, tweet_id: str, pending: dict) -> bool:
+        """
+        Complete a tweet whose commit (processing_status.github_pending_commit) landed but whose
+        status write was lost. Returns False if the commit never reached the branch.
+        """
+        if not self._commit_landed(pending['owner'], pending['repo'], pending['sha']):
+            return False
+        logger.info(f"♻️ {tweet_id} はコミット済み ({pending['sha']}) のため、追記せずに保存済みにします")
+        self._mark_saved([tweet_id], pending['owner'], pending['repo'], pending['path'], pending['sha'])
+        return True
+
+    # --- Git Data API ---
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        if not self._token:
+            raise EnvironmentError("GITHUB_PAT が環境変数に設定されていません")
+        headers = {
+            "Authorization": f"Bearer {self._token}",
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+        }
+        headers.update(kwargs.pop("headers", {}))
+        return self._session.request(method, f"{GITHUB_API_URL}{path}", headers=headers,
+                                     timeout=GITHUB_REQUEST_TIMEOUT, **kwargs)
+
+    def _default_branch(self, owner: str, repo: str) -> str:
+        key = (owner, repo)
+        if key not in self._default_branches:
+            response = self._request("GET", f"/repos/{owner}/{repo}")
+            response.raise_for_status()
+            self._default_branches[key] = response.json()["default_branch"]
+        return self._default_branches[key]
+
+    def _read_file(self, owner: str, repo: str, path: str, ref: str) -> str:
+        response = self._request("GET", f"/repos/{owner}/{repo}/contents/{path}", params={"ref": ref},
+                                 headers={"Accept": "application/vnd.github.raw+json"})
+        if response.status_code == 404:
+            return ""
+        response.raise_for_status()
+        return response.content.decode("utf-8")
+
+    @staticmethod
+    def _append(current: str, entries: list[str]) -> str:
+        addition = "\n\n".join(entry.strip() for entry in entries) + "\n"
+        if not current.strip():
+            return addition
+        return current.rstrip("\n") + "\n\n" + addition
+
+    def _list_directory(self, owner: str, repo: str, directory: str, ref: str) -> list[dict]:
+        response = self._request("GET", f"/repos/{owner}/{repo}/contents/{directory}", params={"ref": ref})
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        listing = response.json()
+        return listing if isinstance(listing, list) else []
+
+    @staticmethod
+    def _shard_directory(path: str) -> str:
+        """notes/scrapcast.md -> notes/scrapcast"""
+        root, _ = os.path.splitext(path)
+        return root
+
+    @staticmethod
+    def _shard_key(name: str) -> tuple[str, int]:
+        match = SHARD_NAME_PATTERN.match(name)
+        return match.group(1), int(match.group(2) or 1)
+
+    @staticmethod
+    def _shard_name(month: str, sequence: int) -> str:
+        return f"{month}.md" if sequence == 1 else f"{month}-{sequence}.md"
+
+    def _active_shard(self, shards: list[dict], month: str, addition_bytes: int) -> tuple[str, int, bool]:
+        """Pick the shard to append to: (name, current size, whether it is new)."""
+        current = [shard for shard in shards
+                   if SHARD_NAME_PATTERN.match(shard["name"]) and self._shard_key(shard["name"])[0] == month]
+        if not current:
+            return self._shard_name(month, 1), 0, True
+        latest = max(current, key=lambda shard: self._shard_key(shard["name"])[1])
+        if latest["size"] > 0 and latest["size"] + addition_bytes > GITHUB_SHARD_MAX_BYTES:
+            sequence = self._shard_key(latest["name"])[1] + 1
+            return self._shard_name(month, sequence), 0, True
+        return latest["name"], latest["size"], False
+
+    def _render_index(self, path: str, shard_names: list[str]) -> str:
+        directory = os.path.basename(self._shard_directory(path))
+        dated = sorted((name for name in shard_names if SHARD_NAME_PATTERN.match(name)),
+                       key=self._shard_key, reverse=True)
+        lines = ["# ScrapCast", INDEX_MARKER, ""]
+        lines += [f"- [{os.path.splitext(name)[0]}]({directory}/{name})" for name in dated]
+        if ARCHIVE_SHARD_NAME in shard_names:
+            lines.append(f"- [archive]({directory}/{ARCHIVE_SHARD_NAME})")
+        return "\n".join(lines) + "\n"
+
+    def _build_sharded_tree(self, owner: str, repo: str, head_sha: str,
+                            path: str, entries: list[str]) -> tuple[list[dict], str]:
+        """
+        Append to the active monthly shard only. The index is rewritten only when a shard is created,
+        so each commit reads at most one shard of bounded size.
+        """
+        directory = self._shard_directory(path)
+        shards = [item for item in self._list_directory(owner, repo, directory, head_sha) if item.get("type") == "file"]
+        addition = self._append("", entries)
+        month = datetime.now(JST).strftime("%Y-%m")
+        shard_name, shard_size, is_new = self._active_shard(shards, month, len(addition.encode("utf-8")))
+        shard_path = f"{directory}/{shard_name}"
+
+        current = "" if is_new else self._read_file(owner, repo, shard_path, head_sha)
+        tree_entries = [self._blob_entry(owner, repo, shard_path, self._append(current, entries))]
+        if not is_new:
+            return tree_entries, shard_path
+
+        shard_names = [shard["name"] for shard in shards] + [shard_name]
+        index = self._read_file(owner, repo, path, head_sha)
+        if index.strip() and INDEX_MARKER not in index:
+            # The file predates the sharded layout: keep its content as the archive shard
+            tree_entries.append(self._blob_entry(owner, repo, f"{directory}/{ARCHIVE_SHARD_NAME}", index))
+            shard_names.append(ARCHIVE_SHARD_NAME)
+        tree_entries.append(self._blob_entry(owner, repo, path, self._render_index(path, shard_names)))
+        return tree_entries, shard_path
+
+    def _build_tree(self, owner: str, repo: str, base_tree: str, head_sha: str,
+                    path: str, layout: str, entries: list[str]) -> tuple[list[dict], str]:
+        """Return the tree entries to write on top of base_tree and the file the entries went to."""
+        if layout == "sharded":
+            return self._build_sharded_tree(owner, repo, head_sha, path, entries)
+        content = self._append(self._read_file(owner, repo, path, head_sha), entries)
+        return [self._blob_entry(owner, repo, path, content)], path
+
+    def _blob_entry(self, owner: str, repo: str, path: str, content: str) -> dict:
+        response = self._request("POST", f"/repos/{owner}/{repo}/git/blobs",
+                                 json={"content": content, "encoding": "utf-8"})
+        response.raise_for_status()
+        return {"path": path, "mode": "100644", "type": "blob", "sha": response.json()["sha"]}
+
+    def _commit_landed(self, owner: str, repo: str, commit_sha: str) -> bool:
+        """Whether commit_sha is reachable from the default branch."""
+        if commit_sha not in self._landed:
+            branch = self._default_branch(owner, repo)
+            response = self._request("GET", f"/repos/{owner}/{repo}/compare/{branch}...{commit_sha}")
+            if response.status_code == 404:
+                landed = False
+            else:
+                response.raise_for_status()
+                landed = response.json()["status"] in ("identical", "behind")
+            self._landed[commit_sha] = landed
+        return self._landed[commit_sha]
+
+    def _try_commit(self, owner: str, repo: str, branch: str, path: str, layout: str,
+                    entries: list[str], tweet_ids: list[str]) -> tuple[str, str]:
+        response = self._request("GET", f"/repos/{owner}/{repo}/git/ref/heads/{branch}")
+        response.raise_for_status()
+        head_sha = response.json()["object"]["sha"]
+
+        response = self._request("GET", f"/repos/{owner}/{repo}/git/commits/{head_sha}")
+        response.raise_for_status()
+        base_tree = response.json()["tree"]["sha"]
+
+        tree_entries, written_path = self._build_tree(owner, repo, base_tree, head_sha, path, layout, entries)
+        response = self._request("POST", f"/repos/{owner}/{repo}/git/trees",
+                                 json={"base_tree": base_tree, "tree": tree_entries})
+        response.raise_for_status()
+        tree_sha = response.json()["sha"]
+
+        message = f"ScrapCast: {len(entries)} 件のツイート要約を追加"
+        response = self._request("POST", f"/repos/{owner}/{repo}/git/commits",
+                                 json={"message": message, "tree": tree_sha, "parents": [head_sha]})
+        response.raise_for_status()
+        commit_sha = response.json()["sha"]
+
+        # Recorded before the branch moves; if this write fails nothing has been appended yet
+        self._mark_committing(tweet_ids, owner, repo, written_path, commit_sha)
+        response = self._request("PATCH", f"/repos/{owner}/{repo}/git/refs/heads/{branch}",
+                                 json={"sha": commit_sha, "force": False})
+        if response.status_code == 422:
+            raise NonFastForwardError(response.text)
+        response.raise_for_status()
+        return commit_sha, written_path
+
+    def _commit_entries(self, owner: str, repo: str, path: str, layout: str,
+                        entries: list[str], tweet_ids: list[str]) -> tuple[str, str]:
+        branch = self._default_branch(owner, repo)
+        for attempt in range(1, self._max_retries + 1):
+            try:
+                return self._try_commit(owner, repo, branch, path, layout, entries, tweet_ids)
+            except NonFastForwardError:
+                # Another commit landed first: rebuild the commit on top of the new head
+                logger.warn(f"⚠️ {owner}/{repo}@{branch} が更新されていたため、リベースして再試行します ({attempt}/{self._max_retries})")
+        raise RuntimeError(f"{owner}/{repo}@{branch} の更新が {self._max_retries} 回競合しました")
+
+    # --- Firestore status ---
+
+    def _mark_committing(self, tweet_ids: list[str], owner: str, repo: str, path: str, commit_sha: str) -> None:
+        collection = self._db.collection('scrapcast_tweets')
+        pending = {'sha': commit_sha, 'owner': owner, 'repo': repo, 'path': path}
+        for start in range(0, len(tweet_ids), FIRESTORE_BATCH_LIMIT):
+            batch = self._db.batch()
+            for tweet_id in tweet_ids[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.update(collection.document(tweet_id), {'processing_status.github_pending_commit': pending})
+            batch.commit()
+
+    def _record_saved(self, tweet_ids: list[str], owner: str, repo: str, path: str, commit_sha: str,
+                      replies: dict[str, dict]) -> None:
+        for attempt in range(1, GITHUB_STATUS_MAX_RETRIES + 1):
+            try:
+                self._mark_saved(tweet_ids, owner, repo, path, commit_sha, replies)
+                return
+            except Exception as error:
+                logger.warn(f"⚠️ 保存済みステータスの更新に失敗しました ({attempt}/{GITHUB_STATUS_MAX_RETRIES}): {error}")
+                if attempt < GITHUB_STATUS_MAX_RETRIES:
+                    time.sleep(2 ** attempt)
+        # The lease runs out and the retry scheduler completes them through recover_committed
+        logger.error(f"❌ コミット {commit_sha} の {len(tweet_ids)} 件を保存済みにできませんでした。"
+                     "再試行時に追記せず保存済みにします")
+
+    def _mark_saved(self, tweet_ids: list[str], owner: str, repo: str, path: str, commit_sha: str,
+                    replies: dict[str, dict] | None = None) -> None:
+        replies = replies or {}
+        collection = self._db.collection('scrapcast_tweets')
+        file_url = f"https://github.com/{owner}/{repo}/blob/{self._default_branch(owner, repo)}/{path}"
+        outbox = self._db.collection(REPLY_OUTBOX_COLLECTION)
+        # A group can hold more tweets than one batch allows, so the writes are split into batches of
+        # at most FIRESTORE_BATCH_LIMIT. A tweet's completion reply goes to the outbox in the same batch
+        # as its status update; the dispatcher sends it later.
+        batch, operations = self._db.batch(), 0
+        for tweet_id in tweet_ids:
+            reply_to = replies.get(tweet_id)
+            needed = 2 if reply_to else 1
+            if operations + needed > FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch, operations = self._db.batch(), 0
+            if reply_to:
+                batch.set(outbox.document(tweet_id),
+                          outbox_entry(tweet_id, reply_to["tweet_id"], reply_to["author_username"], file_url,
+                                       reply_to.get("title")))
+            batch.update(collection.document(tweet_id), {
+                'processing_status.saved_to_github': True,
+                'processing_status.saved_to_github_at': datetime.now(),
+                'processing_status.github_commit': commit_sha,
+                'processing_status.github_file': f"{owner}/{repo}/{path}",
+                'processing_status.github_pending_commit': firestore.DELETE_FIELD,
+                **stage_completed_fields(),
+            })
+            operations += needed
+        if operations:
+            batch.commit()
+
+    def _mark_failed(self, tweet_ids: list[str], error: Exception) -> None:
+        try:
+            # Reschedules the github stage with backoff (or dead-letters it past the limit)
+            fail_stage(self._db, tweet_ids, 'github', error)
+        except Exception as e:
+            logger.error(f"❌ エラーステータスの更新中にさらにエラーが発生しました: {e}")
@@ -3,67 +3,230 @@
 
 import os
 import time
+import queue
 import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime
 from firebase_admin import credentials, firestore, initialize_app
 
 # Important: This tells the script to look for the main.py file
 # in the 'functions' subdirectory.
 import sys
-from main import handle_tweet_data
-
-# --- Emulator Setup ---
-# Ensure the FIRESTORE_EMULATOR_HOST environment variable is set before running.
-# Example: export FIRESTORE_EMULATOR_HOST="localhost:8080"
-if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
-    print("Error: The FIRESTORE_EMULATOR_HOST environment variable is not set.")
-    print("Please set it to your Firestore emulator's address (e.g., localhost:8080)")
-    sys.exit(1)
-
-print("Connecting to Firestore emulator...")
-# When using the emulator, standard credentials are not needed.
-# The SDK automatically detects the FIRESTORE_EMULATOR_HOST variable.
-try:
-    from firebase_admin import get_app
-    get_app()
-except ValueError:
-    initialize_app()
-db = firestore.client()
-
-# --- Firestore Listener ---
-
-# Create a callback function to handle changes.
-# Use a threading.Event to signal when the first snapshot is received.
-initial_snapshot_processed = threading.Event()
-
-def on_snapshot(col_snapshot, changes, read_time):
-    # Skip the initial data dump, only process new changes
-    if not initial_snapshot_processed.is_set():
-        initial_snapshot_processed.set()
-        print("Initial data processed. Waiting for new documents...")
-        return
-
-    for change in changes:
-        if change.type.name == 'ADDED':
-            doc_id = change.document.id
-            doc_data = change.document.to_dict()
-            print(f"\n--- New Document Detected: {doc_id} ---")
+from main import handle_tweet_data, get_user_settings_cache, run_retry_scheduler
+from github_writer import GitHubMarkdownWriter
+from reply_dispatcher import ReplyDispatcher
+
+# --- Worker Pool Settings ---
+# Documents are handed from the watch thread to a bounded queue served by a worker pool.
+# When the queue is full the watch callback blocks, which is the backpressure on the listener.
+WORKER_COUNT = int(os.environ.get("LOCAL_RUNNER_WORKERS", "4"))
+QUEUE_SIZE = int(os.environ.get("LOCAL_RUNNER_QUEUE_SIZE", "100"))
+DOCUMENT_TIMEOUT_SECONDS = float(os.environ.get("LOCAL_RUNNER_DOCUMENT_TIMEOUT", "60"))
+DRAIN_TIMEOUT_SECONDS = float(os.environ.get("LOCAL_RUNNER_DRAIN_TIMEOUT", "30"))
+# How often failed or stalled stages are checked (the deployed functions use a 5 minute schedule)
+RETRY_INTERVAL_SECONDS = float(os.environ.get("LOCAL_RUNNER_RETRY_INTERVAL", "60"))
+# How often the reply outbox is dispatched (replies are sent off the processing path)
+REPLY_INTERVAL_SECONDS = float(os.environ.get("LOCAL_RUNNER_REPLY_INTERVAL", "30"))
+
+# --- Worker Pool ---
+
+class DocumentWorkerPool:
+    """
+    Runs handler(doc_id, doc_data, cancelled) for each submitted document on a fixed set of workers.
+    Each handler runs on its own daemon thread so that one overrunning its timeout can be abandoned:
+    its cancelled event is set and on_timeout(doc_id) records the timeout. Abandoned handlers keep
+    their slot until they return; once every slot is taken the workers stop starting documents,
+    so the queue fills and submit blocks instead of piling up work.
+    """
+
+    def __init__(self, handler, on_timeout, worker_count: int = WORKER_COUNT, queue_size: int = QUEUE_SIZE,
+                 timeout: float = DOCUMENT_TIMEOUT_SECONDS):
+        self._handler = handler
+        self._on_timeout = on_timeout
+        self._timeout = timeout
+        self._queue_size = queue_size
+        self.work_queue = queue.Queue(maxsize=queue_size)
+        # Twice the workers so a few abandoned documents do not starve the rest
+        self._slots = threading.BoundedSemaphore(worker_count * 2)
+        self._workers = [threading.Thread(target=self._worker_loop, name=f"worker-{i}", daemon=True)
+                         for i in range(worker_count)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, doc_id: str, doc_data: dict) -> None:
+        if self.work_queue.full():
+            print(f"Queue is full ({self._queue_size}); waiting for workers before accepting more documents...")
+        # Blocks while the queue is full so a burst cannot grow without bound
+        self.work_queue.put((doc_id, doc_data))
+
+    def _start_handler(self, doc_id: str, doc_data: dict, cancelled: threading.Event) -> Future:
+        """Wait for a free slot, then start the handler on its own thread. Returns its future."""
+        self._slots.acquire()
+        future = Future()
+
+        def run():
             try:
-                # Call the reusable business logic from main.py
-                handle_tweet_data(db, doc_id, doc_data)
+                future.set_result(self._handler(doc_id, doc_data, cancelled))
             except Exception as e:
-                print(f"Error processing document {doc_id}: {e}")
-            print("-----------------------------------------")
-
-collection_ref = db.collection('scrapcast_tweets')
-query_watch = collection_ref.on_snapshot(on_snapshot)
-
-print("Firestore listener is active. Waiting for new tweet documents...")
-print("(Press Ctrl+C to exit)")
-
-# Keep the script running to listen for changes.
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    print("Stopping the listener...")
-    query_watch.unsubscribe()
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+
+        threading.Thread(target=run, name=f"handle-{doc_id}", daemon=True).start()
+        return future
+
+    def _worker_loop(self):
+        while True:
+            item = self.work_queue.get()
+            try:
+                if item is None:
+                    return
+                doc_id, doc_data = item
+                print(f"\n--- New Document Detected: {doc_id} (queued: {self.work_queue.qsize()}) ---")
+                cancelled = threading.Event()
+                future = self._start_handler(doc_id, doc_data, cancelled)
+                try:
+                    # The handler has started by now, so the timeout only counts its own run time
+                    future.result(timeout=self._timeout)
+                except FutureTimeoutError:
+                    print(f"Timed out processing document {doc_id} after {self._timeout}s; moving on")
+                    # Stop the handler before its next write, then record the timeout in its place
+                    cancelled.set()
+                    self._on_timeout(doc_id)
+                except Exception as e:
+                    print(f"Error processing document {doc_id}: {e}")
+                print("-----------------------------------------")
+            finally:
+                self.work_queue.task_done()
+
+    def drain(self, timeout: float) -> bool:
+        """Wait until every queued document has been handled, up to timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while self.work_queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.1)
+        return self.work_queue.unfinished_tasks == 0
+
+    @property
+    def unfinished(self) -> int:
+        return self.work_queue.unfinished_tasks
+
+    def stop(self) -> None:
+        """Let idle workers exit (workers still running a document finish it first)."""
+        for _ in self._workers:
+            try:
+                self.work_queue.put_nowait(None)
+            except queue.Full:
+                break
+
+def mark_timed_out(db, doc_id: str) -> None:
+    try:
+        db.collection('scrapcast_tweets').document(doc_id).update({
+            'processing_status.error': True,
+            'processing_status.error_message': f"timed out after {DOCUMENT_TIMEOUT_SECONDS}s in local runner",
+            'processing_status.error_at': datetime.now()
+        })
+    except Exception as e:
+        print(f"Error recording timeout for {doc_id}: {e}")
+
+# --- Retry Scheduler ---
+
+def retry_loop(db, stopping: threading.Event):
+    while not stopping.wait(RETRY_INTERVAL_SECONDS):
+        try:
+            counts = run_retry_scheduler(db)
+            if any(counts.values()):
+                print(f"Retried failed stages: {counts}")
+        except Exception as e:
+            print(f"Error running the retry scheduler: {e}")
+
+def reply_loop(db, stopping: threading.Event):
+    dispatcher = ReplyDispatcher(db)
+    while not stopping.wait(REPLY_INTERVAL_SECONDS):
+        try:
+            dispatcher.dispatch()
+        except Exception as e:
+            print(f"Error dispatching replies: {e}")
+
+def main():
+    # --- Emulator Setup ---
+    # Ensure the FIRESTORE_EMULATOR_HOST environment variable is set before running.
+    # Example: export FIRESTORE_EMULATOR_HOST="localhost:8080"
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        print("Error: The FIRESTORE_EMULATOR_HOST environment variable is not set.")
+        print("Please set it to your Firestore emulator's address (e.g., localhost:8080)")
+        sys.exit(1)
+
+    print("Connecting to Firestore emulator...")
+    # When using the emulator, standard credentials are not needed.
+    # The SDK automatically detects the FIRESTORE_EMULATOR_HOST variable.
+    try:
+        from firebase_admin import get_app
+        get_app()
+    except ValueError:
+        initialize_app()
+    db = firestore.client()
+
+    # Summaries arriving within the window are committed to GitHub together
+    github_writer = GitHubMarkdownWriter(db)
+
+    # User settings are loaded once and kept current by a listener instead of read per tweet
+    settings_cache = get_user_settings_cache(db)
+    settings_cache.warm()
+    settings_cache.start_listener()
+
+    pool = DocumentWorkerPool(
+        # Call the reusable business logic from main.py
+        lambda doc_id, doc_data, cancelled: handle_tweet_data(db, doc_id, doc_data, github_writer, cancelled),
+        lambda doc_id: mark_timed_out(db, doc_id),
+    )
+
+    # --- Firestore Listener ---
+
+    # Create a callback function to handle changes.
+    # Use a threading.Event to signal when the first snapshot is received.
+    initial_snapshot_processed = threading.Event()
+    stopping = threading.Event()
+    threading.Thread(target=retry_loop, args=(db, stopping), name="retry", daemon=True).start()
+    threading.Thread(target=reply_loop, args=(db, stopping), name="reply", daemon=True).start()
+
+    def on_snapshot(col_snapshot, changes, read_time):
+        # Skip the initial data dump, only process new changes
+        if not initial_snapshot_processed.is_set():
+            initial_snapshot_processed.set()
+            print("Initial data processed. Waiting for new documents...")
+            return
+
+        added = [(change.document.id, change.document.to_dict() or {})
+                 for change in changes if change.type.name == 'ADDED']
+        # Resolve every author of this batch up front (at most one get_all);
+        # a document without author_username must not break the callback, so it is just not looked up
+        settings_cache.get_many(doc_data.get('author_username') for _, doc_data in added)
+        for doc_id, doc_data in added:
+            if stopping.is_set():
+                return
+            pool.submit(doc_id, doc_data)
+
+    collection_ref = db.collection('scrapcast_tweets')
+    query_watch = collection_ref.on_snapshot(on_snapshot)
+
+    print(f"Firestore listener is active with {WORKER_COUNT} workers (queue size {QUEUE_SIZE}). Waiting for new tweet documents...")
+    print("(Press Ctrl+C to exit)")
+
+    # Keep the script running to listen for changes.
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping the listener...")
+        stopping.set()
+        query_watch.unsubscribe()
+        settings_cache.stop_listener()
+        print(f"Draining {pool.unfinished} queued documents (up to {DRAIN_TIMEOUT_SECONDS}s)...")
+        if not pool.drain(DRAIN_TIMEOUT_SECONDS):
+            print(f"Drain timed out; {pool.unfinished} documents were not processed")
+        pool.stop()
+        print("Flushing pending GitHub commits...")
+        github_writer.flush()
+
+if __name__ == '__main__':
+    main()
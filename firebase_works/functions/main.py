@@ -1,29 +1,52 @@
 # ScrapCast Cloud Functions (Python) - 2nd Gen
 import os
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING
 import firebase_admin
 from firebase_admin import initialize_app, firestore
-from firebase_functions import https_fn, options, logger, firestore_fn
+from firebase_functions import https_fn, options, logger, firestore_fn, scheduler_fn
+from firebase_functions.params import IntParam
 from datetime import datetime
+from user_settings import UserSettingsCache
+from retry_scheduler import claim_stage, fail_stage, run_due_stage, stage_completed_fields
+
+if TYPE_CHECKING:
+    import threading
+    from github_writer import GitHubMarkdownWriter
 
 # Global options for all functions
 options.set_global_options(region=options.SupportedRegion.ASIA_NORTHEAST1)
 
-# Initialize Firebase Admin SDK only if it hasn't been initialized.
-# This is to prevent errors when this module is imported by other scripts
-# that might also initialize the app (e.g., local runners).
-if not firebase_admin._apps:
-    logger.info("Initializing Firebase Admin SDK...")
-    # Get project ID from environment variable for local development
-    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
-    if project_id:
-        initialize_app(options={"projectId": project_id})
-        logger.info(f"Firebase Admin SDK initialized with project ID: {project_id}")
-    else:
-        initialize_app()
-        logger.info("Firebase Admin SDK initialized without explicit project ID (assuming Cloud Functions environment).")
+# Deploy-time scaling of the process_tweet trigger.
+# Warm instances skip the cold start entirely; concurrency lets one instance serve several events.
+PROCESS_TWEET_MIN_INSTANCES = IntParam("PROCESS_TWEET_MIN_INSTANCES", default=0)
+PROCESS_TWEET_CONCURRENCY = IntParam("PROCESS_TWEET_CONCURRENCY", default=80)
 
-db = firestore.client()
-logger.info("Firestore db initialized.")
+@lru_cache(maxsize=None)
+def get_db() -> firestore.Client:
+    """
+    Initialize the Admin SDK and the Firestore client on first use.
+    Keeping this out of module import means functions that never touch Firestore
+    (and the deploy-time manifest load) do not pay for it.
+    """
+    # Initialize Firebase Admin SDK only if it hasn't been initialized.
+    # This is to prevent errors when this module is imported by other scripts
+    # that might also initialize the app (e.g., local runners).
+    if not firebase_admin._apps:
+        logger.info("Initializing Firebase Admin SDK...")
+        # Get project ID from environment variable for local development
+        project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+        if project_id:
+            initialize_app(options={"projectId": project_id})
+            logger.info(f"Firebase Admin SDK initialized with project ID: {project_id}")
+        else:
+            initialize_app()
+            logger.info("Firebase Admin SDK initialized without explicit project ID (assuming Cloud Functions environment).")
+
+    db = firestore.client()
+    logger.info("Firestore db initialized.")
+    return db
 
 @https_fn.on_request()
 def hello_scrapcast(req: https_fn.Request) -> https_fn.Response:
@@ -31,11 +54,101 @@ def hello_scrapcast(req: https_fn.Request) -> https_fn.Response:
     logger.info("Hello from ScrapCast Python! (2nd Gen)")
     return https_fn.Response("Hello from ScrapCast Cloud Functions (Python)! 🐍 (2nd Gen)")
 
-def handle_tweet_data(db: firestore.Client, tweet_id: str, tweet_data: dict) -> None:
+@lru_cache(maxsize=None)
+def get_user_settings_cache(db: firestore.Client) -> UserSettingsCache:
+    """One settings cache per client, shared by every event an instance handles."""
+    return UserSettingsCache(db)
+
+def get_user_settings(db: firestore.Client, username: str) -> dict | None:
+    """scrapcast_users/{username} from the cache; None if the user is unknown or inactive."""
+    return get_user_settings_cache(db).get(username)
+
+def queue_github_save(db: firestore.Client, tweet_id: str, tweet_data: dict,
+                      github_writer: "GitHubMarkdownWriter | None" = None) -> bool:
+    """
+    Queue the summary for the user's Markdown file.
+    Without a shared writer, a one-off writer commits immediately.
+    Returns False when there is nothing to save for this tweet.
+    """
+    summary = tweet_data.get('summary')
+    if not summary:
+        logger.warn(f"⚠️ 要約がないためGitHub保存をスキップします: {tweet_id}")
+        return False
+
+    author_username = tweet_data.get('author_username', '')
+    settings = get_user_settings(db, author_username)
+    if not settings or not all(settings.get(key) for key in ('github_owner', 'github_repo', 'github_file_path')):
+        logger.warn(f"⚠️ @{author_username} のGitHub設定がないためGitHub保存をスキップします: {tweet_id}")
+        return False
+
+    # Completion reply (settings.auto_reply, on by default) is queued in the outbox with the save
+    reply_to = None
+    if (settings.get('settings') or {}).get('auto_reply', True) and tweet_data.get('id'):
+        reply_to = {'tweet_id': tweet_data['id'], 'author_username': author_username}
+
+    if github_writer is None:
+        # Imported here so that requests is only loaded once a summary is actually published
+        from github_writer import GitHubMarkdownWriter
+        writer = GitHubMarkdownWriter(db, window_seconds=0)
+        writer.add(tweet_id, settings, summary, reply_to)
+        writer.flush()
+    else:
+        github_writer.add(tweet_id, settings, summary, reply_to)
+        logger.info(f"📝 GitHub保存待ちに追加しました: {tweet_id}")
+    return True
+
+def retry_github_saves(db: firestore.Client, snapshots: list) -> None:
+    """Re-run only the GitHub stage for documents whose earlier attempt failed or stalled."""
+    from github_writer import GitHubMarkdownWriter
+    writer = GitHubMarkdownWriter(db, window_seconds=0)
+    batch = db.batch()
+    for snapshot in snapshots:
+        tweet_data = snapshot.to_dict()
+        status = tweet_data.get('processing_status', {})
+        if status.get('saved_to_github'):
+            batch.update(snapshot.reference, stage_completed_fields())
+        elif status.get('github_pending_commit') and writer.recover_committed(snapshot.id,
+                                                                               status['github_pending_commit']):
+            # An earlier attempt appended the summary but could not record it; do not append again
+            continue
+        elif not queue_github_save(db, snapshot.id, tweet_data, writer):
+            batch.update(snapshot.reference, stage_completed_fields())
+    batch.commit()
+    # Saved documents are completed and failed ones rescheduled by the writer
+    writer.flush()
+
+# Stage name -> handler that re-runs it. "summarize" is retried by the watcher.
+RETRY_HANDLERS = {
+    'github': retry_github_saves,
+}
+
+def run_retry_scheduler(db: firestore.Client) -> dict[str, int]:
+    """Re-run every due stage handled here. Returns the number of documents per stage."""
+    return {stage: run_due_stage(db, stage, handler) for stage, handler in RETRY_HANDLERS.items()}
+
+def _abandoned(cancelled: "threading.Event | None", tweet_id: str, step: str) -> bool:
+    """True once the caller has given up on this run (e.g. the local runner's timeout)."""
+    if cancelled is None or not cancelled.is_set():
+        return False
+    logger.warn(f"⏱️ タイムアウトで打ち切られたため{step}をスキップします: {tweet_id}")
+    return True
+
+def handle_tweet_data(db: firestore.Client, tweet_id: str, tweet_data: dict,
+                      github_writer: "GitHubMarkdownWriter | None" = None,
+                      cancelled: "threading.Event | None" = None) -> None:
     """
     Business logic to process a tweet.
     This is reusable and testable.
+    A shared github_writer lets long-running callers batch commits across tweets.
+    Once cancelled is set, the run stops before its next write, so a caller that
+    abandoned it after a timeout does not race a late finisher.
     """
+    if tweet_data.get('migrated_from'):
+        # Re-keyed copy written by migrate_tweet_keys.py; the original was already processed
+        logger.info(f"⏭️ キー移行で作られたドキュメントのためスキップします: {tweet_id}")
+        return
+
+    start = time.perf_counter()
     try:
         logger.info(f"🔥 Processing tweet document: {tweet_id}")
         
@@ -49,31 +162,69 @@ def handle_tweet_data(db: firestore.Client, tweet_id: str, tweet_data: dict) ->
         logger.info(f"引用元URL: {quoted_tweet_url or 'なし'}")
         logger.info("=====================================")
         
-        # Update processing status
         doc_ref = db.collection('scrapcast_tweets').document(tweet_id)
+        has_summary = bool(tweet_data.get('summary'))
+        if _abandoned(cancelled, tweet_id, "処理"):
+            return
+        if has_summary:
+            # Claim the GitHub stage: another worker may already run it (duplicate delivery,
+            # several local runners); if this run dies, the retry scheduler picks it up
+            claimed = claim_stage(db, doc_ref, 'github')
+            if claimed is None:
+                logger.info(f"⏭️ 他のワーカーが処理中か処理済みのためスキップします: {tweet_id}")
+                return
+            tweet_data = claimed.to_dict()
+
+        if _abandoned(cancelled, tweet_id, "処理ステータスの更新"):
+            return
+        # Update processing status
         doc_ref.update({
             'processing_status.started': True,
             'processing_status.started_at': datetime.now()
         })
         
         logger.info(f"✅ ツイート処理ステータスを更新しました: {tweet_id}")
-        logger.info(f"🎉 ツイート処理完了（Python版デモ）: {tweet_id}")
+        
+        if _abandoned(cancelled, tweet_id, "GitHub保存"):
+            return
+        queued = queue_github_save(db, tweet_id, tweet_data, github_writer)
+        # The stage duration (as the spec asks) is taken once the save has been made or queued;
+        # with a shared writer the commit itself happens later, at flush
+        elapsed_ms = round((time.perf_counter() - start) * 1000)
+        completion = {'processing_status.durations_ms.handle_tweet_data': elapsed_ms}
+        if not queued and has_summary:
+            completion.update(stage_completed_fields())
+        if _abandoned(cancelled, tweet_id, "完了の記録"):
+            return
+        doc_ref.update(completion)
+        logger.info(f"🎉 ツイート処理完了（Python版デモ）: {tweet_id} ({elapsed_ms} ms)")
         
     except Exception as error:
         logger.error(f"❌ ツイート処理でエラーが発生しました: {tweet_id}, Error: {error}")
+        if _abandoned(cancelled, tweet_id, "エラーの記録"):
+            # The caller has already recorded the timeout
+            return
         # Error handling
         try:
-            doc_ref = db.collection('scrapcast_tweets').document(tweet_id)
-            doc_ref.update({
-                'processing_status.error': True,
-                'processing_status.error_message': str(error),
-                'processing_status.error_at': datetime.now()
-            })
+            if tweet_data.get('summary'):
+                # Schedule a retry of the GitHub stage (or dead-letter it)
+                fail_stage(db, [tweet_id], 'github', error)
+            else:
+                doc_ref = db.collection('scrapcast_tweets').document(tweet_id)
+                doc_ref.update({
+                    'processing_status.error': True,
+                    'processing_status.error_message': str(error),
+                    'processing_status.error_at': datetime.now()
+                })
         except Exception as e:
             logger.error(f"❌ エラーハンドリング中にさらにエラーが発生しました: {tweet_id}, Error: {e}")
 
 #def process_tweet(event: firestore_fn.Event[firestore_fn.Change]) -> None:
-@firestore_fn.on_document_created(document="scrapcast_tweets/{tweet_id}")
+@firestore_fn.on_document_created(document="scrapcast_tweets/{tweet_id}",
+                                  min_instances=PROCESS_TWEET_MIN_INSTANCES,
+                                  concurrency=PROCESS_TWEET_CONCURRENCY,
+                                  # concurrency > 1 requires a full vCPU (the default is gcf_gen1)
+                                  cpu=1)
 def process_tweet(event: firestore_fn.Event[firestore_fn.Change]) -> None:
     """
     Firestore onCreate trigger for tweet processing (2nd Gen).
@@ -83,9 +234,22 @@ def process_tweet(event: firestore_fn.Event[firestore_fn.Change]) -> None:
     
     # For created documents, event.data.after contains the DocumentSnapshot
     if not event.data or not event.data.after:
-        logger.warning(f"No data associated with the event for tweetId: {tweet_id}")
+        logger.warn(f"No data associated with the event for tweetId: {tweet_id}")
         return
 
     tweet_data = event.data.after.to_dict()
     
-    handle_tweet_data(db, tweet_id, tweet_data)
+    handle_tweet_data(get_db(), tweet_id, tweet_data)
+
+@scheduler_fn.on_schedule(schedule="every 5 minutes")
+def retry_failed_stages(event: scheduler_fn.ScheduledEvent) -> None:
+    """Scheduled retry of failed or stalled stages (up to RETRY_MAX_ATTEMPTS per stage)."""
+    counts = run_retry_scheduler(get_db())
+    logger.info(f"🔁 再試行スケジューラーを実行しました: {counts}")
+
+@scheduler_fn.on_schedule(schedule="every 1 minutes")
+def send_replies(event: scheduler_fn.ScheduledEvent) -> None:
+    """Send pending completion replies from the outbox within the posting limit."""
+    from reply_dispatcher import ReplyDispatcher
+    sent = ReplyDispatcher(get_db()).dispatch()
+    logger.info(f"💬 リプライを {sent} 件送信しました")
@@ -0,0 +1,290 @@
+# ScrapCast reply dispatcher
+# Saved tweets are written to an outbox collection in the same batch that marks them saved.
+# The dispatcher runs separately (scheduled function / local runner thread), groups the
+# outbox per user, and sends one "✅ 保存しました！" reply per group through a token bucket
+# that is persisted in Firestore, so replies never block summarization or saving.
+import os
+import random
+import re
+from datetime import datetime, timedelta, timezone
+
+import requests
+from firebase_admin import firestore
+from firebase_functions import logger
+
+from retry_scheduler import WORKER_ID
+
+REPLY_OUTBOX_COLLECTION = 'scrapcast_reply_outbox'
+REPLY_BUCKET_DOCUMENT = ('scrapcast_state', 'reply_token_bucket')
+TWITTER_POST_URL = os.environ.get("TWITTER_POST_URL", "https://api.twitter.com/2/tweets")
+# POST /2/tweets needs a user-context token (OAuth 2.0 with tweet.write)
+TWITTER_USER_ACCESS_TOKEN = os.environ.get("TWITTER_USER_ACCESS_TOKEN")
+# Posting limit of the account: REPLY_RATE_LIMIT replies per REPLY_RATE_WINDOW_SECONDS
+# (defaults to the Free tier's 17 posts per 24 hours), with bursts of up to REPLY_BURST
+REPLY_RATE_LIMIT = int(os.environ.get("REPLY_RATE_LIMIT", "17"))
+REPLY_RATE_WINDOW_SECONDS = float(os.environ.get("REPLY_RATE_WINDOW_SECONDS", str(24 * 60 * 60)))
+REPLY_BURST = int(os.environ.get("REPLY_BURST", "3"))
+# Saves of one user within this window are answered with a single reply
+REPLY_GROUP_WINDOW_SECONDS = float(os.environ.get("REPLY_GROUP_WINDOW_SECONDS", "120"))
+REPLY_MAX_ATTEMPTS = int(os.environ.get("REPLY_MAX_ATTEMPTS", "3"))
+REPLY_BATCH_SIZE = int(os.environ.get("REPLY_BATCH_SIZE", "100"))
+# Entries being sent are leased ("sending") so that concurrent dispatchers do not reply twice
+REPLY_LEASE_SECONDS = float(os.environ.get("REPLY_LEASE_SECONDS", "120"))
+# Links per reply; each URL counts as 23 characters towards the 280 limit
+REPLY_MAX_LINKS = 3
+REPLY_MAX_WEIGHT = 280
+REPLY_URL_WEIGHT = 23
+# Each saved tweet is listed by its title, cut to this many characters
+REPLY_TITLE_MAX_CHARS = int(os.environ.get("REPLY_TITLE_MAX_CHARS", "30"))
+# X counts characters in these ranges once and everything else (CJK, emoji) twice
+SINGLE_WEIGHT_RANGES = ((0x0000, 0x10FF), (0x2000, 0x200D), (0x2010, 0x201F), (0x2032, 0x2037))
+SUMMARY_HEADING_PREFIX = re.compile(r'^#*\s*(\d{4}-\d{2}-\d{2} \d{2}:\d{2}\s*)?')
+REPLY_REQUEST_TIMEOUT = 30
+JST = timezone(timedelta(hours=9))
+
+def summary_title(markdown: str) -> str | None:
+    """Title from the summary's "### <date> <time> <title>" heading."""
+    lines = markdown.strip().splitlines()
+    if not lines:
+        return None
+    return SUMMARY_HEADING_PREFIX.sub('', lines[0].strip()) or None
+
+def outbox_entry(tweet_doc_id: str, tweet_id: str, author_username: str, file_url: str,
+                 title: str | None = None) -> dict:
+    """Outbox document for one saved tweet (stored under the tweet's document ID)."""
+    now = datetime.now(timezone.utc)
+    return {
+        'tweet_doc_id': tweet_doc_id,
+        'tweet_id': tweet_id,
+        'author_username': author_username,
+        'file_url': file_url,
+        'title': title,
+        'status': 'pending',
+        'attempts': 0,
+        'created_at': now,
+        'next_attempt_at': now,
+    }
+
+def reply_weight(lines: list[str]) -> int:
+    """Length of the joined lines as X counts it (a line holding a URL counts as one URL)."""
+    weight = len(lines) - 1
+    for line in lines:
+        if line.startswith(("http://", "https://")):
+            weight += REPLY_URL_WEIGHT
+            continue
+        weight += sum(1 if any(low <= ord(char) <= high for low, high in SINGLE_WEIGHT_RANGES) else 2
+                      for char in line)
+    return weight
+
+def build_reply_text(saved: list[tuple[str, str]], saved_at: datetime) -> str:
+    """
+    Reply text for one group; saved holds (title or tweet ID, file URL) per tweet.
+    Titles are listed while they fit in the 280 limit, the rest as a count.
+    X rejects posts whose text repeats an earlier post of the account,
+    and saves of one day go to the same file, so the text carries the time of the newest save.
+    """
+    count = len(saved)
+    heading = "✅ 保存しました！" if count == 1 else f"✅ {count}件保存しました！"
+    urls = list(dict.fromkeys(file_url for _, file_url in saved))[:REPLY_MAX_LINKS]
+    stamp = f"🕒 {saved_at.astimezone(JST):%Y-%m-%d %H:%M:%S} JST"
+    tail = ["こちらに追加しました👇", *urls, stamp]
+
+    titles = []
+    for index, (label, _) in enumerate(saved):
+        if len(label) > REPLY_TITLE_MAX_CHARS:
+            label = label[:REPLY_TITLE_MAX_CHARS - 1] + "…"
+        rest = count - index - 1
+        # Keep room for the "ほかN件" line that follows when later titles do not fit
+        more = [f"・ほか{rest}件"] if rest else []
+        if reply_weight([heading, *titles, f"・{label}", *more, *tail]) > REPLY_MAX_WEIGHT:
+            break
+        titles.append(f"・{label}")
+    if len(titles) < count:
+        titles.append(f"・ほか{count - len(titles)}件")
+    return "\n".join([heading, *titles, *tail])
+
+def is_duplicate_content(response: requests.Response) -> bool:
+    """403 that X returns for a post repeating an earlier one; sending it again can never succeed."""
+    return response.status_code == 403 and "duplicate" in response.text.lower()
+
+class TokenBucket:
+    """
+    Token bucket kept in a Firestore document so every instance shares one posting budget.
+    Tokens refill at limit / window per second up to the burst size.
+    """
+
+    def __init__(self, db: firestore.Client, limit: int = REPLY_RATE_LIMIT,
+                 window_seconds: float = REPLY_RATE_WINDOW_SECONDS, burst: int = REPLY_BURST):
+        self._db = db
+        self._rate = limit / window_seconds
+        self._burst = max(1, burst)
+        self._ref = db.collection(REPLY_BUCKET_DOCUMENT[0]).document(REPLY_BUCKET_DOCUMENT[1])
+
+    def _refilled(self, snapshot, now: datetime) -> float:
+        if not snapshot.exists:
+            return float(self._burst)
+        state = snapshot.to_dict()
+        elapsed = max(0.0, (now - state['updated_at']).total_seconds())
+        return min(float(self._burst), state['tokens'] + elapsed * self._rate)
+
+    def try_acquire(self) -> bool:
+        """Take one token if available."""
+        @firestore.transactional
+        def acquire(transaction):
+            now = datetime.now(timezone.utc)
+            tokens = self._refilled(self._ref.get(transaction=transaction), now)
+            if tokens < 1:
+                return False
+            transaction.set(self._ref, {'tokens': tokens - 1, 'updated_at': now})
+            return True
+        return acquire(self._db.transaction())
+
+    def exhaust_until(self, reset_at: datetime) -> None:
+        """The API said the limit is reached: no tokens until reset_at."""
+        self._ref.set({'tokens': 0.0, 'updated_at': reset_at})
+
+class ReplyDispatcher:
+    """Sends the pending outbox as one reply per user and marks the tweets replied."""
+
+    def __init__(self, db: firestore.Client, token: str | None = None, bucket: TokenBucket | None = None):
+        self._db = db
+        self._token = token or TWITTER_USER_ACCESS_TOKEN
+        self._bucket = bucket or TokenBucket(db)
+        self._session = requests.Session()
+
+    def _due_entries(self, now: datetime) -> list:
+        # "sending" entries are only due once their lease has expired (the sender died)
+        query = (self._db.collection(REPLY_OUTBOX_COLLECTION)
+                 .where(filter=firestore.FieldFilter('status', 'in', ['pending', 'sending']))
+                 .where(filter=firestore.FieldFilter('next_attempt_at', '<=', now))
+                 .order_by('next_attempt_at')
+                 .limit(REPLY_BATCH_SIZE))
+        return list(query.stream())
+
+    def dispatch(self) -> int:
+        """Send every group whose window has closed, as far as the bucket allows. Returns replies sent."""
+        if not self._token:
+            logger.warn("⚠️ TWITTER_USER_ACCESS_TOKEN が設定されていないため、リプライを送信しません")
+            return 0
+
+        now = datetime.now(timezone.utc)
+        groups: dict[str, list] = {}
+        for snapshot in self._due_entries(now):
+            groups.setdefault(snapshot.get('author_username'), []).append(snapshot)
+
+        sent = 0
+        window = timedelta(seconds=REPLY_GROUP_WINDOW_SECONDS)
+        for author_username, entries in groups.items():
+            # Wait for the window to close so later saves of the same user join this reply
+            if min(entry.get('created_at') for entry in entries) > now - window:
+                continue
+            entries = self._claim(entries)
+            if not entries:
+                continue
+            if not self._bucket.try_acquire():
+                self._release(entries)
+                logger.info("⏳ リプライの送信枠がないため、残りは次回に送信します")
+                break
+            if self._send(author_username, entries):
+                sent += 1
+        return sent
+
+    def _claim(self, entries: list) -> list:
+        """Lease the entries in a transaction; returns those no other dispatcher has claimed meanwhile."""
+        @firestore.transactional
+        def claim(transaction):
+            now = datetime.now(timezone.utc)
+            claimed = []
+            for snapshot in self._db.get_all([entry.reference for entry in entries], transaction=transaction):
+                if snapshot.get('status') not in ('pending', 'sending') or snapshot.get('next_attempt_at') > now:
+                    continue
+                transaction.update(snapshot.reference, {
+                    'status': 'sending',
+                    'lease_owner': WORKER_ID,
+                    'next_attempt_at': now + timedelta(seconds=REPLY_LEASE_SECONDS),
+                })
+                claimed.append(snapshot)
+            return claimed
+        return claim(self._db.transaction())
+
+    def _release(self, entries: list) -> None:
+        batch = self._db.batch()
+        for entry in entries:
+            batch.update(entry.reference, {'status': 'pending', 'next_attempt_at': datetime.now(timezone.utc)})
+        batch.commit()
+
+    def _send(self, author_username: str, entries: list) -> bool:
+        # Reply to the newest mention; the reply lists everything saved in the window
+        latest = max(entries, key=lambda entry: int(entry.get('tweet_id')))
+        # Entries queued before titles were stored are listed by tweet ID
+        saved = [((entry.to_dict() or {}).get('title') or entry.get('tweet_id'), entry.get('file_url'))
+                 for entry in sorted(entries, key=lambda entry: int(entry.get('tweet_id')))]
+        text = build_reply_text(saved, max(entry.get('created_at') for entry in entries))
+        try:
+            response = self._session.post(
+                TWITTER_POST_URL,
+                headers={"Authorization": f"Bearer {self._token}"},
+                json={"text": text, "reply": {"in_reply_to_tweet_id": latest.get('tweet_id')}},
+                timeout=REPLY_REQUEST_TIMEOUT,
+            )
+        except requests.RequestException as error:
+            self._mark_failed(entries, error)
+            return False
+
+        if response.status_code == 429:
+            reset = response.headers.get("x-rate-limit-reset")
+            reset_at = (datetime.fromtimestamp(int(reset), timezone.utc) if reset
+                        else datetime.now(timezone.utc) + timedelta(minutes=15))
+            self._bucket.exhaust_until(reset_at)
+            self._release(entries)
+            logger.warn(f"⏳ リプライがレート制限に達しました。{reset_at.isoformat()} まで送信を止めます")
+            return False
+        if is_duplicate_content(response):
+            # The text is unique per group, so the same group was already posted
+            # (an earlier attempt succeeded but its response was lost)
+            self._mark_sent(entries, None)
+            logger.warn(f"⚠️ @{author_username} へのリプライは送信済みでした（重複投稿として拒否されました）")
+            return False
+        if response.status_code not in (200, 201):
+            self._mark_failed(entries, f"{response.status_code} {response.text}")
+            return False
+
+        reply_id = response.json().get('data', {}).get('id')
+        self._mark_sent(entries, reply_id)
+        logger.info(f"💬 @{author_username} に {len(entries)} 件分のリプライを送信しました: {reply_id}")
+        return True
+
+    def _mark_sent(self, entries: list, reply_id: str | None) -> None:
+        now = datetime.now(timezone.utc)
+        batch = self._db.batch()
+        tweets = self._db.collection('scrapcast_tweets')
+        for entry in entries:
+            batch.update(entry.reference, {'status': 'sent', 'sent_at': now, 'reply_tweet_id': reply_id})
+            batch.update(tweets.document(entry.get('tweet_doc_id')), {
+                'processing_status.replied': True,
+                'processing_status.replied_at': now,
+                'processing_status.reply_tweet_id': reply_id,
+            })
+        batch.commit()
+
+    def _mark_failed(self, entries: list, error: Exception | str) -> None:
+        logger.error(f"❌ リプライの送信に失敗しました: {error}")
+        now = datetime.now(timezone.utc)
+        batch = self._db.batch()
+        tweets = self._db.collection('scrapcast_tweets')
+        for entry in entries:
+            attempts = entry.get('attempts') + 1
+            if attempts >= REPLY_MAX_ATTEMPTS:
+                batch.update(entry.reference, {'status': 'failed', 'attempts': attempts, 'error_message': str(error)})
+                batch.update(tweets.document(entry.get('tweet_doc_id')), {
+                    'processing_status.reply_error': str(error),
+                })
+            else:
+                delay = 60 * (2 ** attempts) * random.uniform(0.8, 1.2)
+                batch.update(entry.reference, {
+                    'status': 'pending',
+                    'attempts': attempts,
+                    'error_message': str(error),
+                    'next_attempt_at': now + timedelta(seconds=delay),
+                })
+        batch.commit()
@@ -0,0 +1,226 @@
+# ScrapCast retry policy
+# The single definition of how failed stages are retried, shared by the retry scheduler here and
+# by the watcher (tweet_watcher.py imports this file for the "summarize" stage).
+# Each document carries the stage that still has to run in processing_status:
+#   retry_stage   - "summarize" (run by the watcher), "github" (run by the functions)
+#   retry_count   - failures of that stage so far
+#   next_retry_at - when the stage is due; while a stage runs this is its lease deadline,
+#                   so a crashed run shows up as due again (stalled) without extra bookkeeping
+#   lease_owner   - the worker running the stage
+#   error, error_message, error_at - the last failure
+# Failed stages are rescheduled with exponential backoff; after RETRY_MAX_ATTEMPTS retries
+# the document is copied to the dead-letter collection and dropped from the schedule.
+# Claims, lease renewals and results are written in transactions that check lease_owner, so a
+# worker whose lease expired and was taken over never overwrites the new owner's state.
+# Only firebase_admin is imported here, because the watcher does not install firebase-functions;
+# callers do their own logging.
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from firebase_admin import firestore
+
+TWEETS_COLLECTION = 'scrapcast_tweets'
+DEAD_LETTER_COLLECTION = 'scrapcast_dead_letters'
+# The spec allows up to 3 automatic retries per stage
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_SECONDS = float(os.environ.get("RETRY_BASE_SECONDS", "60"))
+RETRY_MAX_SECONDS = float(os.environ.get("RETRY_MAX_SECONDS", "3600"))
+# A stage that has not finished within this time is treated as stalled and retried
+STAGE_LEASE_SECONDS = float(os.environ.get("STAGE_LEASE_SECONDS", "600"))
+RETRY_BATCH_SIZE = int(os.environ.get("RETRY_BATCH_SIZE", "50"))
+# A summarized document is created with its GitHub stage already scheduled this far ahead, so the
+# retry scheduler runs it if the onCreate trigger never does (or dies before claiming it)
+STAGE_GRACE_SECONDS = float(os.environ.get("STAGE_GRACE_SECONDS", "600"))
+# Firestore allows at most 500 writes per transaction
+TRANSACTION_WRITE_LIMIT = 500
+# Identifies this process in lease_owner (one per function instance / local runner)
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+# processing_status flag that marks a stage as done, so a late claim does not run it again
+STAGE_DONE_FIELDS = {
+    'summarize': 'summarized',
+    'github': 'saved_to_github',
+}
+
+class StageFailure(NamedTuple):
+    """The writes that record one more failure of a stage."""
+    failures: int
+    delay: float | None            # seconds until the retry; None once dead-lettered
+    fields: dict                   # update for the tweet document
+    dead_letter: dict | None       # document for DEAD_LETTER_COLLECTION past the limit
+
+def retry_delay(failures: int) -> float:
+    """Exponential backoff with jitter for the n-th failure (n >= 1)."""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * (2 ** (failures - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+def scheduled_stage_status(stage: str, delay: float = STAGE_GRACE_SECONDS) -> dict:
+    """processing_status entries of a new document whose stage is due after delay seconds (no lease yet)."""
+    return {
+        'retry_stage': stage,
+        'retry_count': 0,
+        'next_retry_at': datetime.now(timezone.utc) + timedelta(seconds=delay),
+    }
+
+def stage_started_fields(stage: str, owner: str) -> dict:
+    """Fields that lease a stage while it runs."""
+    return {
+        'processing_status.retry_stage': stage,
+        'processing_status.next_retry_at': datetime.now(timezone.utc) + timedelta(seconds=STAGE_LEASE_SECONDS),
+        'processing_status.lease_owner': owner,
+    }
+
+def stage_completed_fields(next_stage: str | None = None) -> dict:
+    """Fields that clear the schedule, or hand the document to next_stage right away."""
+    if next_stage:
+        return {
+            'processing_status.retry_stage': next_stage,
+            'processing_status.retry_count': 0,
+            'processing_status.next_retry_at': datetime.now(timezone.utc),
+            'processing_status.lease_owner': firestore.DELETE_FIELD,
+        }
+    return {
+        'processing_status.retry_stage': firestore.DELETE_FIELD,
+        'processing_status.retry_count': 0,
+        'processing_status.next_retry_at': firestore.DELETE_FIELD,
+        'processing_status.lease_owner': firestore.DELETE_FIELD,
+    }
+
+def stage_failure(document_id: str, data: dict, stage: str, error: Exception | str) -> StageFailure:
+    """Reschedule the stage with backoff, or dead-letter it once RETRY_MAX_ATTEMPTS retries have failed."""
+    now = datetime.now(timezone.utc)
+    status = data.get('processing_status', {})
+    previous = status.get('retry_count', 0) if status.get('retry_stage') == stage else 0
+    failures = previous + 1
+    fields = {
+        'processing_status.error': True,
+        'processing_status.error_message': str(error),
+        'processing_status.error_at': now,
+        'processing_status.retry_count': failures,
+        'processing_status.lease_owner': firestore.DELETE_FIELD,
+    }
+    if failures > RETRY_MAX_ATTEMPTS:
+        fields.update({
+            'processing_status.dead_lettered': True,
+            'processing_status.retry_stage': firestore.DELETE_FIELD,
+            'processing_status.next_retry_at': firestore.DELETE_FIELD,
+        })
+        dead_letter = {
+            'tweet_id': data.get('id', document_id),
+            'stage': stage,
+            'failures': failures,
+            'error_message': str(error),
+            'dead_lettered_at': now,
+            'document': data,
+        }
+        return StageFailure(failures, None, fields, dead_letter)
+
+    delay = retry_delay(failures)
+    fields.update({
+        'processing_status.retry_stage': stage,
+        'processing_status.next_retry_at': now + timedelta(seconds=delay),
+    })
+    return StageFailure(failures, delay, fields, None)
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def _holds_lease(snapshot, stage: str, owner: str) -> bool:
+    status = snapshot.to_dict().get('processing_status', {}) if snapshot.exists else {}
+    return status.get('retry_stage') == stage and status.get('lease_owner') == owner
+
+def claim_stage(db: firestore.Client, doc_ref, stage: str, owner: str = WORKER_ID):
+    """
+    Claim a stage of one document in a transaction. Returns the snapshot if owner now
+    holds the lease, or None if the stage is done, dead-lettered, or leased by another worker.
+    An expired lease (next_retry_at in the past) can be claimed by anyone, and so can a stage
+    that is only scheduled (no lease_owner): next_retry_at then only tells the scheduler when to look.
+    Dead-lettered documents run again only once processing_status.dead_lettered is cleared.
+    """
+    @firestore.transactional
+    def claim(transaction):
+        snapshot = doc_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return None
+        status = snapshot.to_dict().get('processing_status', {})
+        done_field = STAGE_DONE_FIELDS.get(stage)
+        if (done_field and status.get(done_field)) or status.get('dead_lettered'):
+            return None
+        if (status.get('retry_stage') == stage and status.get('lease_owner') not in (None, owner)
+                and status.get('next_retry_at') and status['next_retry_at'] > datetime.now(timezone.utc)):
+            return None
+        transaction.update(doc_ref, stage_started_fields(stage, owner))
+        return snapshot
+    return claim(db.transaction())
+
+def renew_leases(db: firestore.Client, tweet_ids: list[str], stage: str, owner: str = WORKER_ID) -> set[str]:
+    """
+    Extend the leases owner still holds, in transactions of up to TRANSACTION_WRITE_LIMIT documents.
+    Returns the IDs still held; work on the others has been taken over and must be dropped.
+    """
+    collection = db.collection(TWEETS_COLLECTION)
+
+    @firestore.transactional
+    def renew(transaction, chunk):
+        held = set()
+        for snapshot in db.get_all([collection.document(tweet_id) for tweet_id in chunk], transaction=transaction):
+            if _holds_lease(snapshot, stage, owner):
+                transaction.update(snapshot.reference, stage_started_fields(stage, owner))
+                held.add(snapshot.id)
+        return held
+
+    held = set()
+    for chunk in _chunks(list(tweet_ids), TRANSACTION_WRITE_LIMIT):
+        held |= renew(db.transaction(), chunk)
+    return held
+
+def complete_stage(db: firestore.Client, updates: dict[str, dict], stage: str, owner: str = WORKER_ID) -> set[str]:
+    """
+    Write each document's result (tweet ID -> update) only while owner still holds its lease.
+    Returns the IDs written; the others were taken over and their results are dropped.
+    """
+    collection = db.collection(TWEETS_COLLECTION)
+
+    @firestore.transactional
+    def complete(transaction, chunk):
+        written = set()
+        for snapshot in db.get_all([collection.document(tweet_id) for tweet_id in chunk], transaction=transaction):
+            if _holds_lease(snapshot, stage, owner):
+                transaction.update(snapshot.reference, updates[snapshot.id])
+                written.add(snapshot.id)
+        return written
+
+    written = set()
+    for chunk in _chunks(list(updates), TRANSACTION_WRITE_LIMIT):
+        written |= complete(db.transaction(), chunk)
+    return written
+
+def record_stage_failures(db: firestore.Client, tweet_ids: list[str], stage: str, error: Exception | str,
+                          owner: str = WORKER_ID) -> dict[str, StageFailure]:
+    """
+    Record a failed stage for each document owner still holds the lease of: reschedule it,
+    or dead-letter it past the limit. Returns the failures written, by tweet ID.
+    """
+    collection = db.collection(TWEETS_COLLECTION)
+
+    @firestore.transactional
+    def record(transaction, chunk):
+        failures = {}
+        for snapshot in db.get_all([collection.document(tweet_id) for tweet_id in chunk], transaction=transaction):
+            if not _holds_lease(snapshot, stage, owner):
+                continue
+            failure = stage_failure(snapshot.id, snapshot.to_dict(), stage, error)
+            if failure.dead_letter:
+                transaction.set(db.collection(DEAD_LETTER_COLLECTION).document(snapshot.id), failure.dead_letter)
+            transaction.update(snapshot.reference, failure.fields)
+            failures[snapshot.id] = failure
+        return failures
+
+    failures = {}
+    # Up to two writes per document (the update and the dead letter)
+    for chunk in _chunks(list(tweet_ids), TRANSACTION_WRITE_LIMIT // 2):
+        failures.update(record(db.transaction(), chunk))
+    return failures
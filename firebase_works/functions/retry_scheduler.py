@@ -0,0 +1,56 @@
+# ScrapCast retry scheduler
+# Runs due stages for the functions side. The backoff, dead-letter policy, the
+# processing_status fields and the lease transactions are defined once in retry_policy.py,
+# which the watcher shares. Claims are made in a transaction so that several processors can
+# run side by side and each stage runs once.
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from firebase_functions import logger
+
+from retry_policy import (RETRY_BATCH_SIZE, RETRY_MAX_ATTEMPTS, TWEETS_COLLECTION, WORKER_ID, claim_stage,
+                          record_stage_failures, renew_leases, stage_completed_fields)
+
+def fail_stage(db: firestore.Client, tweet_ids: list[str], stage: str, error: Exception | str,
+               owner: str = WORKER_ID) -> None:
+    """
+    Record a failed stage for each document this worker still holds: reschedule it, or dead-letter
+    it past the limit. Documents whose lease was taken over are left to their new owner.
+    """
+    if not tweet_ids:
+        return
+    failures = record_stage_failures(db, tweet_ids, stage, error, owner)
+    for tweet_id, failure in failures.items():
+        if failure.dead_letter:
+            logger.error(f"☠️ {tweet_id} の {stage} が {failure.failures} 回失敗したため、デッドレターに移しました")
+        else:
+            logger.warn(f"🔁 {tweet_id} の {stage} を {failure.delay:.0f} 秒後に再試行します ({failure.failures}/{RETRY_MAX_ATTEMPTS})")
+    if len(failures) < len(tweet_ids):
+        logger.warn(f"⚠️ リースを失った {len(tweet_ids) - len(failures)} 件の失敗は記録しません（他のワーカーに任せます）")
+
+def find_due_documents(db: firestore.Client, stage: str, limit: int = RETRY_BATCH_SIZE) -> list:
+    """Documents whose stage is due (failed and backed off, or stalled past its lease)."""
+    query = (db.collection(TWEETS_COLLECTION)
+             .where(filter=firestore.FieldFilter('processing_status.retry_stage', '==', stage))
+             .where(filter=firestore.FieldFilter('processing_status.next_retry_at', '<=', datetime.now(timezone.utc)))
+             .order_by('processing_status.next_retry_at')
+             .limit(limit))
+    return list(query.stream())
+
+def run_due_stage(db: firestore.Client, stage: str, handler, limit: int = RETRY_BATCH_SIZE) -> int:
+    """
+    Re-run one stage for every due document. The handler receives the snapshots and
+    is responsible for completing or failing the stage for each of them.
+    """
+    # Claim each document first so an overlapping scheduler run or another worker skips it
+    snapshots = [claimed for claimed in (claim_stage(db, snapshot.reference, stage)
+                                         for snapshot in find_due_documents(db, stage, limit)) if claimed]
+    if not snapshots:
+        return 0
+    logger.info(f"🔁 {stage} の再試行対象が {len(snapshots)} 件あります")
+    try:
+        handler(db, snapshots)
+    except Exception as error:
+        logger.error(f"❌ {stage} の再試行でエラーが発生しました: {error}")
+        fail_stage(db, [snapshot.id for snapshot in snapshots], stage, error)
+    return len(snapshots)
@@ -0,0 +1,117 @@
+# ScrapCast user settings cache
+# Keeps scrapcast_users/{username} documents in memory so settings lookups do not cost
+# one Firestore read per tweet. Entries expire after a TTL, or are kept current by an
+# on_snapshot listener in long-running processes.
+import os
+import threading
+import time
+
+from firebase_admin import firestore
+from firebase_functions import logger
+
+USERS_COLLECTION = 'scrapcast_users'
+USER_SETTINGS_TTL_SECONDS = float(os.environ.get("USER_SETTINGS_TTL_SECONDS", "300"))
+
+class UserSettingsCache:
+    """
+    TTL cache of user documents. Missing users are cached too (as None) so unknown
+    authors do not trigger a read for every tweet.
+    While a snapshot listener is running, entries are updated by the listener and do not expire.
+    """
+
+    def __init__(self, db: firestore.Client, ttl_seconds: float = USER_SETTINGS_TTL_SECONDS):
+        self._db = db
+        self._ttl_seconds = ttl_seconds
+        self._entries: dict[str, tuple[dict | None, float]] = {}
+        self._lock = threading.Lock()
+        self._watch = None
+
+    @staticmethod
+    def _active(settings: dict | None) -> dict | None:
+        if settings is None or not settings.get('active', True):
+            return None
+        return settings
+
+    def _lookup(self, username: str) -> tuple[bool, dict | None]:
+        entry = self._entries.get(username)
+        if entry is None:
+            return False, None
+        settings, fetched_at = entry
+        if self._watch is None and time.monotonic() - fetched_at > self._ttl_seconds:
+            return False, None
+        return True, settings
+
+    def _store(self, username: str, settings: dict | None) -> None:
+        self._entries[username] = (settings, time.monotonic())
+
+    def get(self, username: str) -> dict | None:
+        """Settings of an active user, or None if the user is unknown or inactive."""
+        return self.get_many([username]).get(username)
+
+    def get_many(self, usernames) -> dict[str, dict | None]:
+        """Resolve several users; everything not cached is read with a single get_all."""
+        results = {}
+        missing = []
+        with self._lock:
+            for username in dict.fromkeys(usernames):
+                if not username:
+                    continue
+                hit, settings = self._lookup(username)
+                if hit:
+                    results[username] = self._active(settings)
+                else:
+                    missing.append(username)
+        if not missing:
+            return results
+
+        collection = self._db.collection(USERS_COLLECTION)
+        fetched = {username: None for username in missing}
+        for snapshot in self._db.get_all([collection.document(username) for username in missing]):
+            if snapshot.exists:
+                fetched[snapshot.id] = snapshot.to_dict()
+        with self._lock:
+            for username, settings in fetched.items():
+                self._store(username, settings)
+                results[username] = self._active(settings)
+        logger.info(f"👤 ユーザー設定を {len(missing)} 件読み込みました")
+        return results
+
+    def warm(self) -> int:
+        """Load every user document in one query. Returns the number of users loaded."""
+        snapshots = list(self._db.collection(USERS_COLLECTION).stream())
+        with self._lock:
+            for snapshot in snapshots:
+                self._store(snapshot.id, snapshot.to_dict())
+        logger.info(f"👤 ユーザー設定を {len(snapshots)} 件ウォームアップしました")
+        return len(snapshots)
+
+    def invalidate(self, username: str | None = None) -> None:
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+
+    # --- Snapshot listener ---
+
+    def _on_snapshot(self, col_snapshot, changes, read_time) -> None:
+        with self._lock:
+            for change in changes:
+                document = change.document
+                if change.type.name == 'REMOVED':
+                    self._store(document.id, None)
+                else:
+                    self._store(document.id, document.to_dict())
+
+    def start_listener(self) -> None:
+        """Keep the cache current from an on_snapshot listener (for long-running processes)."""
+        if self._watch is None:
+            self._watch = self._db.collection(USERS_COLLECTION).on_snapshot(self._on_snapshot)
+            logger.info("👂 ユーザー設定の変更監視を開始しました")
+
+    def stop_listener(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+            # Without the listener entries may be stale: let them expire from now on
+            self.invalidate()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+
+# scrapcast_tweets のドキュメントキーを、ツイートIDそのもの（旧形式）から
+# ハッシュを前置きした形式（tweet_keys.tweet_document_key）に移し替える一回限りのツール。
+# 移し替えたドキュメントには migrated_from を付けるので、Cloud Functionsのトリガーは再処理しない。
+# ツイートのドキュメントキーで保存している返信の送信待ち（scrapcast_reply_outbox）と
+# デッドレター（scrapcast_dead_letters）も同じキーに移し替える。
+# 送信中（sending）の送信待ちは移すと二重に返信しかねないので残し、件数を表示する（もう一度実行すれば移る）。
+# 移行が終わったら TWEET_KEY_LEGACY_LOOKUP=0 にして旧キーの重複チェックをやめる。
+#
+# tweet_watcher.py は読み込むだけでAPIキーを要求するので使わない。Firestoreへの接続は
+# FIRESTORE_EMULATOR_HOST（エミュレーター）、GOOGLE_APPLICATION_CREDENTIALS、
+# keys/firebase-service-account-key.json の順に探す。
+#
+# python3 migrate_tweet_keys.py --dry-run
+# python3 migrate_tweet_keys.py
+
+import argparse
+import os
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+from tweet_keys import is_legacy_key, tweet_document_key
+
+TWEETS_COLLECTION = "scrapcast_tweets"
+REPLY_OUTBOX_COLLECTION = "scrapcast_reply_outbox"
+DEAD_LETTER_COLLECTION = "scrapcast_dead_letters"
+LOCAL_KEY_FILE = "keys/firebase-service-account-key.json"
+# Firestoreの1バッチあたりの書き込み上限
+FIRESTORE_BATCH_LIMIT = 500
+# 1件あたり書き込み（set）と削除（delete）の2操作なので、バッチ上限の半分ずつ処理する
+PAGE_SIZE = FIRESTORE_BATCH_LIMIT // 2
+
+
+def initialize_firestore():
+    """移行先のFirestoreに接続する"""
+    if firebase_admin._apps:
+        return firestore.client()
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        project_id = os.environ.get("GOOGLE_CLOUD_PROJECT", "scrapcast-c94cc")
+        print(f"Firestoreエミュレーター ({os.environ['FIRESTORE_EMULATOR_HOST']}) に接続します。プロジェクトID: {project_id}")
+        firebase_admin.initialize_app(options={"projectId": project_id})
+        return firestore.client()
+    key_file = os.path.expandvars(os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", LOCAL_KEY_FILE))
+    if not os.path.isfile(key_file):
+        raise EnvironmentError(f"Firebase サービスアカウントキーファイルが見つかりません: {key_file}")
+    firebase_admin.initialize_app(credentials.Certificate(key_file))
+    return firestore.client()
+
+
+def rekey_tweet(data, old_key, new_key):
+    data.setdefault("id", old_key)
+    data["migrated_from"] = old_key
+    return data
+
+
+def rekey_outbox_entry(data, old_key, new_key):
+    if data.get("status") == "sending":
+        return None
+    if data.get("tweet_doc_id") == old_key:
+        data["tweet_doc_id"] = new_key
+    return data
+
+
+def rekey_dead_letter(data, old_key, new_key):
+    return data
+
+
+# 移し替える順番（送信待ちとデッドレターはツイートのドキュメントを参照するので後にする）
+COLLECTIONS = [
+    (TWEETS_COLLECTION, rekey_tweet),
+    (REPLY_OUTBOX_COLLECTION, rekey_outbox_entry),
+    (DEAD_LETTER_COLLECTION, rekey_dead_letter),
+]
+
+
+def migrate_page(db, collection_name, snapshots, rekey, dry_run):
+    """
+    1ページ分の旧キーのドキュメントを新キーに移し替え、(移した件数, 残した件数) を返す。
+    rekey(data, old_key, new_key) は新キーに書く内容を返し、None なら今回は移さない。
+    """
+    collection = db.collection(collection_name)
+    legacy = [snapshot for snapshot in snapshots if is_legacy_key(snapshot.id)]
+    moves = []
+    skipped = 0
+    for snapshot in legacy:
+        new_key = tweet_document_key(snapshot.id)
+        data = rekey(snapshot.to_dict(), snapshot.id, new_key)
+        if data is None:
+            skipped += 1
+            continue
+        moves.append((snapshot, collection.document(new_key), data))
+    if not moves:
+        return 0, skipped
+    # 新キーで既に保存されているものは上書きせず、旧キーを消すだけにする
+    existing = {snapshot.id for snapshot in db.get_all([target for _, target, _ in moves]) if snapshot.exists}
+
+    if dry_run:
+        for snapshot, target, _ in moves:
+            action = "削除のみ" if target.id in existing else "移行"
+            print(f"  {collection_name}/{snapshot.id} → {target.id} ({action})")
+        return len(moves), skipped
+
+    batch = db.batch()
+    for snapshot, target, data in moves:
+        if target.id not in existing:
+            batch.set(target, data)
+        batch.delete(snapshot.reference)
+    batch.commit()
+    return len(moves), skipped
+
+
+def migrate_collection(db, collection_name, rekey, dry_run):
+    """コレクション全体をキー順にページングして移し替え、(確認した件数, 移した件数, 残した件数) を返す"""
+    collection = db.collection(collection_name)
+    last = None
+    scanned = migrated = skipped = 0
+    # 新キーは16進数の前置きなので、移し替えたものは数字だけの旧キーと区別できる
+    while True:
+        query = collection.order_by("__name__").limit(PAGE_SIZE)
+        if last is not None:
+            query = query.start_after(last)
+        snapshots = list(query.stream())
+        if not snapshots:
+            break
+        last = snapshots[-1]
+        scanned += len(snapshots)
+        page_migrated, page_skipped = migrate_page(db, collection_name, snapshots, rekey, dry_run)
+        migrated += page_migrated
+        skipped += page_skipped
+        print(f"🔑 {collection_name}: {scanned} 件を確認し、{migrated} 件を移行しました")
+    return scanned, migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scrapcast_tweets のドキュメントキーを移行する")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに移行対象を表示する")
+    args = parser.parse_args()
+
+    db = initialize_firestore()
+    verb = "移行対象" if args.dry_run else "移行済み"
+    for collection_name, rekey in COLLECTIONS:
+        scanned, migrated, skipped = migrate_collection(db, collection_name, rekey, args.dry_run)
+        print(f"✅ {collection_name}: {scanned} 件中 {migrated} 件が{verb}です")
+        if skipped:
+            print(f"⚠️ {collection_name}: 送信中の {skipped} 件は移していません。送信が終わってからもう一度実行してください")
+
+
+if __name__ == '__main__':
+    main()
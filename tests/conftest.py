@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(ROOT, "firebase_works", "functions")
+for path in (ROOT, FUNCTIONS_DIR, os.path.dirname(os.path.abspath(__file__))):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# tweet_watcher は import 時に必須の環境変数を確認するので、ネットワークに出ないダミー値を入れておく
+os.environ.setdefault("CI", "1")
+os.environ.setdefault("BEARER_TOKEN", "test-bearer-token")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("CHECKPOINT_BACKEND", "file")
+os.environ.setdefault("HTTP_CASSETTE_MODE", "")
+
+from fake_firestore import FakeFirestore, transactional  # noqa: E402
+
+@pytest.fixture
+def db(monkeypatch):
+    """In-memory Firestore shared by the watcher and the functions modules."""
+    from firebase_admin import firestore
+
+    client = FakeFirestore()
+    monkeypatch.setattr(firestore, "transactional", transactional)
+    import tweet_watcher
+    monkeypatch.setattr(tweet_watcher, "_firestore_client", client)
+    return client
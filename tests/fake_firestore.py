@@ -0,0 +1,256 @@
+"""In-memory stand-in for the parts of the Firestore client this repo uses."""
+import copy
+import operator
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+BATCH_LIMIT = 500
+
+_OPERATORS = {
+    "==": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+
+_MISSING = object()
+
+def _lookup(data, field_path):
+    for part in field_path.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+def _apply_update(data, fields):
+    for field_path, value in fields.items():
+        *parents, leaf = field_path.split(".")
+        target = data
+        for part in parents:
+            target = target.setdefault(part, {})
+        if value is firestore.DELETE_FIELD:
+            target.pop(leaf, None)
+        else:
+            target[leaf] = copy.deepcopy(value)
+
+def _merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        else:
+            target[key] = copy.deepcopy(value)
+
+class NotFound(Exception):
+    pass
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = copy.deepcopy(data)
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        # Like the real client: a missing field raises KeyError
+        value = _lookup(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+class DocumentReference:
+    def __init__(self, client, collection_name, document_id):
+        self._client = client
+        self.id = document_id
+        self.path = f"{collection_name}/{document_id}"
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, transaction=None):
+        self._client.reads += 1
+        return DocumentSnapshot(self, self._client.documents.get(self.path))
+
+    def set(self, data, merge=False):
+        current = self._client.documents.get(self.path)
+        if merge and current is not None:
+            _merge(current, data)
+        else:
+            self._client.documents[self.path] = copy.deepcopy(data)
+
+    def create(self, data):
+        if self.path in self._client.documents:
+            raise AlreadyExists(self.path)
+        self._client.documents[self.path] = copy.deepcopy(data)
+
+    def update(self, fields):
+        current = self._client.documents.get(self.path)
+        if current is None:
+            raise NotFound(self.path)
+        _apply_update(current, fields)
+
+    def delete(self):
+        self._client.documents.pop(self.path, None)
+
+class Query:
+    def __init__(self, collection, filters=(), order=None, descending=False, limit=None, start_after=None):
+        self._collection = collection
+        self._filters = list(filters)
+        self._order = order
+        self._descending = descending
+        self._limit = limit
+        self._start_after = start_after
+        self.selected = None
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, descending=self._descending,
+                     limit=self._limit, start_after=self._start_after)
+        state.update(changes)
+        query = Query(self._collection, **state)
+        query.selected = self.selected
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(order=field_path, descending=direction == "DESCENDING")
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot)
+
+    def select(self, field_paths):
+        query = self._copy()
+        query.selected = list(field_paths)
+        return query
+
+    def _sort_key(self, item):
+        document_id, data = item
+        if self._order in (None, "__name__"):
+            return document_id
+        return _lookup(data, self._order)
+
+    def stream(self):
+        client = self._collection._client
+        prefix = f"{self._collection.id}/"
+        matches = []
+        for path, data in list(client.documents.items()):
+            if not path.startswith(prefix):
+                continue
+            if all((value := _lookup(data, field)) is not _MISSING and _OPERATORS[op](value, expected)
+                   for field, op, expected in self._filters):
+                matches.append((path[len(prefix):], data))
+        if self._order not in (None, "__name__"):
+            matches = [item for item in matches if self._sort_key(item) is not _MISSING]
+        matches.sort(key=self._sort_key, reverse=self._descending)
+        if self._start_after is not None:
+            after = self._sort_key((self._start_after.id, self._start_after._data))
+            matches = [item for item in matches
+                       if (self._sort_key(item) < after if self._descending else self._sort_key(item) > after)]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        client.reads += len(matches)
+        return [self._snapshot(document_id, data) for document_id, data in matches]
+
+    def _snapshot(self, document_id, data):
+        reference = self._collection.document(document_id)
+        if self.selected is not None:
+            data = {field: _lookup(data, field) for field in self.selected
+                    if field != "__name__" and _lookup(data, field) is not _MISSING}
+        return DocumentSnapshot(reference, data)
+
+    def get(self):
+        return self.stream()
+
+class CollectionReference(Query):
+    def __init__(self, client, collection_name):
+        self._client = client
+        self.id = collection_name
+        super().__init__(self)
+
+    def document(self, document_id):
+        return DocumentReference(self._client, self.id, document_id)
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, data, merge=False):
+        data = copy.deepcopy(data)
+        self._writes.append(lambda: reference.set(data, merge=merge))
+
+    def create(self, reference, data):
+        data = copy.deepcopy(data)
+        self._writes.append(lambda: reference.create(data))
+
+    def update(self, reference, fields):
+        fields = dict(fields)
+        self._writes.append(lambda: reference.update(fields))
+
+    def delete(self, reference):
+        self._writes.append(reference.delete)
+
+    def commit(self):
+        if len(self._writes) > BATCH_LIMIT:
+            raise ValueError(f"maximum {BATCH_LIMIT} writes allowed per request")
+        self._client.commits += 1
+        # All or nothing, like a real batch: a failing write (e.g. create on an existing document) undoes the rest
+        saved = copy.deepcopy(self._client.documents)
+        try:
+            for write in self._writes:
+                write()
+        except Exception:
+            self._client.documents = saved
+            raise
+        self._writes = []
+
+class Transaction(WriteBatch):
+    """Applies writes on commit, which the patched ``transactional`` decorator calls."""
+
+class FakeFirestore:
+    def __init__(self):
+        self.documents = {}
+        self.reads = 0
+        self.commits = 0
+        self.get_all_calls = 0
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def get_all(self, references, transaction=None, field_paths=None):
+        self.get_all_calls += 1
+        for reference in references:
+            yield reference.get()
+
+def transactional(function):
+    """Runs the function once with the transaction and commits its writes, like the real decorator."""
+    def run(transaction, *args, **kwargs):
+        result = function(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    return run
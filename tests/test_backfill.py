@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta, timezone
+
+import tweet_watcher as tw
+
+def tweet_id_at(moment):
+    return str(int(moment.timestamp() * 1000 - tw.TWITTER_EPOCH_MS) << 22)
+
+def test_checkpoint_stops_before_the_oldest_failure():
+    assert tw.newest_contiguous_success([("5", True), ("4", False), ("3", True), ("2", True)]) == "3"
+    assert tw.newest_contiguous_success([("5", True), ("4", True)]) == "5"
+    assert tw.newest_contiguous_success([("5", True), ("4", False)]) is None
+
+def test_time_slices_cover_the_range_newest_first():
+    start = datetime(2024, 6, 1, 0, 0, tzinfo=timezone.utc)
+    slices = tw.backfill_time_slices(start, start + timedelta(hours=5), slice_hours=2)
+    assert slices[0] == (start + timedelta(hours=3), start + timedelta(hours=5))
+    assert slices[-1] == (start, start + timedelta(hours=1))
+    assert all(newer[0] == older[1] for newer, older in zip(slices, slices[1:]))
+
+def test_backfill_starts_at_the_checkpoint_or_the_given_hours():
+    checkpoint_time = datetime.now(timezone.utc) - timedelta(days=2)
+    start = tw.backfill_start_time(since_id=tweet_id_at(checkpoint_time))
+    assert abs((start - checkpoint_time).total_seconds()) < 1
+    assert tw.backfill_start_time(since_id="1", hours=3) > datetime.now(timezone.utc) - timedelta(hours=3, seconds=1)
+
+def test_backfill_never_starts_outside_the_search_window():
+    start = tw.backfill_start_time(hours=tw.SEARCH_WINDOW_DAYS * 24)
+    assert start > datetime.now(timezone.utc) - timedelta(days=tw.SEARCH_WINDOW_DAYS)
+
+def test_stale_checkpoint_hint_covers_the_whole_window(monkeypatch, capsys):
+    stale = tweet_id_at(datetime.now(timezone.utc) - timedelta(days=tw.SEARCH_WINDOW_DAYS + 1))
+    monkeypatch.setattr(tw, "load_last_tweet_id", lambda shard=None: stale)
+    monkeypatch.setattr(tw, "submit_shard_pages", lambda pipeline, fetchers: (0, {}, {}))
+    tw.search_recent_tweets(shards={tw.DEFAULT_SEARCH_SHARD: "query"})
+    hint = f"--backfill --hours {tw.SEARCH_WINDOW_DAYS * 24}"
+    assert hint in capsys.readouterr().out
+    # 案内どおりに実行すると、最新に進んだチェックポイントではなく検索できる最古の時刻から取り込む
+    assert tw.backfill_start_time(hours=tw.SEARCH_WINDOW_DAYS * 24) < datetime.now(timezone.utc) - timedelta(days=6)
@@ -0,0 +1,52 @@
+import json
+
+import requests
+
+import benchmark
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(1, 101))
+    assert [benchmark.percentile(values, p) for p in (50, 95, 99)] == [50, 95, 99]
+    assert benchmark.percentile([], 50) == 0.0
+
+def test_rate_limit_applies_per_window(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(benchmark.time, "time", lambda: now[0])
+    behavior = benchmark.StubBehavior(latency=0, error_rate=0, rate_limit=2, rate_window=60)
+    assert [behavior.admit()[0] for _ in range(3)] == [False, False, True]
+    now[0] += 60
+    assert behavior.admit() == (False, 1, 1120)
+
+def test_fake_search_pages_newest_first_after_since_id(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(benchmark.time, "time", lambda: now[0])
+    twitter = benchmark.FakeTwitter(benchmark.StubBehavior(0, 0, 0, 60))
+    first = twitter.add_burst(3, quoted_pool=1)
+    now[0] += 1
+    second = twitter.add_burst(2, quoted_pool=1)
+    page = twitter.search({"since_id": [first[-1]], "max_results": ["1"]})
+    assert [tweet["id"] for tweet in page["data"]] == [second[-1]]
+    assert page["meta"]["next_token"] == "1"
+    last = twitter.search({"since_id": [first[-1]], "max_results": ["1"], "pagination_token": ["1"]})
+    assert [tweet["id"] for tweet in last["data"]] == [second[0]] and "next_token" not in last["meta"]
+    assert all(ref["id"] in twitter.quoted_tweets for tweet in page["data"] for ref in tweet["referenced_tweets"])
+
+def test_stub_server_answers_like_the_real_apis():
+    twitter = benchmark.FakeTwitter(benchmark.StubBehavior(0, 0, 1, 60))
+    gemini = benchmark.FakeGemini(benchmark.StubBehavior(0, 0, 0, 60))
+    twitter.add_burst(2, quoted_pool=1)
+    server = benchmark.start_stub_server(twitter, gemini)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        search = requests.get(f"{base}/2/tweets/search/recent", params={"max_results": 10}, timeout=5)
+        assert search.status_code == 200 and len(search.json()["data"]) == 2
+        assert requests.get(f"{base}/2/tweets/search/recent", timeout=5).status_code == 429
+
+        prompt = "[0]\n一件目\n[1]\n二件目"
+        body = {"contents": [{"parts": [{"text": prompt}]}],
+                "generationConfig": {"responseMimeType": "application/json"}}
+        reply = requests.post(f"{base}/v1beta/models/m:generateContent", json=body, timeout=5).json()
+        items = json.loads(reply["candidates"][0]["content"]["parts"][0]["text"])
+        assert [item["index"] for item in items] == [0, 1]
+    finally:
+        server.shutdown()
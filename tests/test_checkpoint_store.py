@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+import tweet_watcher as tw
+
+def test_checkpoint_store_requires_read_and_write():
+    with pytest.raises(TypeError):
+        tw.CheckpointStore()
+
+def test_file_store_only_moves_forward(tmp_path):
+    path = tmp_path / "last_tweet_id.txt"
+    store = tw.FileCheckpointStore(str(path))
+    assert store.load() is None
+    assert store.commit("200") is True
+    assert store.commit("100") is False
+    assert store.commit("200") is False
+    assert path.read_text() == "200"
+    assert tw.FileCheckpointStore(str(path)).load() == "200"
+
+def test_file_store_caches_the_first_read(tmp_path):
+    path = tmp_path / "last_tweet_id.txt"
+    path.write_text("10")
+    store = tw.FileCheckpointStore(str(path))
+    assert store.load() == "10"
+    path.write_text("20")
+    assert store.load() == "10"
+
+def test_failed_write_keeps_the_cached_value():
+    class FailingStore(tw.CheckpointStore):
+        def _read(self):
+            return "5"
+
+        def _write(self, tweet_id):
+            return None
+
+    store = FailingStore()
+    assert store.commit("6") is False
+    assert store.load() == "5"
+
+def test_firestore_store_does_not_move_backwards(db):
+    first = tw.FirestoreCheckpointStore(document="checkpoint_test")
+    second = tw.FirestoreCheckpointStore(document="checkpoint_test")
+    second.load()
+    assert first.commit("300") is True
+    # second は古い値（None）をキャッシュしたままだが、トランザクションで後退を防ぐ
+    assert second.commit("250") is False
+    stored = db.collection(tw.CHECKPOINT_COLLECTION).document("checkpoint_test").get().to_dict()
+    assert stored["last_tweet_id"] == "300"
+    # 保存先の値をキャッシュするので、以後も古いIDでは書き込まない
+    assert second.load() == "300"
+    assert second.commit("280") is False
+
+def test_concurrent_commits_never_move_the_cache_backwards():
+    writes = []
+
+    class SlowStore(tw.CheckpointStore):
+        def _read(self):
+            return None
+
+        def _write(self, tweet_id):
+            writes.append(tweet_id)
+            time.sleep(0.01)
+            return tweet_id
+
+    store = SlowStore()
+    threads = [threading.Thread(target=store.commit, args=(str(tweet_id),)) for tweet_id in range(100, 110)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.load() == "109"
+    # ロックの中で比べるので、保存する値は必ず前回より新しい
+    assert writes == sorted(writes, key=int)
+
+def test_shard_stores_use_shard_specific_names():
+    assert tw.create_checkpoint_store("file", "news")._filename == "last_tweet_id.news.txt"
+    assert tw.create_checkpoint_store("firestore", "news")._document == "watcher_checkpoint_news"
+    assert tw.create_checkpoint_store("github", "news")._var_name == "LAST_TWEET_ID_NEWS"
+    assert tw.create_checkpoint_store("github")._var_name == tw.LAST_TWEET_ID_VAR_NAME
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(EnvironmentError):
+        tw.create_checkpoint_store("s3")
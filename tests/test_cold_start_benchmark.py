@@ -0,0 +1,20 @@
+import cold_start_benchmark as bench
+
+def sample(total):
+    return {"import_ms": 1.0, "init_ms": 0.0, "first_event_ms": 2.0, "warm_event_ms": 0.5, "cold_total_ms": total}
+
+def test_percentile_picks_the_nearest_rank():
+    values = list(range(1, 101))
+    assert bench.percentile(values, 50) == 50
+    assert bench.percentile(values, 95) == 95
+    assert bench.percentile([7], 95) == 7
+
+def test_summary_reports_the_measured_cold_total():
+    summary = bench.summarize([sample(100.0), sample(300.0), sample(200.0)])
+    assert summary["cold_total_ms"] == {"p50": 200.0, "p95": 300.0}
+    assert set(summary) == {"import_ms", "init_ms", "first_event_ms", "warm_event_ms", "cold_total_ms"}
+
+def test_seed_tweet_is_written_by_the_parent(db):
+    tweet_data = bench.seed_tweet(db, "cold_start_lazy_0")
+    stored = db.collection("scrapcast_tweets").document("cold_start_lazy_0").get().to_dict()
+    assert stored == tweet_data
@@ -0,0 +1,73 @@
+import signal
+from types import SimpleNamespace
+
+import pytest
+
+import tweet_watcher as tw
+
+class StoppingEvent:
+    """Records each wait and stops the daemon after the given number of polls."""
+
+    def __init__(self, polls):
+        self.polls = polls
+        self.waits = []
+        self._set = False
+
+    def is_set(self):
+        return self._set
+
+    def set(self):
+        self._set = True
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        if len(self.waits) >= self.polls:
+            self._set = True
+
+@pytest.fixture
+def daemon(monkeypatch):
+    def run(outcomes, rate_limited=0.0):
+        """outcomes: new tweet counts (or exceptions to raise) of each poll"""
+        event = StoppingEvent(len(outcomes))
+        polls = iter(outcomes)
+        handlers = {}
+
+        def search_recent_tweets():
+            outcome = next(polls)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        monkeypatch.setattr(tw, "threading", SimpleNamespace(Event=lambda: event))
+        monkeypatch.setattr(tw, "signal", SimpleNamespace(signal=handlers.__setitem__, Signals=signal.Signals,
+                                                          SIGTERM=signal.SIGTERM, SIGINT=signal.SIGINT))
+        monkeypatch.setattr(tw, "search_recent_tweets", search_recent_tweets)
+        monkeypatch.setattr(tw, "retry_failed_summaries", lambda: 0)
+        monkeypatch.setattr(tw, "_rate_limited_interval", lambda: rate_limited)
+        monkeypatch.setattr(tw.metrics, "export", lambda: None)
+        monkeypatch.setattr(tw.shard_leases, "release", lambda: None)
+        tw.run_daemon(min_interval=10, max_interval=60)
+        return event.waits, handlers
+    return run
+
+def test_interval_backs_off_while_idle_and_resets_on_new_tweets(daemon, monkeypatch):
+    monkeypatch.setattr(tw, "POLL_BACKOFF_FACTOR", 2)
+    waits, _ = daemon([0, 0, 0, 0, 3, 0])
+    assert waits == [20, 40, 60, 60, 10, 20]
+
+def test_rate_limit_stretches_the_interval(daemon):
+    waits, _ = daemon([5], rate_limited=90.0)
+    assert waits == [90.0]
+
+def test_poll_errors_do_not_stop_the_daemon(daemon, monkeypatch):
+    monkeypatch.setattr(tw, "POLL_BACKOFF_FACTOR", 2)
+    waits, _ = daemon([RuntimeError("boom"), 1])
+    assert waits == [20, 10]
+
+def test_termination_signal_stops_after_the_current_poll(daemon):
+    _, handlers = daemon([0])
+    assert set(handlers) == {signal.SIGTERM, signal.SIGINT}
+
+def test_interval_is_spread_over_the_remaining_searches(monkeypatch):
+    monkeypatch.setattr(tw.http_client, "rate_limit", lambda host: (9, tw.time.time() + 900))
+    monkeypatch.setattr(tw, "SEARCH_SHARDS", {"a": "q", "b": "q"})
+    assert 199 < tw._rate_limited_interval() <= 200
@@ -0,0 +1,55 @@
+import pytest
+
+import tweet_watcher as tw
+
+@pytest.fixture
+def saved_tweets(db, monkeypatch):
+    """Saves tweets 1000..1999 and resets the watcher's Bloom filter."""
+    monkeypatch.setattr(tw, "seen_tweet_filter", None)
+    for tweet_id in range(1000, 2000):
+        db.collection("scrapcast_tweets").document(tw.tweet_document_key(str(tweet_id))).set({
+            "id": str(tweet_id),
+            "text": "本文",
+        })
+    return db
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = tw.BloomFilter(capacity=1000)
+    keys = [str(1_700_000_000_000_000_000 + i) for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+def test_bloom_filter_false_positive_rate_stays_near_target():
+    bloom = tw.BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"saved-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+def test_warm_filter_loads_every_saved_tweet(saved_tweets):
+    tw.warm_seen_tweet_filter(enabled=True)
+    assert all(str(tweet_id) in tw.seen_tweet_filter for tweet_id in range(1000, 2000))
+
+def test_old_saved_tweet_is_still_detected_after_warm_up(saved_tweets):
+    tw.warm_seen_tweet_filter(enabled=True)
+    assert tw.filter_processed_tweet_ids(["1000", "1999", "5000"]) == {"1000", "1999"}
+
+def test_filter_misses_skip_firestore(saved_tweets):
+    tw.warm_seen_tweet_filter(enabled=True)
+    calls = saved_tweets.get_all_calls
+    assert tw.filter_processed_tweet_ids(["new-1", "new-2"]) == set()
+    assert saved_tweets.get_all_calls == calls
+
+def test_false_positive_is_confirmed_with_firestore(saved_tweets, monkeypatch):
+    tw.warm_seen_tweet_filter(enabled=True)
+    monkeypatch.setattr(tw.BloomFilter, "__contains__", lambda self, key: True)
+    assert tw.filter_processed_tweet_ids(["1500", "9999"]) == {"1500"}
+
+def test_processed_tweets_are_added_to_filter(saved_tweets):
+    tw.warm_seen_tweet_filter(enabled=True)
+    tw.mark_tweets_processed(["3000"])
+    assert "3000" in tw.seen_tweet_filter
+
+def test_without_filter_every_id_is_checked(saved_tweets):
+    assert tw.filter_processed_tweet_ids(["1234", "7777"]) == {"1234"}
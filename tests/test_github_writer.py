@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+
+import github_writer
+from github_writer import GitHubMarkdownWriter
+from reply_dispatcher import REPLY_OUTBOX_COLLECTION
+from retry_scheduler import WORKER_ID
+from test_http_client import make_response
+
+SETTINGS = {"github_owner": "alice", "github_repo": "notes", "github_file_path": "scrapcast.md"}
+
+@pytest.fixture
+def writer(db):
+    writer = GitHubMarkdownWriter(db, token="test-token", window_seconds=0)
+    writer._default_branches[("alice", "notes")] = "main"
+    return writer
+
+def leased_tweets(db, count):
+    tweet_ids = [f"{index:04x}_{1800000000000000000 + index}" for index in range(count)]
+    for tweet_id in tweet_ids:
+        db.collection("scrapcast_tweets").document(tweet_id).set({
+            "id": tweet_id.partition("_")[2],
+            "processing_status": {
+                "retry_stage": "github",
+                "lease_owner": WORKER_ID,
+                "next_retry_at": datetime.now(timezone.utc) + timedelta(minutes=10),
+            },
+        })
+    return tweet_ids
+
+def test_append_separates_entries_with_blank_lines():
+    assert GitHubMarkdownWriter._append("", ["a\n", "b"]) == "a\n\nb\n"
+    assert GitHubMarkdownWriter._append("old\n\n\n", ["new"]) == "old\n\nnew\n"
+
+def test_active_shard_rolls_over_when_full(monkeypatch):
+    monkeypatch.setattr(github_writer, "GITHUB_SHARD_MAX_BYTES", 100)
+    writer = GitHubMarkdownWriter(None, token="test-token")
+    shards = [{"name": "2024-06.md", "size": 90}, {"name": "2024-05.md", "size": 10}]
+    assert writer._active_shard(shards, "2024-06", 20) == ("2024-06-2.md", 0, True)
+    assert writer._active_shard(shards, "2024-06", 5) == ("2024-06.md", 90, False)
+    assert writer._active_shard(shards, "2024-07", 5) == ("2024-07.md", 0, True)
+
+def test_index_lists_newest_shard_first():
+    writer = GitHubMarkdownWriter(None, token="test-token")
+    index = writer._render_index("notes/scrapcast.md", ["2024-05.md", "2024-06.md", "2024-06-2.md", "archive.md"])
+    links = [line for line in index.splitlines() if line.startswith("- ")]
+    assert links == [
+        "- [2024-06-2](scrapcast/2024-06-2.md)",
+        "- [2024-06](scrapcast/2024-06.md)",
+        "- [2024-05](scrapcast/2024-05.md)",
+        "- [archive](scrapcast/archive.md)",
+    ]
+
+def test_mark_saved_splits_writes_into_batches_of_500(db, writer):
+    tweet_ids = leased_tweets(db, 400)
+    replies = {tweet_id: {"tweet_id": tweet_id.partition("_")[2], "author_username": "alice"}
+               for tweet_id in tweet_ids}
+    writer._mark_saved(tweet_ids, "alice", "notes", "scrapcast.md", "abc123", replies)
+    assert db.commits == 2
+    for tweet_id in tweet_ids:
+        status = db.collection("scrapcast_tweets").document(tweet_id).get().to_dict()["processing_status"]
+        assert status["saved_to_github"] is True
+        assert "lease_owner" not in status
+        assert db.collection(REPLY_OUTBOX_COLLECTION).document(tweet_id).get().exists
+
+def test_flush_commits_once_and_marks_every_tweet_saved(db, writer, monkeypatch):
+    tweet_ids = leased_tweets(db, 3)
+    commits = []
+    monkeypatch.setattr(writer, "_commit_entries",
+                        lambda owner, repo, path, layout, entries, tweet_ids: commits.append(entries) or ("sha1", path))
+    for tweet_id in tweet_ids:
+        writer.add(tweet_id, SETTINGS, f"summary {tweet_id}")
+    assert writer.flush() == {("alice", "notes", "scrapcast.md"): tweet_ids}
+    assert len(commits) == 1 and len(commits[0]) == 3
+
+def test_completion_reply_carries_the_summary_title(db, writer, monkeypatch):
+    tweet_id = leased_tweets(db, 1)[0]
+    monkeypatch.setattr(writer, "_commit_entries",
+                        lambda owner, repo, path, layout, entries, tweet_ids: ("sha1", path))
+    writer.add(tweet_id, SETTINGS, "### 2024-06-01 12:00 生成AIの最新動向\n要約",
+               {"tweet_id": tweet_id.partition("_")[2], "author_username": "alice"})
+    writer.flush()
+    assert db.collection(REPLY_OUTBOX_COLLECTION).document(tweet_id).get().to_dict()["title"] == "生成AIの最新動向"
+
+def test_flush_drops_entries_whose_lease_was_taken_over(db, writer, monkeypatch):
+    tweet_ids = leased_tweets(db, 2)
+    db.collection("scrapcast_tweets").document(tweet_ids[0]).update({"processing_status.lease_owner": "other"})
+    monkeypatch.setattr(writer, "_commit_entries",
+                        lambda owner, repo, path, layout, entries, tweet_ids: ("sha1", path))
+    for tweet_id in tweet_ids:
+        writer.add(tweet_id, SETTINGS, "summary")
+    assert writer.flush() == {("alice", "notes", "scrapcast.md"): [tweet_ids[1]]}
+
+def test_lost_status_write_after_a_commit_never_appends_again(db, writer, monkeypatch):
+    tweet_ids = leased_tweets(db, 2)
+    commits = []
+
+    def commit_entries(owner, repo, path, layout, entries, tweet_ids):
+        # _try_commit records the commit on each tweet before it moves the branch
+        writer._mark_committing(tweet_ids, owner, repo, path, "sha1")
+        commits.append(entries)
+        return "sha1", path
+
+    def failing_mark_saved(*args, **kwargs):
+        raise RuntimeError("firestore unavailable")
+
+    monkeypatch.setattr(github_writer.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(writer, "_commit_entries", commit_entries)
+    monkeypatch.setattr(writer, "_mark_saved", failing_mark_saved)
+    for tweet_id in tweet_ids:
+        writer.add(tweet_id, SETTINGS, "summary")
+    writer.flush()
+    status = db.collection("scrapcast_tweets").document(tweet_ids[0]).get().to_dict()["processing_status"]
+    assert "retry_count" not in status and "error" not in status
+    assert status["github_pending_commit"]["sha"] == "sha1"
+
+    # The lease runs out and the retry scheduler re-runs the stage
+    monkeypatch.setattr(GitHubMarkdownWriter, "_commit_entries",
+                        lambda self, *args: pytest.fail("the summaries were already committed"))
+    monkeypatch.setattr(GitHubMarkdownWriter, "_commit_landed", lambda self, owner, repo, sha: sha == "sha1")
+    monkeypatch.setattr(GitHubMarkdownWriter, "_default_branch", lambda self, owner, repo: "main")
+    snapshots = [db.collection("scrapcast_tweets").document(tweet_id).get() for tweet_id in tweet_ids]
+    main.retry_github_saves(db, snapshots)
+    assert len(commits) == 1
+    for tweet_id in tweet_ids:
+        status = db.collection("scrapcast_tweets").document(tweet_id).get().to_dict()["processing_status"]
+        assert status["saved_to_github"] is True and status["github_commit"] == "sha1"
+        assert "github_pending_commit" not in status
+
+def test_commit_that_never_landed_is_appended_again(db, writer, monkeypatch):
+    monkeypatch.setattr(writer, "_request", lambda method, path, **kwargs: make_response(404))
+    assert writer.recover_committed("t1", {"sha": "lost", "owner": "alice", "repo": "notes", "path": "x.md"}) is False
@@ -0,0 +1,85 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main
+
+TWEET_ID = "ab12_1800000000000000000"
+
+@pytest.fixture
+def tweet(db):
+    data = {
+        "id": "1800000000000000000",
+        "url": "https://twitter.com/alice/status/1800000000000000000",
+        "author_username": "alice",
+        "summary": "2024-06-01 12:00 タイトル\n要約",
+        "processing_status": {"retry_stage": "github", "next_retry_at": datetime.now(timezone.utc)},
+    }
+    db.collection("scrapcast_tweets").document(TWEET_ID).set(data)
+    return data
+
+def stored(db):
+    return db.collection("scrapcast_tweets").document(TWEET_ID).get().to_dict()
+
+def test_duration_covers_the_github_save(db, tweet, monkeypatch):
+    def slow_save(db, tweet_id, tweet_data, github_writer=None):
+        time.sleep(0.05)
+        return True
+
+    monkeypatch.setattr(main, "queue_github_save", slow_save)
+    main.handle_tweet_data(db, TWEET_ID, tweet)
+    status = stored(db)["processing_status"]
+    assert status["started"] is True
+    assert status["durations_ms"]["handle_tweet_data"] >= 50
+
+def test_nothing_to_save_completes_the_stage_with_its_duration(db, tweet):
+    # alice has no scrapcast_users settings, so there is nothing to save
+    main.handle_tweet_data(db, TWEET_ID, tweet)
+    status = stored(db)["processing_status"]
+    assert "retry_stage" not in status
+    assert "lease_owner" not in status
+    assert "handle_tweet_data" in status["durations_ms"]
+
+def test_stage_leased_by_another_worker_is_skipped(db, tweet, monkeypatch):
+    db.collection("scrapcast_tweets").document(TWEET_ID).update({
+        "processing_status.lease_owner": "other-worker",
+        "processing_status.next_retry_at": datetime.now(timezone.utc) + timedelta(minutes=5),
+    })
+    calls = []
+    monkeypatch.setattr(main, "queue_github_save", lambda *args, **kwargs: calls.append(args) or True)
+    main.handle_tweet_data(db, TWEET_ID, tweet)
+    assert calls == []
+    assert "started" not in stored(db)["processing_status"]
+
+def test_migrated_copy_is_skipped(db, tweet, monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "claim_stage", lambda *args, **kwargs: calls.append(args))
+    main.handle_tweet_data(db, TWEET_ID, {**tweet, "migrated_from": "1800000000000000000"})
+    assert calls == []
+
+def test_cancelled_run_stops_before_its_next_write(db, tweet, monkeypatch):
+    cancelled = threading.Event()
+    calls = []
+
+    def timed_out_save(db, tweet_id, tweet_data, github_writer=None):
+        calls.append(tweet_id)
+        # The local runner gives up on the run while the save is still in progress
+        cancelled.set()
+        return False
+
+    monkeypatch.setattr(main, "queue_github_save", timed_out_save)
+    main.handle_tweet_data(db, TWEET_ID, tweet, cancelled=cancelled)
+    status = stored(db)["processing_status"]
+    assert calls == [TWEET_ID]
+    assert "durations_ms" not in status
+    # The stage was not completed, so its lease runs out and the retry scheduler picks it up
+    assert status["retry_stage"] == "github"
+
+def test_already_cancelled_run_writes_nothing(db, tweet, monkeypatch):
+    cancelled = threading.Event()
+    cancelled.set()
+    monkeypatch.setattr(main, "queue_github_save", lambda *args, **kwargs: pytest.fail("must not save"))
+    main.handle_tweet_data(db, TWEET_ID, tweet, cancelled=cancelled)
+    assert "started" not in stored(db)["processing_status"]
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+import requests
+
+import tweet_watcher as tw
+from test_http_client import FakeSession, make_response
+
+def test_request_key_ignores_secrets_and_volatile_params():
+    key = tw.HttpCassette._request_key("GET", "https://api.example.com/search?key=secret&q=a",
+                                       {"since_id": "1", "max_results": 10})
+    assert key == "GET https://api.example.com/search?max_results=10&q=a"
+
+def test_request_key_distinguishes_bodies():
+    first = tw.HttpCassette._request_key("POST", "https://api.example.com/x", body={"a": 1, "b": 2})
+    same = tw.HttpCassette._request_key("POST", "https://api.example.com/x", body={"b": 2, "a": 1})
+    other = tw.HttpCassette._request_key("POST", "https://api.example.com/x", body={"a": 2})
+    assert first == same != other
+
+def cassette_client(mode, path, outcomes=()):
+    client = tw.HttpClient(cassette=tw.HttpCassette(mode=mode, path=str(path), simulate_latency=False),
+                           max_retries=0)
+    session = FakeSession(outcomes)
+    client._session = lambda host: session
+    return client, session
+
+def test_responses_are_replayed_in_recorded_order(tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    recorder, _ = cassette_client("record", path, [make_response(200, body="first"), make_response(200, body="second")])
+    recorder.get("https://api.example.com/x?key=secret")
+    recorder.get("https://api.example.com/x?key=secret")
+    assert "secret" not in path.read_text()
+
+    player, session = cassette_client("replay", path)
+    assert [player.get("https://api.example.com/x").text for _ in range(3)] == ["first", "second", "second"]
+    assert session.calls == []
+
+def test_failed_requests_are_recorded_and_raised_again_on_replay(tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    recorder, _ = cassette_client("record", path, [
+        requests.ConnectionError("Max retries exceeded with url: /v1/x?key=secret (refused)"),
+        requests.Timeout("read timed out")])
+    with pytest.raises(requests.ConnectionError):
+        recorder.post("https://api.example.com/x", json={"n": 1})
+    with pytest.raises(requests.Timeout):
+        recorder.post("https://api.example.com/x", json={"n": 2})
+    assert "secret" not in path.read_text()
+    assert json.loads(path.read_text().splitlines()[0])["error"]["type"] == "ConnectionError"
+
+    player, _ = cassette_client("replay", path)
+    with pytest.raises(requests.ConnectionError, match="key=\\*\\*\\*"):
+        player.post("https://api.example.com/x", json={"n": 1})
+    with pytest.raises(requests.Timeout):
+        player.post("https://api.example.com/x", json={"n": 2})
+
+def test_unrecorded_request_fails_on_replay(tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    path.write_text("")
+    player, _ = cassette_client("replay", path)
+    with pytest.raises(LookupError):
+        player.get("https://api.example.com/unknown")
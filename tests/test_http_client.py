@@ -0,0 +1,93 @@
+import time
+
+import pytest
+import requests
+
+import tweet_watcher as tw
+
+class FakeSession:
+    """Returns the queued responses (or raises the queued exceptions) in order."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+def make_response(status, headers=None, body="", url="https://api.example.com/x"):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response.url = url
+    response._content = body.encode("utf-8")
+    return response
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(tw.time, "sleep", slept.append)
+    return slept
+
+def make_client(outcomes, **options):
+    client = tw.HttpClient(cassette=tw.HttpCassette(mode=""), max_retries=3, **options)
+    session = FakeSession(outcomes)
+    client._session = lambda host: session
+    return client, session
+
+def test_get_is_retried_after_server_error(sleeps):
+    client, session = make_client([make_response(503), make_response(200)])
+    assert client.get("https://api.example.com/x").status_code == 200
+    assert len(session.calls) == 2
+
+def test_post_is_not_retried_after_server_error(sleeps):
+    client, session = make_client([make_response(502), make_response(200)])
+    assert client.post("https://api.example.com/x", json={}).status_code == 502
+    assert len(session.calls) == 1
+
+def test_post_is_not_retried_after_timeout(sleeps):
+    client, session = make_client([requests.Timeout("slow"), make_response(200)])
+    with pytest.raises(requests.Timeout):
+        client.post("https://api.example.com/x", json={})
+    assert len(session.calls) == 1
+
+def test_post_is_retried_when_caller_opts_in(sleeps):
+    client, session = make_client([make_response(500), make_response(204)])
+    assert client.patch("https://api.example.com/x", json={}, idempotent=True).status_code == 204
+    assert "idempotent" not in session.calls[0][2]
+
+def test_post_is_retried_after_429(sleeps):
+    client, session = make_client([make_response(429, {"Retry-After": "2"}), make_response(200)])
+    assert client.post("https://api.example.com/x", json={}).status_code == 200
+    assert sleeps == [2.0]
+
+def test_github_primary_rate_limit_403_waits_for_reset(sleeps, monkeypatch):
+    monkeypatch.setattr(tw.time, "time", lambda: 1000.0)
+    limited = make_response(403, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": "1030"})
+    client, session = make_client([limited, make_response(204)])
+    assert client.patch("https://api.github.com/x", json={}).status_code == 204
+    assert 31.0 in sleeps
+
+def test_plain_403_is_returned(sleeps):
+    client, session = make_client([make_response(403, {"x-ratelimit-remaining": "4999"})])
+    assert client.get("https://api.github.com/x").status_code == 403
+    assert len(session.calls) == 1
+
+def test_gives_up_after_max_retries(sleeps):
+    client, session = make_client([make_response(503)] * 4)
+    assert client.get("https://api.example.com/x").status_code == 503
+    assert len(session.calls) == 4
+
+def test_backoff_is_bounded(monkeypatch):
+    client = tw.HttpClient(cassette=tw.HttpCassette(mode=""), backoff_base=1.0, backoff_max=5.0)
+    assert all(0 <= client._backoff(attempt) <= 5.0 for attempt in range(10))
+
+def test_retry_after_http_date_is_honoured(sleeps):
+    retry_at = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 60))
+    client, _ = make_client([make_response(429, {"Retry-After": retry_at})])
+    delay = client._retry_delay("api.example.com", make_response(429, {"Retry-After": retry_at}), 0)
+    assert 55 <= delay <= 61
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+import local_function_runner as runner
+
+class Handlers:
+    """Handler that blocks until released and records what it was asked to do."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = []
+        self.finished = []
+        self.timed_out = []
+        self.writes = []
+        self._lock = threading.Lock()
+
+    def handle(self, doc_id, doc_data, cancelled):
+        with self._lock:
+            self.started.append(doc_id)
+        self.release.wait(5)
+        # A late finisher checks its cancelled flag before writing, like handle_tweet_data
+        if not cancelled.is_set():
+            with self._lock:
+                self.writes.append(doc_id)
+        with self._lock:
+            self.finished.append(doc_id)
+
+    def on_timeout(self, doc_id):
+        self.timed_out.append(doc_id)
+
+@pytest.fixture
+def handlers():
+    handlers = Handlers()
+    yield handlers
+    handlers.release.set()
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_full_queue_blocks_the_listener(handlers):
+    pool = runner.DocumentWorkerPool(handlers.handle, handlers.on_timeout, worker_count=1, queue_size=1, timeout=5)
+    pool.submit("1", {})
+    assert wait_for(lambda: handlers.started == ["1"])
+    pool.submit("2", {})  # waits in the queue while the only worker is busy
+
+    submitted = threading.Event()
+    threading.Thread(target=lambda: (pool.submit("3", {}), submitted.set()), daemon=True).start()
+    assert not submitted.wait(0.2)
+
+    handlers.release.set()
+    assert submitted.wait(2)
+    assert pool.drain(2)
+    assert handlers.finished == ["1", "2", "3"]
+    pool.stop()
+
+def test_timed_out_handler_is_abandoned_and_cannot_write(handlers):
+    pool = runner.DocumentWorkerPool(handlers.handle, handlers.on_timeout, worker_count=1, queue_size=5,
+                                     timeout=0.1)
+    pool.submit("slow", {})
+    assert wait_for(lambda: handlers.timed_out == ["slow"])
+    # The worker moved on while the abandoned handler still holds its slot
+    handlers.release.set()
+    assert wait_for(lambda: handlers.finished == ["slow"])
+    assert handlers.writes == []
+    pool.stop()
+
+def test_abandoned_handlers_hold_their_slots(handlers):
+    # One worker has two slots: after two timeouts it cannot start a third document
+    pool = runner.DocumentWorkerPool(handlers.handle, handlers.on_timeout, worker_count=1, queue_size=5,
+                                     timeout=0.05)
+    for doc_id in ("1", "2", "3"):
+        pool.submit(doc_id, {})
+    assert wait_for(lambda: handlers.timed_out == ["1", "2"])
+    time.sleep(0.1)
+    assert handlers.started == ["1", "2"]
+    handlers.release.set()
+    assert wait_for(lambda: "3" in handlers.finished)
+    pool.stop()
+
+def test_drain_waits_for_queued_documents(handlers):
+    pool = runner.DocumentWorkerPool(handlers.handle, handlers.on_timeout, worker_count=1, queue_size=5, timeout=5)
+    pool.submit("1", {})
+    pool.submit("2", {})
+    assert pool.drain(0.1) is False
+    assert pool.unfinished == 2
+    handlers.release.set()
+    assert pool.drain(2) is True
+    assert handlers.finished == ["1", "2"]
+    pool.stop()
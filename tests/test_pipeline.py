@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+import tweet_watcher as tw
+
+@pytest.fixture
+def stages(monkeypatch):
+    calls = {"analyzed": [], "persisted": [], "durations_ms": {}}
+    lock = threading.Lock()
+
+    def build_tweet_context(tweet, referenced_tweets=None, users=None):
+        return {"tweet_id": tweet["id"], "quoted_tweet_id": tweet.get("quoted"), "durations_ms": {}}
+
+    def analyze(contexts):
+        with lock:
+            calls["analyzed"].append([context["tweet_id"] for context in contexts])
+
+    def persist(contexts):
+        with lock:
+            calls["persisted"].extend(context["tweet_id"] for context in contexts)
+            calls["durations_ms"].update((context["tweet_id"], context["durations_ms"]) for context in contexts)
+        return {context["tweet_id"]: context["tweet_id"] != "bad" for context in contexts}
+
+    monkeypatch.setattr(tw, "filter_processed_tweet_ids", lambda tweet_ids: {"old"} & set(tweet_ids))
+    monkeypatch.setattr(tw, "build_tweet_context", build_tweet_context)
+    monkeypatch.setattr(tw, "resolve_context_urls", lambda contexts: None)
+    monkeypatch.setattr(tw, "analyze_tweet_contexts", analyze)
+    monkeypatch.setattr(tw, "persist_tweet_contexts", persist)
+    return calls
+
+def test_results_come_back_in_fetch_order(stages):
+    with tw.TweetPipeline(analyze_workers=2, persist_workers=2, batch_size=10) as pipeline:
+        pipeline.submit_page([{"id": "5"}, {"id": "old"}, {"id": "bad"}])
+        pipeline.submit_page([{"id": "3"}])
+        results = pipeline.drain()
+    assert results == [("5", True), ("old", True), ("bad", False), ("3", True)]
+    assert "old" not in stages["persisted"]
+
+def test_tweets_quoting_the_same_tweet_are_analyzed_together(stages):
+    with tw.TweetPipeline(batch_size=1) as pipeline:
+        pipeline.submit_page([{"id": "1", "quoted": "q"}, {"id": "2", "quoted": "r"}, {"id": "3", "quoted": "q"}])
+        pipeline.drain()
+    assert sorted(stages["analyzed"]) == [["1", "3"], ["2"]]
+
+def test_a_failing_page_fails_only_its_own_tweets(stages, monkeypatch):
+    def persist(contexts):
+        if contexts[0]["tweet_id"] == "9":
+            raise RuntimeError("boom")
+        return {context["tweet_id"]: True for context in contexts}
+    monkeypatch.setattr(tw, "persist_tweet_contexts", persist)
+    with tw.TweetPipeline() as pipeline:
+        pipeline.submit_page([{"id": "9"}])
+        pipeline.submit_page([{"id": "8"}])
+        assert pipeline.drain() == [("9", False), ("8", True)]
+
+def test_stage_durations_are_recorded_on_each_tweet(stages):
+    with tw.TweetPipeline() as pipeline:
+        pipeline.submit_page([{"id": "5"}, {"id": "4"}], search_ms=120)
+        pipeline.drain()
+    for tweet_id in ("5", "4"):
+        durations = stages["durations_ms"][tweet_id]
+        assert durations["search"] == 120
+        assert set(durations) == {"search", "dedup", "url_resolve"}
+
+def test_stage_durations_are_saved_with_the_tweet():
+    document = tw.build_tweet_document({"id": "1"}, "someone",
+                                       {"search": 120, "dedup": 3, "url_resolve": 40, "analyze": 900})
+    assert document["processing_status"]["durations_ms"] == {"search": 120, "dedup": 3, "url_resolve": 40,
+                                                             "analyze": 900}
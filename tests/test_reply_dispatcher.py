@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import reply_dispatcher
+from reply_dispatcher import (REPLY_MAX_WEIGHT, REPLY_OUTBOX_COLLECTION, ReplyDispatcher, TokenBucket, build_reply_text,
+                              outbox_entry, reply_weight, summary_title)
+from test_http_client import make_response
+
+class FakePostSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(kwargs["json"])
+        return self.responses.pop(0)
+
+def test_bucket_allows_the_burst_then_refills(db, monkeypatch):
+    bucket = TokenBucket(db, limit=1, window_seconds=60, burst=2)
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+    later = datetime.now(timezone.utc) + timedelta(seconds=61)
+    monkeypatch.setattr(reply_dispatcher, "datetime", type("FrozenDatetime", (datetime,), {
+        "now": staticmethod(lambda tz=None: later)}))
+    assert bucket.try_acquire() is True
+
+def test_exhausted_bucket_has_no_tokens_until_the_reset(db):
+    bucket = TokenBucket(db, burst=3)
+    bucket.exhaust_until(datetime.now(timezone.utc) + timedelta(minutes=15))
+    assert bucket.try_acquire() is False
+
+def test_reply_text_differs_between_saves_to_the_same_file():
+    saved_at = datetime(2024, 6, 1, 3, 0, tzinfo=timezone.utc)
+    saved = [("記事", "https://github.com/a/notes/blob/main/2024-06-01.md")]
+    first = build_reply_text(saved, saved_at)
+    second = build_reply_text(saved, saved_at + timedelta(seconds=1))
+    assert first != second
+    assert "2024-06-01 12:00:00 JST" in first
+
+FILE_URL = "https://github.com/a/notes/blob/main/2024-06-01.md"
+SAVED_AT = datetime(2024, 6, 1, 3, 0, tzinfo=timezone.utc)
+
+def test_reply_text_lists_each_saved_title():
+    text = build_reply_text([("生成AIの最新動向", FILE_URL), ("1800000000000000001", FILE_URL)], SAVED_AT)
+    assert text.splitlines() == [
+        "✅ 2件保存しました！",
+        "・生成AIの最新動向",
+        "・1800000000000000001",
+        "こちらに追加しました👇",
+        FILE_URL,
+        "🕒 2024-06-01 12:00:00 JST",
+    ]
+
+def test_long_titles_are_cut():
+    text = build_reply_text([("あ" * 100, FILE_URL)], SAVED_AT)
+    line = text.splitlines()[1]
+    assert line.endswith("…")
+    assert len(line) == 1 + reply_dispatcher.REPLY_TITLE_MAX_CHARS
+
+def test_titles_that_do_not_fit_are_counted():
+    saved = [(f"とても長い記事のタイトル その{index} " + "あ" * 30, f"{FILE_URL}?{index % 3}") for index in range(20)]
+    text = build_reply_text(saved, SAVED_AT)
+    lines = text.splitlines()
+    assert reply_weight(lines) <= REPLY_MAX_WEIGHT
+    listed = [line for line in lines if line.startswith("・") and "ほか" not in line]
+    assert 0 < len(listed) < 20
+    assert f"・ほか{20 - len(listed)}件" in lines
+
+def test_reply_weight_counts_urls_and_wide_characters():
+    assert reply_weight(["abc"]) == 3
+    assert reply_weight(["保存"]) == 4
+    assert reply_weight(["abc", FILE_URL]) == 3 + 1 + 23
+
+def test_summary_title_drops_the_heading_and_time():
+    assert summary_title("### 2024-06-01 12:00 生成AIの最新動向\n要約") == "生成AIの最新動向"
+    assert summary_title("2024-06-01 12:00 タイトル\n要約") == "タイトル"
+    assert summary_title("") is None
+
+@pytest.fixture
+def outbox(db):
+    created_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    for tweet_id in ("101", "102"):
+        # 101 has a title; 102 was queued before titles were stored
+        entry = outbox_entry(f"ab12_{tweet_id}", tweet_id, "alice", "https://github.com/a/notes/blob/main/x.md",
+                             "記事A" if tweet_id == "101" else None)
+        entry.update({"created_at": created_at, "next_attempt_at": created_at})
+        db.collection(REPLY_OUTBOX_COLLECTION).document(f"ab12_{tweet_id}").set(entry)
+        db.collection("scrapcast_tweets").document(f"ab12_{tweet_id}").set({"id": tweet_id})
+    return db
+
+def make_dispatcher(db, responses):
+    dispatcher = ReplyDispatcher(db, token="user-token", bucket=TokenBucket(db, burst=5))
+    dispatcher._session = FakePostSession(responses)
+    return dispatcher
+
+def entry_status(db, tweet_id):
+    return db.collection(REPLY_OUTBOX_COLLECTION).document(f"ab12_{tweet_id}").get().to_dict()["status"]
+
+def test_one_reply_per_user_to_the_newest_mention(outbox):
+    dispatcher = make_dispatcher(outbox, [make_response(201, body='{"data": {"id": "900"}}')])
+    assert dispatcher.dispatch() == 1
+    post = dispatcher._session.posts[0]
+    assert post["reply"]["in_reply_to_tweet_id"] == "102"
+    assert post["text"].startswith("✅ 2件保存しました！\n・記事A\n・102\n")
+    tweet = outbox.collection("scrapcast_tweets").document("ab12_101").get().to_dict()
+    assert tweet["processing_status"]["reply_tweet_id"] == "900"
+
+def test_duplicate_content_is_not_retried(outbox):
+    duplicate = make_response(403, body='{"detail": "You are not allowed to create a Tweet with duplicate content."}')
+    dispatcher = make_dispatcher(outbox, [duplicate])
+    dispatcher.dispatch()
+    assert entry_status(outbox, "101") == entry_status(outbox, "102") == "sent"
+    assert make_dispatcher(outbox, []).dispatch() == 0
+
+def test_other_errors_are_retried_later(outbox):
+    dispatcher = make_dispatcher(outbox, [make_response(503, body="unavailable")])
+    dispatcher.dispatch()
+    entry = outbox.collection(REPLY_OUTBOX_COLLECTION).document("ab12_101").get().to_dict()
+    assert (entry["status"], entry["attempts"]) == ("pending", 1)
+    assert entry["next_attempt_at"] > datetime.now(timezone.utc)
+
+def test_recent_saves_wait_for_the_group_window(outbox):
+    for tweet_id in ("101", "102"):
+        outbox.collection(REPLY_OUTBOX_COLLECTION).document(f"ab12_{tweet_id}").update(
+            {"created_at": datetime.now(timezone.utc)})
+    dispatcher = make_dispatcher(outbox, [])
+    assert dispatcher.dispatch() == 0
+    assert dispatcher._session.posts == []
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import retry_policy
+import retry_scheduler
+import tweet_watcher as tw
+from retry_policy import DEAD_LETTER_COLLECTION, RETRY_MAX_ATTEMPTS, stage_failure
+
+def test_retry_delay_doubles_with_jitter_up_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: 1.0)
+    assert [retry_policy.retry_delay(n) for n in (1, 2, 3)] == [60.0, 120.0, 240.0]
+    assert retry_policy.retry_delay(20) == retry_policy.RETRY_MAX_SECONDS
+    monkeypatch.undo()
+    assert all(48 <= retry_policy.retry_delay(1) <= 72 for _ in range(100))
+
+def test_failure_of_another_stage_starts_counting_again():
+    failure = stage_failure("doc", {"processing_status": {"retry_stage": "summarize", "retry_count": 3}},
+                            "github", "boom")
+    assert failure.failures == 1
+    assert failure.fields["processing_status.retry_stage"] == "github"
+    assert failure.dead_letter is None
+
+def test_failure_past_the_limit_is_dead_lettered():
+    data = {"id": "123", "processing_status": {"retry_stage": "github", "retry_count": RETRY_MAX_ATTEMPTS}}
+    failure = stage_failure("ab12_123", data, "github", "boom")
+    assert failure.delay is None
+    assert failure.fields["processing_status.dead_lettered"] is True
+    assert failure.dead_letter["tweet_id"] == "123"
+    assert failure.dead_letter["failures"] == RETRY_MAX_ATTEMPTS + 1
+
+def test_watcher_and_functions_share_one_policy():
+    assert tw.retry_delay is retry_policy.retry_delay
+    assert tw.RETRY_MAX_ATTEMPTS == retry_scheduler.RETRY_MAX_ATTEMPTS
+    assert tw.claim_stage is retry_scheduler.claim_stage
+    assert not hasattr(tw, "claim_retry_documents")
+
+@pytest.fixture
+def failed_summary(db):
+    key = tw.tweet_document_key("1800000000000000001")
+    db.collection("scrapcast_tweets").document(key).set({
+        "id": "1800000000000000001",
+        "retry_payload": {
+            "tweet_created_at": datetime(2024, 6, 1, 3, 0).isoformat(),
+            "quoted_tweet_id": "1700000000000000000",
+            "quoted_tweet_text": "引用元の本文",
+            "quoted_tweet_url": "https://twitter.com/bob/status/1700000000000000000",
+            "quoted_urls": [],
+        },
+        "processing_status": {
+            "retry_stage": "summarize",
+            "retry_count": 1,
+            "next_retry_at": datetime.now(timezone.utc) - timedelta(seconds=1),
+        },
+    })
+    return db.collection("scrapcast_tweets").document(key)
+
+def test_failed_summary_retry_is_rescheduled_with_the_shared_fields(failed_summary, monkeypatch):
+    monkeypatch.setattr(tw, "analyze_tweets_batch", lambda items: [(None, None)] * len(items))
+    assert tw.retry_failed_summaries() == 1
+    status = failed_summary.get().to_dict()["processing_status"]
+    assert status["retry_count"] == 2
+    assert status["error"] is True
+    assert status["next_retry_at"] > datetime.now(timezone.utc)
+    assert "lease_owner" not in status
+
+def test_summary_retry_past_the_limit_is_dead_lettered(failed_summary, db, monkeypatch):
+    failed_summary.update({"processing_status.retry_count": RETRY_MAX_ATTEMPTS})
+    monkeypatch.setattr(tw, "analyze_tweets_batch", lambda items: [(None, None)] * len(items))
+    tw.retry_failed_summaries()
+    assert failed_summary.get().to_dict()["processing_status"]["dead_lettered"] is True
+    dead_letter = db.collection(DEAD_LETTER_COLLECTION).document(failed_summary.id).get().to_dict()
+    assert dead_letter["stage"] == "summarize"
+
+def test_successful_summary_retry_hands_over_to_github(failed_summary, monkeypatch):
+    analysis = "### 2024-06-01 12:00 タイトル\n要約\nhttps://twitter.com/bob/status/1700000000000000000"
+    usage = {"provider": "gemini", "model": "m", "latency_ms": 5, "hedged": False}
+    monkeypatch.setattr(tw, "analyze_tweets_batch", lambda items: [(analysis, usage)] * len(items))
+    monkeypatch.setattr(tw.summary_cache, "get_many", lambda ids: {})
+    monkeypatch.setattr(tw.summary_cache, "put_many", lambda values: None)
+    tw.retry_failed_summaries()
+    data = failed_summary.get().to_dict()
+    assert data["summary"].startswith("### 2024-06-01 12:00 タイトル")
+    assert "retry_payload" not in data
+    assert data["processing_status"]["retry_stage"] == "github"
+    assert data["processing_status"]["retry_count"] == 0
+
+def tweet(db, doc_id, **status):
+    db.collection("scrapcast_tweets").document(doc_id).set({"id": doc_id, "processing_status": status})
+    return db.collection("scrapcast_tweets").document(doc_id)
+
+def test_live_lease_of_another_worker_cannot_be_claimed(db):
+    ref = tweet(db, "1", retry_stage="github", lease_owner="other",
+                next_retry_at=datetime.now(timezone.utc) + timedelta(minutes=5))
+    assert retry_policy.claim_stage(db, ref, "github", "me") is None
+    ref.update({"processing_status.next_retry_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    assert retry_policy.claim_stage(db, ref, "github", "me") is not None
+    assert ref.get().to_dict()["processing_status"]["lease_owner"] == "me"
+
+def test_done_or_dead_lettered_stages_are_not_claimed(db):
+    assert retry_policy.claim_stage(db, tweet(db, "1", summarized=True), "summarize", "me") is None
+    assert retry_policy.claim_stage(db, tweet(db, "2", dead_lettered=True), "summarize", "me") is None
+
+def test_failure_is_not_recorded_once_the_lease_was_taken_over(db):
+    ref = tweet(db, "1", retry_stage="github", retry_count=1, lease_owner="new-owner")
+    retry_scheduler.fail_stage(db, ["1"], "github", "boom", owner="old-owner")
+    status = ref.get().to_dict()["processing_status"]
+    assert status["retry_count"] == 1 and status["lease_owner"] == "new-owner"
+    retry_scheduler.fail_stage(db, ["1"], "github", "boom", owner="new-owner")
+    assert ref.get().to_dict()["processing_status"]["retry_count"] == 2
+
+def test_results_are_written_only_for_held_leases(db):
+    tweet(db, "1", retry_stage="summarize", lease_owner="me")
+    tweet(db, "2", retry_stage="summarize", lease_owner="other")
+    written = retry_policy.complete_stage(db, {"1": {"summary": "a"}, "2": {"summary": "b"}}, "summarize", "me")
+    assert written == {"1"}
+    assert "summary" not in db.collection("scrapcast_tweets").document("2").get().to_dict()
+
+def test_large_groups_are_split_into_transactions_within_the_write_limit(db):
+    tweet_ids = [str(n) for n in range(600)]
+    for tweet_id in tweet_ids:
+        tweet(db, tweet_id, retry_stage="github", retry_count=RETRY_MAX_ATTEMPTS, lease_owner="me")
+    assert retry_policy.renew_leases(db, tweet_ids, "github", "me") == set(tweet_ids)
+    failures = retry_policy.record_stage_failures(db, tweet_ids, "github", "boom", "me")
+    assert len(failures) == 600 and all(failure.dead_letter for failure in failures.values())
+
+def test_summarized_tweet_is_scheduled_for_github_in_case_the_trigger_never_runs(db, monkeypatch):
+    tweet_data = tw.build_tweet_document({"id": "1800000000000000002"}, "alice", summary="### 要約")
+    status = tweet_data["processing_status"]
+    assert status["retry_stage"] == "github" and "lease_owner" not in status
+    assert status["next_retry_at"] > datetime.now(timezone.utc) + timedelta(seconds=60)
+    ref = db.collection("scrapcast_tweets").document("ab12_1800000000000000002")
+    ref.set(tweet_data)
+    assert retry_scheduler.find_due_documents(db, "github") == []
+
+    # トリガーは猶予を待たずに確保できる
+    assert retry_policy.claim_stage(db, ref, "github", "trigger") is not None
+
+def test_stalled_github_stage_is_found_after_the_grace_period(db):
+    ref = db.collection("scrapcast_tweets").document("ab12_1800000000000000003")
+    ref.set(tw.build_tweet_document({"id": "1800000000000000003"}, "alice", summary="### 要約"))
+    ref.update({"processing_status.next_retry_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    assert [snapshot.id for snapshot in retry_scheduler.find_due_documents(db, "github")] == [ref.id]
@@ -0,0 +1,33 @@
+import tweet_watcher as tw
+from fake_firestore import WriteBatch
+
+def documents(count):
+    return [{"id": str(1800000000000000000 + n), "text": "t"} for n in range(count)]
+
+def test_documents_are_written_in_batches_within_the_limit(db):
+    docs = documents(tw.FIRESTORE_BATCH_LIMIT + 20)
+    results = tw.save_tweets_to_firestore(docs)
+    assert all(results.values()) and len(results) == len(docs)
+    assert db.commits == 2
+    assert db.collection("scrapcast_tweets").document(tw.tweet_document_key(docs[-1]["id"])).get().exists
+
+def test_failed_batch_is_retried_one_document_at_a_time(db, monkeypatch):
+    def failing_commit(self):
+        raise RuntimeError("batch rejected")
+    monkeypatch.setattr(WriteBatch, "commit", failing_commit)
+    docs = documents(3)
+    assert tw.save_tweets_to_firestore(docs) == {doc["id"]: True for doc in docs}
+    assert db.collection("scrapcast_tweets").document(tw.tweet_document_key(docs[0]["id"])).get().exists
+
+def test_every_caller_shares_one_client(db):
+    assert tw.initialize_firebase() is tw.initialize_firebase() is db
+
+def test_already_saved_tweet_is_not_overwritten(db):
+    saved, new = documents(2)
+    key = tw.tweet_document_key(saved["id"])
+    db.collection("scrapcast_tweets").document(key).set(
+        {**saved, "processing_status": {"saved_to_github": True}})
+    # 重複チェックが失敗して、保存済みのツイートがもう一度届いた
+    assert tw.save_tweets_to_firestore([saved, new]) == {saved["id"]: True, new["id"]: True}
+    assert db.collection("scrapcast_tweets").document(key).get().to_dict()["processing_status"]["saved_to_github"]
+    assert db.collection("scrapcast_tweets").document(tw.tweet_document_key(new["id"])).get().exists
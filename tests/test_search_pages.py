@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+import tweet_watcher as tw
+from test_http_client import make_client, make_response
+
+def page(tweet_ids, next_token=None):
+    body = {
+        "data": [{"id": tweet_id, "text": "t", "author_id": "9", "created_at": "2024-06-01T03:00:00.000Z"}
+                 for tweet_id in tweet_ids],
+        "includes": {"users": [{"id": "9", "username": "alice"}]},
+        "meta": {"next_token": next_token} if next_token else {},
+    }
+    return make_response(200, body=json.dumps(body))
+
+@pytest.fixture
+def search(monkeypatch):
+    def install(responses):
+        client, session = make_client(responses)
+        monkeypatch.setattr(tw, "http_client", client)
+        return session
+    return install
+
+def test_every_page_after_since_id_is_fetched(search):
+    session = search([page(["5", "4"], "a"), page(["3"], "b"), page([])])
+    pages = list(tw.fetch_tweet_pages(since_id="1"))
+    assert [[tweet["id"] for tweet in tweets] for tweets, _, _ in pages] == [["5", "4"], ["3"]]
+    assert pages[0][2]["9"]["username"] == "alice"
+    assert len(session.calls) == 3
+    assert session.calls[-1][2]["params"]["pagination_token"] == "b"
+
+def test_pages_without_since_id_are_capped(search, monkeypatch):
+    monkeypatch.setattr(tw, "MAX_PAGES_WITHOUT_SINCE_ID", 2)
+    session = search([page(["5"], "a"), page(["4"], "b"), page(["3"], "c")])
+    assert len(list(tw.fetch_tweet_pages())) == 2
+    assert len(session.calls) == 2
+
+def test_time_range_is_sent_to_the_api(search):
+    from datetime import datetime, timezone
+    session = search([page(["5"])])
+    list(tw.fetch_tweet_pages(start_time=datetime(2024, 6, 1, tzinfo=timezone.utc),
+                              end_time=datetime(2024, 6, 1, 6, tzinfo=timezone.utc)))
+    params = session.calls[0][2]["params"]
+    assert (params["start_time"], params["end_time"]) == ("2024-06-01T00:00:00Z", "2024-06-01T06:00:00Z")
+
+def test_api_errors_are_raised(search):
+    search([make_response(400, body="bad request")])
+    with pytest.raises(Exception, match="400"):
+        list(tw.fetch_tweet_pages(since_id="1"))
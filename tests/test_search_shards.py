@@ -0,0 +1,22 @@
+import pytest
+
+import tweet_watcher as tw
+
+def test_shards_are_parsed_in_order():
+    shards = tw.parse_search_shards("default=@a is:quote; replies = @a is:reply ;;empty=")
+    assert list(shards.items()) == [("default", "@a is:quote"), ("replies", "@a is:reply")]
+
+def test_no_shards_fall_back_to_the_default_query():
+    assert tw.parse_search_shards("", default_query="@a") == {tw.DEFAULT_SEARCH_SHARD: "@a"}
+
+@pytest.mark.parametrize("value", ["Replies=@a;replies=@b", "replies=@a;replies=@b"])
+def test_names_that_differ_only_in_case_are_rejected(value):
+    with pytest.raises(EnvironmentError, match="重複"):
+        tw.parse_search_shards(value)
+
+def test_names_must_be_usable_in_file_and_variable_names():
+    with pytest.raises(EnvironmentError, match="英数字"):
+        tw.parse_search_shards("my-shard=@a")
+
+def test_validation_leaves_no_module_globals_behind():
+    assert not hasattr(tw, "_shard")
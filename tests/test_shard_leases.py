@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import tweet_watcher as tw
+
+SHARDS = {"news": "news query", "tech": "tech query"}
+
+@pytest.fixture
+def leases(db):
+    created = []
+
+    def make(owner):
+        shard_leases = tw.ShardLeases(owner=owner, lease_seconds=60)
+        created.append(shard_leases)
+        return shard_leases
+
+    yield make
+    for shard_leases in created:
+        shard_leases.release()
+
+def lease_doc(db, shard):
+    return db.collection(tw.CHECKPOINT_COLLECTION).document(f"{tw.WATCHER_LEASE_PREFIX}{shard}")
+
+def test_free_shards_are_acquired(db, leases):
+    first = leases("a")
+    assert first.acquire(SHARDS) == SHARDS
+    assert first.holds("news") and first.holds("tech")
+    assert lease_doc(db, "news").get().to_dict()["owner"] == "a"
+
+def test_live_lease_of_another_owner_is_not_taken(db, leases):
+    leases("a").acquire({"news": "news query"})
+    second = leases("b")
+    assert second.acquire(SHARDS) == {"tech": "tech query"}
+    assert not second.holds("news")
+
+def test_expired_lease_is_taken_over(db, leases):
+    first = leases("a")
+    first.acquire(SHARDS)
+    lease_doc(db, "news").set({"owner": "a", "expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    second = leases("b")
+    assert second.acquire(SHARDS) == {"news": "news query"}
+    # 次のポーリングで a は引き継がれたことに気づき、担当から外す
+    assert first.acquire(SHARDS) == {"tech": "tech query"}
+    assert not first.holds("news")
+
+def test_released_leases_can_be_acquired_immediately(db, leases):
+    first = leases("a")
+    first.acquire(SHARDS)
+    first.release()
+    assert leases("b").acquire(SHARDS) == SHARDS
+
+class FinishedPipeline:
+    """Pretends every fetched tweet was processed successfully."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def drain(self):
+        return [("5", True)]
+
+@pytest.fixture
+def lost_mid_poll(db, leases, monkeypatch):
+    """Runs a poll during which another instance takes over the "news" shard."""
+    mine = leases("a")
+    saved = []
+    monkeypatch.setattr(tw, "WATCHER_LEASES", True)
+    monkeypatch.setattr(tw, "SEARCH_SHARDS", {"news": "news query"})
+    monkeypatch.setattr(tw, "shard_leases", mine)
+    monkeypatch.setattr(tw, "TweetPipeline", FinishedPipeline)
+    monkeypatch.setattr(tw, "load_last_tweet_id", lambda shard=None: None)
+    monkeypatch.setattr(tw, "save_last_tweet_id", lambda tweet_id, shard=None: saved.append((shard, tweet_id)))
+
+    def submit_shard_pages(pipeline, fetchers, concurrency=None):
+        # 取得中にリースの期限が切れ、別のインスタンスが引き継いだ（a は延長で失ったことを知る）
+        lease_doc(db, "news").set({"owner": "b", "expires_at": datetime.now(timezone.utc) + timedelta(seconds=60)})
+        mine.acquire({"news": "news query"})
+        return 1, {"news": ["5"]}, {}
+
+    monkeypatch.setattr(tw, "submit_shard_pages", submit_shard_pages)
+    return saved
+
+def test_search_does_not_save_the_checkpoint_of_a_lost_shard(lost_mid_poll):
+    tw.search_recent_tweets()
+    assert lost_mid_poll == []
+
+def test_backfill_does_not_save_the_checkpoint_of_a_lost_shard(lost_mid_poll):
+    tw.backfill_tweets(hours=1)
+    assert lost_mid_poll == []
+
+def test_backfill_skips_shards_held_by_another_instance(db, leases, monkeypatch):
+    leases("b").acquire({"news": "news query"})
+    monkeypatch.setattr(tw, "WATCHER_LEASES", True)
+    monkeypatch.setattr(tw, "SEARCH_SHARDS", {"news": "news query"})
+    monkeypatch.setattr(tw, "shard_leases", leases("a"))
+    monkeypatch.setattr(tw, "submit_shard_pages", lambda *args: pytest.fail("searched a shard held by another instance"))
+    assert tw.backfill_tweets(hours=1) == 0
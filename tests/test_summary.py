@@ -0,0 +1,141 @@
+import json
+import time
+from datetime import datetime
+
+import pytest
+
+import tweet_watcher as tw
+from test_http_client import make_client, make_response
+
+class FakeProvider(tw.SummaryProvider):
+    def __init__(self, name, outcome, delay=0.0):
+        super().__init__(f"{name}-model", "test-key")
+        self.name = name
+        self.outcome = outcome
+        self.delay = delay
+        self.deadlines = []
+
+    def _generate(self, prompt, max_output_tokens, json_mode, deadline):
+        self.deadlines.append(deadline)
+        time.sleep(self.delay)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+def test_summary_provider_requires_generate():
+    with pytest.raises(TypeError):
+        tw.SummaryProvider("model", "key")
+
+def test_retry_after_beyond_the_deadline_is_not_waited_for(monkeypatch):
+    slept = []
+    monkeypatch.setattr(tw.time, "sleep", slept.append)
+    client, session = make_client([make_response(429, {"Retry-After": "900"}), make_response(200)])
+    response = client.post("https://api.example.com/x", json={}, deadline=time.monotonic() + 5)
+    assert response.status_code == 429
+    assert slept == [] and len(session.calls) == 1
+
+def test_rate_limit_reset_beyond_the_deadline_raises(monkeypatch):
+    monkeypatch.setattr(tw.time, "sleep", lambda seconds: pytest.fail("must not sleep"))
+    client, session = make_client([make_response(200)])
+    client._rate_limits["api.example.com"] = (0, int(time.time()) + 600)
+    with pytest.raises(tw.DeadlineExceeded):
+        client.post("https://api.example.com/x", json={}, deadline=time.monotonic() + 5)
+    assert session.calls == []
+
+def test_request_timeout_is_capped_by_the_deadline():
+    client, session = make_client([make_response(200)])
+    client.post("https://api.example.com/x", json={}, timeout=30, deadline=time.monotonic() + 2)
+    assert session.calls[0][2]["timeout"] <= 2
+
+def test_rate_limited_provider_fails_over_within_the_budget(monkeypatch):
+    client, _ = make_client([make_response(429, {"Retry-After": "900"})])
+    gemini = tw.GeminiProvider("gemini-model", "test-key", client=client)
+    backup = FakeProvider("openai", "### タイトル\n要約")
+    summarizer = tw.HedgedSummarizer([gemini, backup], budget=5, hedge_delay=5)
+    started = time.monotonic()
+    text, usage = summarizer.generate("prompt", 100)
+    assert time.monotonic() - started < 1
+    assert text == "### タイトル\n要約"
+    assert usage["provider"] == "openai" and usage["hedged"] is True
+
+def test_slow_primary_is_hedged_after_the_delay():
+    primary = FakeProvider("gemini", "slow", delay=0.5)
+    backup = FakeProvider("openai", "fast")
+    text, usage = tw.HedgedSummarizer([primary, backup], budget=5, hedge_delay=0.05).generate("prompt", 100)
+    assert (text, usage["provider"], usage["hedged"]) == ("fast", "openai", True)
+
+def test_nothing_within_the_budget_returns_none():
+    primary = FakeProvider("gemini", None)
+    backup = FakeProvider("openai", RuntimeError("boom"))
+    assert tw.HedgedSummarizer([primary, backup], budget=1, hedge_delay=0.05).generate("prompt", 100) == (None, None)
+
+def test_providers_get_a_deadline_inside_the_budget():
+    primary = FakeProvider("gemini", "ok")
+    started = time.monotonic()
+    tw.HedgedSummarizer([primary], budget=3, hedge_delay=1).generate("prompt", 100)
+    assert started < primary.deadlines[0] <= started + 3.1
+
+def test_cache_version_depends_on_provider_and_model():
+    versions = {tw.summary_cache_version("gemini", "gemini-1.5-flash-latest"),
+                tw.summary_cache_version("gemini", "gemini-2.0-flash"),
+                tw.summary_cache_version("openai", "gemini-1.5-flash-latest")}
+    assert len(versions) == 3
+
+def test_summary_from_another_provider_is_not_served(db):
+    gemini_cache = tw.SummaryCache(tw.summary_cache_version("gemini", "gemini-model"))
+    value = {"title": "タイトル", "summary": "要約", "urls": [],
+             "usage": {"provider": "openai", "model": "gpt-4o-mini", "latency_ms": 10, "hedged": True}}
+    gemini_cache.put_many({"111": value})
+    assert gemini_cache.get_many(["111"]) == {}
+    openai_cache = tw.SummaryCache(tw.summary_cache_version("openai", "gpt-4o-mini"))
+    assert openai_cache.get_many(["111"])["111"]["summary"] == "要約"
+
+def test_invalidate_removes_every_cached_version(db):
+    cache = tw.SummaryCache(tw.summary_cache_version("gemini", "gemini-model"))
+    for provider in ("gemini", "openai"):
+        cache.put_many({"222": {"title": "t", "summary": "s", "urls": [],
+                                "usage": {"provider": provider, "model": "m"}}})
+    cache.invalidate("222")
+    assert not any(path.startswith(tw.SUMMARY_CACHE_COLLECTION) for path in db.documents)
+
+def test_analysis_format_round_trips():
+    text = tw.format_analysis("2024-06-01 12:00", "タイトル", "要約", "https://x.com/a/status/1", ["https://e.com"])
+    assert tw.parse_analysis(text) == {"title": "タイトル", "summary": "要約", "urls": ["https://e.com"]}
+    assert tw.parse_analysis("タイトルだけ") is None
+
+def test_batch_analysis_falls_back_to_single_calls_for_invalid_items(monkeypatch):
+    batch_reply = json.dumps([{"index": 0, "title": "一件目", "summary": "要約1", "urls": []},
+                              {"index": 5, "title": "範囲外", "summary": "x"}])
+    usage = {"provider": "gemini", "model": "m", "latency_ms": 1, "hedged": False}
+    calls = []
+
+    def generate(prompt, max_output_tokens, json_mode=False):
+        calls.append(json_mode)
+        if json_mode:
+            return batch_reply, usage
+        return "### 2024-06-01 12:00 二件目\n要約2\nhttps://x.com/b/status/2", usage
+
+    monkeypatch.setattr(tw.summarizer, "generate", generate)
+    created_at = datetime(2024, 6, 1, 3, 0)
+    results = tw.analyze_tweets_batch([("一", "https://x.com/a/status/1", created_at, []),
+                                       ("二", "https://x.com/b/status/2", created_at, [])])
+    assert calls == [True, False]
+    assert results[0][0].startswith("### 2024-06-01 12:00 一件目")
+    assert results[1][0].startswith("### 2024-06-01 12:00 二件目")
+
+@pytest.mark.parametrize("outcome", [(None, None), ("not json", {"provider": "gemini"}), ('{"a": 1}', {}),
+                                     RuntimeError("503")])
+def test_failed_batch_call_is_not_repeated_per_item(monkeypatch, outcome):
+    calls = []
+
+    def generate(prompt, max_output_tokens, json_mode=False):
+        calls.append(json_mode)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(tw.summarizer, "generate", generate)
+    created_at = datetime(2024, 6, 1, 3, 0)
+    items = [(text, f"https://x.com/a/status/{n}", created_at, []) for n, text in enumerate("一二三")]
+    assert tw.analyze_tweets_batch(items) == [(None, None)] * 3
+    assert calls == [True]
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import migrate_tweet_keys
+from tweet_keys import is_legacy_key, tweet_document_key, tweet_id_from_document_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_document_key_round_trips_the_tweet_id():
+    key = tweet_document_key("1800000000000000001")
+    assert key.endswith("_1800000000000000001") and len(key.partition("_")[0]) == 4
+    assert tweet_id_from_document_key(key) == "1800000000000000001"
+    assert tweet_id_from_document_key("1800000000000000001") == "1800000000000000001"
+    assert is_legacy_key("1800000000000000001") and not is_legacy_key(key)
+
+def test_migration_does_not_need_the_watcher_configuration():
+    env = {key: value for key, value in os.environ.items()
+           if key not in ("BEARER_TOKEN", "GEMINI_API_KEY", "OPENAI_API_KEY")}
+    result = subprocess.run([sys.executable, "-c", "import migrate_tweet_keys, sys; "
+                             "sys.exit('tweet_watcher' in sys.modules)"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+def test_tweets_outbox_and_dead_letters_move_to_the_new_key(db):
+    db.collection("scrapcast_tweets").document("111").set({"id": "111", "text": "旧"})
+    db.collection("scrapcast_reply_outbox").document("111").set({"tweet_doc_id": "111", "status": "pending"})
+    db.collection("scrapcast_reply_outbox").document("222").set({"tweet_doc_id": "222", "status": "sending"})
+    db.collection("scrapcast_dead_letters").document("333").set({"tweet_id": "333", "stage": "github"})
+    for name, rekey in migrate_tweet_keys.COLLECTIONS:
+        migrate_tweet_keys.migrate_collection(db, name, rekey, dry_run=False)
+
+    new_key = tweet_document_key("111")
+    tweet = db.collection("scrapcast_tweets").document(new_key).get().to_dict()
+    assert tweet["migrated_from"] == "111"
+    assert not db.collection("scrapcast_tweets").document("111").get().exists
+    assert db.collection("scrapcast_reply_outbox").document(new_key).get().to_dict()["tweet_doc_id"] == new_key
+    # 送信中のものは次の実行まで旧キーのまま
+    assert db.collection("scrapcast_reply_outbox").document("222").get().exists
+    assert db.collection("scrapcast_dead_letters").document(tweet_document_key("333")).get().exists
+
+def test_existing_new_key_is_not_overwritten(db):
+    new_key = tweet_document_key("111")
+    db.collection("scrapcast_tweets").document(new_key).set({"id": "111", "text": "新"})
+    db.collection("scrapcast_tweets").document("111").set({"id": "111", "text": "旧"})
+    migrate_tweet_keys.migrate_collection(db, "scrapcast_tweets", migrate_tweet_keys.rekey_tweet, dry_run=False)
+    assert db.collection("scrapcast_tweets").document(new_key).get().to_dict()["text"] == "新"
+    assert not db.collection("scrapcast_tweets").document("111").get().exists
+
+def test_dry_run_writes_nothing(db):
+    db.collection("scrapcast_tweets").document("111").set({"id": "111"})
+    assert migrate_tweet_keys.migrate_collection(db, "scrapcast_tweets", migrate_tweet_keys.rekey_tweet,
+                                                 dry_run=True) == (1, 1, 0)
+    assert db.collection("scrapcast_tweets").document("111").get().exists
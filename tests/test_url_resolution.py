@@ -0,0 +1,58 @@
+import pytest
+
+import tweet_watcher as tw
+from test_http_client import FakeSession, make_response
+
+def test_entity_urls_prefer_the_unwound_url_and_skip_media():
+    tweet = {"text": "見て https://t.co/a https://t.co/m", "entities": {"urls": [
+        {"url": "https://t.co/a", "expanded_url": "https://bit.ly/x", "unwound_url": "https://example.com/article"},
+        {"url": "https://t.co/b", "expanded_url": "https://bit.ly/y"},
+        {"url": "https://t.co/m", "expanded_url": "https://x.com/a/photo/1", "media_key": "3_1"},
+    ]}}
+    assert tw.extract_urls_from_tweet(tweet) == ["https://example.com/article", "https://bit.ly/y"]
+
+def test_text_is_scanned_only_without_entities():
+    assert tw.extract_urls_from_tweet({"text": "見て https://example.com/a　です"}) == ["https://example.com/a"]
+    assert tw.extract_urls_from_tweet({"text": "https://example.com/a", "entities": {}}) == []
+
+@pytest.fixture
+def resolver(db):
+    resolver = tw.UrlResolver(concurrency=2)
+    session = FakeSession([])
+
+    def request(method, url, **kwargs):
+        session.calls.append((method, url, kwargs))
+        return make_response(200, url=url.replace("https://bit.ly/", "https://example.com/"))
+    session.request = request
+    resolver._client._session = lambda host: session
+    return resolver, session
+
+def test_short_urls_are_resolved_once_and_cached(resolver, db):
+    resolver, session = resolver
+    urls = ["https://bit.ly/x", "https://example.com/plain", "https://bit.ly/x"]
+    assert resolver.resolve_many(urls) == {"https://bit.ly/x": "https://example.com/x",
+                                           "https://example.com/plain": "https://example.com/plain"}
+    assert [call[1] for call in session.calls] == ["https://bit.ly/x"]
+    resolver.resolve_many(["https://bit.ly/x"])
+    assert len(session.calls) == 1
+
+    # 別のプロセスはFirestoreのキャッシュから引く
+    other = tw.UrlResolver()
+    other._client._session = lambda host: pytest.fail("must not request")
+    assert other.resolve_many(["https://bit.ly/x"])["https://bit.ly/x"] == "https://example.com/x"
+
+def test_failed_resolution_keeps_the_short_url(resolver):
+    resolver, session = resolver
+
+    def request(method, url, **kwargs):
+        raise tw.requests.ConnectionError("refused")
+    session.request = request
+    assert resolver.resolve_many(["https://bit.ly/x"]) == {"https://bit.ly/x": "https://bit.ly/x"}
+
+def test_cache_writes_are_split_into_batches(resolver, db):
+    resolver, session = resolver
+    urls = [f"https://bit.ly/{index}" for index in range(tw.FIRESTORE_BATCH_LIMIT + 20)]
+    resolver.resolve_many(urls)
+    assert db.commits == 2
+    cached = [path for path in db.documents if path.startswith(f"{tw.URL_CACHE_COLLECTION}/")]
+    assert len(cached) == len(urls)
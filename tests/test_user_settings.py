@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+import user_settings
+from user_settings import USERS_COLLECTION, UserSettingsCache
+
+@pytest.fixture
+def users(db):
+    db.collection(USERS_COLLECTION).document("alice").set({"github_repo": "notes"})
+    db.collection(USERS_COLLECTION).document("bob").set({"github_repo": "memo", "active": False})
+    return db
+
+def test_cached_users_are_read_once(users):
+    cache = UserSettingsCache(users)
+    assert cache.get_many(["alice", "alice", "carol", None]) == {"alice": {"github_repo": "notes"}, "carol": None}
+    calls = users.get_all_calls
+    assert cache.get("alice") == {"github_repo": "notes"}
+    assert cache.get("carol") is None
+    assert users.get_all_calls == calls
+
+def test_inactive_users_have_no_settings(users):
+    assert UserSettingsCache(users).get("bob") is None
+
+def test_entries_expire_after_the_ttl(users, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(user_settings.time, "monotonic", lambda: now[0])
+    cache = UserSettingsCache(users, ttl_seconds=60)
+    cache.get("alice")
+    users.collection(USERS_COLLECTION).document("alice").set({"github_repo": "renamed"})
+    now[0] += 30
+    assert cache.get("alice") == {"github_repo": "notes"}
+    now[0] += 31
+    assert cache.get("alice") == {"github_repo": "renamed"}
+
+def test_listener_updates_replace_cached_entries(users):
+    cache = UserSettingsCache(users)
+    cache.warm()
+    document = SimpleNamespace(id="alice", to_dict=lambda: {"github_repo": "moved"})
+    cache._on_snapshot(None, [SimpleNamespace(type=SimpleNamespace(name="MODIFIED"), document=document)], None)
+    assert cache.get("alice") == {"github_repo": "moved"}
+    cache._on_snapshot(None, [SimpleNamespace(type=SimpleNamespace(name="REMOVED"), document=document)], None)
+    assert cache.get("alice") is None
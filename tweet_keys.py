@@ -0,0 +1,23 @@
+# scrapcast_tweets のドキュメントキー。
+# tweet_watcher.py と migrate_tweet_keys.py の両方が使うので、環境変数や外部サービスに依存しない形でここに置く。
+import hashlib
+
+# ドキュメントキーに前置きするIDのハッシュの桁数（16^4通りに書き込みを分散する）
+TWEET_KEY_PREFIX_LENGTH = 4
+
+def tweet_document_key(tweet_id):
+    """
+    scrapcast_tweets のドキュメントキー。
+    Snowflake IDは単調増加するので、そのままキーにすると書き込みが1つのタブレットに集中する。
+    IDのハッシュの先頭を前置きしてキー空間に分散させる（元のIDは id フィールドに残す）。
+    """
+    prefix = hashlib.sha256(tweet_id.encode("utf-8")).hexdigest()[:TWEET_KEY_PREFIX_LENGTH]
+    return f"{prefix}_{tweet_id}"
+
+def tweet_id_from_document_key(key):
+    """ドキュメントキー（旧形式のツイートIDそのものも可）からツイートIDを取り出す"""
+    return key.rpartition("_")[2]
+
+def is_legacy_key(key):
+    """ツイートIDそのものをキーにした旧形式か"""
+    return key.isdigit()
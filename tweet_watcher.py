@@ -1,17 +1,63 @@
 import os
+import sys
 import requests
 import json
+import signal
+import argparse
 import re
+import math
+import time
+import random
+import hashlib
+import socket
+import uuid
+import threading
+import queue
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime, timezone, timedelta
+from email.utils import parsedate_to_datetime
+from urllib.parse import parse_qsl, urlsplit
+from requests.adapters import HTTPAdapter
+from google.api_core.exceptions import AlreadyExists
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+# 再試行の方針（回数・バックオフ・デッドレター・processing_status のフィールド）はCloud Functions側と共有する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "firebase_works", "functions"))
+from retry_policy import (RETRY_BATCH_SIZE, RETRY_MAX_ATTEMPTS, claim_stage, complete_stage, record_stage_failures,
+                          retry_delay, scheduled_stage_status, stage_completed_fields)
+from tweet_keys import tweet_document_key, tweet_id_from_document_key
+
 # --- Constants ---
 LAST_TWEET_ID_VAR_NAME = "LAST_TWEET_ID"
 LAST_TWEET_ID_FILENAME = "last_tweet_id.txt"
+CHECKPOINT_COLLECTION = "scrapcast_state"
+CHECKPOINT_DOCUMENT = "watcher_checkpoint"
 SEARCH_QUERY = "@ScrapCastGoGo is:quote"
-SEARCH_URL = "https://api.twitter.com/2/tweets/search/recent"
+DEFAULT_SEARCH_SHARD = "default"
+# ベンチマーク用のスタブサーバーなどに向けるときは環境変数で上書きする
+SEARCH_URL = os.environ.get("TWITTER_SEARCH_URL", "https://api.twitter.com/2/tweets/search/recent")
+SEARCH_MAX_RESULTS = 100  # recent search の1ページあたりの上限
+# since_id がない（初回・リセット時）は7日分を遡らないようページ数を制限する
+MAX_PAGES_WITHOUT_SINCE_ID = 1
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+GEMINI_MODEL = "gemini-1.5-flash-latest"
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
+# OpenAI互換のChat Completions API（仕様の本運用期はGPT-4o mini）
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_API_BASE = os.environ.get("OPENAI_API_BASE", "https://api.openai.com/v1")
+# プロンプトを変更したら上げる（要約キャッシュのキーに含まれる）
+ANALYSIS_PROMPT_VERSION = "1"
+SUMMARY_CACHE_COLLECTION = "scrapcast_summary_cache"
+URL_CACHE_COLLECTION = "scrapcast_url_cache"
+# 短縮URLとして展開を試みるホスト
+SHORT_URL_HOSTS = {"t.co", "bit.ly", "buff.ly", "ow.ly", "goo.gl", "tinyurl.com", "lnkd.in", "dlvr.it", "amzn.to", "youtu.be"}
 
 # --- Environment Setup ---
 # Load .env only if not in a CI environment (like GitHub Actions)
@@ -21,22 +67,561 @@ if not IS_CI:
     load_dotenv()
 
 BEARER_TOKEN = os.environ.get("BEARER_TOKEN")
+# チェックポイントの保存先: file / firestore / github（未指定ならCIはgithub、ローカルはfile）
+CHECKPOINT_BACKEND = os.environ.get("CHECKPOINT_BACKEND") or ("github" if IS_CI else "file")
 GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN")
 GITHUB_REPOSITORY = os.environ.get("GITHUB_REPOSITORY")
 
 if not BEARER_TOKEN:
     raise EnvironmentError("BEARER_TOKEN が環境変数に設定されていません")
 
-if not GEMINI_API_KEY:
-    raise EnvironmentError("GEMINI_API_KEY が環境変数に設定されていません")
+if not GEMINI_API_KEY and not OPENAI_API_KEY:
+    raise EnvironmentError("GEMINI_API_KEY または OPENAI_API_KEY が環境変数に設定されていません")
+
+# --- Logging / Metrics Settings ---
+# DEBUG にするとTwitter APIのレスポンス全体などのデバッグ出力を表示する
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+DEBUG = LOG_LEVEL == "DEBUG"
+# 実行ごと（デーモンではポーリングごと）のメトリクスの出力先。未指定なら標準出力にJSONで表示する
+METRICS_PATH = os.environ.get("METRICS_PATH")
+METRICS_FORMAT = os.environ.get("METRICS_FORMAT", "json")  # json / prometheus
+
+# --- Pipeline Settings ---
+# 外部サービスごとの同時実行数の上限（ステージごとのワーカー数）
+GEMINI_CONCURRENCY = int(os.environ.get("GEMINI_CONCURRENCY", "4"))
+FIRESTORE_CONCURRENCY = int(os.environ.get("FIRESTORE_CONCURRENCY", "8"))
+# 1回のGemini呼び出しでまとめて分析する引用元ツイートの件数
+GEMINI_BATCH_SIZE = int(os.environ.get("GEMINI_BATCH_SIZE", "10"))
+# 要約キャッシュ（プロセス内LRUの件数と、Firestore上の有効期限）
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_TTL_DAYS = int(os.environ.get("SUMMARY_CACHE_TTL_DAYS", "30"))
+# 短縮URLの展開を並行実行する数と、1件あたりのタイムアウト（秒）
+URL_RESOLVE_CONCURRENCY = int(os.environ.get("URL_RESOLVE_CONCURRENCY", "8"))
+URL_RESOLVE_TIMEOUT = float(os.environ.get("URL_RESOLVE_TIMEOUT", "5"))
+# Firestoreの1バッチあたりの書き込み上限
+FIRESTORE_BATCH_LIMIT = 500
+# 処理済みツイートIDのBloomフィルタ（1なら起動時に保存済みの全IDを読み込む）
+# フィルタが知っているのは起動時点の保存済みIDとこのプロセスが保存したIDだけなので、
+# scrapcast_tweets に書き込むウォッチャーが1つのときだけ有効にする
+SEEN_FILTER = os.environ.get("SEEN_FILTER", "0") == "1"
+# migrate_tweet_keys.py で移行し終えるまでは、旧形式（ツイートIDそのもの）のキーも重複チェックで引く
+TWEET_KEY_LEGACY_LOOKUP = os.environ.get("TWEET_KEY_LEGACY_LOOKUP", "1") == "1"
+
+# --- Summary Provider Settings ---
+# 要約に使うプロバイダの優先順（APIキーが設定されているものだけ使う）。先頭が通常の送信先、次がヘッジ先
+SUMMARY_PROVIDERS = [name.strip() for name in os.environ.get("SUMMARY_PROVIDERS", "gemini,openai").split(",") if name.strip()]
+# 1回の要約リクエストにかけてよい時間の上限（秒）。超えたら失敗として扱う
+SUMMARY_LATENCY_BUDGET = float(os.environ.get("SUMMARY_LATENCY_BUDGET", "30"))
+# 送信先のp95が分かるまでは、この秒数を超えたらヘッジを送る
+SUMMARY_HEDGE_DELAY = float(os.environ.get("SUMMARY_HEDGE_DELAY", "10"))
+SUMMARY_HEDGE_MIN_SAMPLES = 20
+SUMMARY_LATENCY_WINDOW = 200
+
+# --- Retry Settings ---
+# 要約に失敗したツイートは processing_status.retry_stage = "summarize" として次回以降に要約だけやり直す
+# （GitHub保存など後続のステージはCloud Functions側の再試行スケジューラーが受け持つ）
+# 回数・バックオフ・デッドレターの設定（RETRY_* / STAGE_LEASE_SECONDS）と、リースを確かめて書き込むトランザクションは
+# firebase_works/functions/retry_policy.py にある
+
+# --- Lease Settings ---
+# 複数のウォッチャーを並べて動かすときは、シャードごとのリース（scrapcast_state/watcher_lease_{シャード名}）を
+# 持っているインスタンスだけがそのシャードを検索し、チェックポイントを進める。期限切れのリースは他が引き継ぐ
+WATCHER_LEASES = os.environ.get("WATCHER_LEASES", "1") == "1"
+WATCHER_LEASE_SECONDS = float(os.environ.get("WATCHER_LEASE_SECONDS", "300"))
+WATCHER_LEASE_PREFIX = "watcher_lease_"
+# リースの持ち主としてドキュメントに書く、このプロセスの識別子
+WATCHER_ID = os.environ.get("WATCHER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# --- HTTP Settings ---
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "5"))
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+# レート制限のリセット待ちの上限（Twitterのレート制限ウィンドウは15分）
+RATE_LIMIT_MAX_WAIT = 15 * 60
+# 外部APIへのリクエストの記録・再生（ローカル開発用）: record / replay（未指定なら通常どおり通信する）
+HTTP_CASSETTE_MODE = os.environ.get("HTTP_CASSETTE_MODE", "").lower()
+HTTP_CASSETTE_PATH = os.environ.get("HTTP_CASSETTE_PATH", "http_cassette.jsonl")
+# 1 にすると再生時に記録したときのレイテンシだけ待つ
+HTTP_CASSETTE_LATENCY = os.environ.get("HTTP_CASSETTE_LATENCY", "0") == "1"
+# カセットに残さないクエリパラメーター
+HTTP_CASSETTE_SECRET_PARAMS = {"key", "api_key", "access_token", "token"}
+# チェックポイントや現在時刻で実行ごとに変わるため、カセットのキーに含めないクエリパラメーター
+HTTP_CASSETTE_VOLATILE_PARAMS = {"since_id", "start_time", "end_time"}
+# 再生に必要なレスポンスヘッダーだけを記録する
+HTTP_CASSETTE_HEADERS = {"content-type", "retry-after", "x-rate-limit-limit", "x-rate-limit-remaining",
+                         "x-rate-limit-reset", "x-ratelimit-remaining", "x-ratelimit-reset"}
+
+# --- Daemon Settings ---
+# 新着があれば最短間隔に戻し、なければ最長間隔まで倍々に延ばす
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", "15"))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", "300"))
+POLL_BACKOFF_FACTOR = 2.0
+
+# --- Backfill Settings ---
+# recent search で遡れるのは7日間。取りこぼした期間を start_time / end_time の区間に分けて並行に取得する
+SEARCH_WINDOW_DAYS = 7
+BACKFILL_SLICE_HOURS = float(os.environ.get("BACKFILL_SLICE_HOURS", "6"))
+BACKFILL_CONCURRENCY = int(os.environ.get("BACKFILL_CONCURRENCY", "4"))
+# end_time は現在時刻の10秒以上前、start_time は7日以内でなければならない
+BACKFILL_END_MARGIN = timedelta(seconds=30)
+BACKFILL_START_MARGIN = timedelta(minutes=5)
+# Twitter Snowflake ID のエポック（ミリ秒）
+TWITTER_EPOCH_MS = 1288834974657
+
+# --- Search Shard Settings ---
+# 検索クエリのシャード。"名前=クエリ" を ";" 区切りで並べる（未指定なら SEARCH_QUERY だけの default シャード）
+# 例: SEARCH_SHARDS="default=@ScrapCastGoGo is:quote;replies=@ScrapCastGoGo is:reply"
+# シャードごとにチェックポイントを持ち、1回のポーリングで全シャードを並行に検索する
+def parse_search_shards(value, default_query=SEARCH_QUERY):
+    """
+    "名前=クエリ;名前=クエリ" をシャード名→クエリに変換する（空なら既定のシャード1つ）。
+    シャード名はチェックポイントのファイル名・変数名に使い、GitHubの変数名は大文字に揃えられるので、
+    大文字小文字だけが違う名前も同じシャードとみなして拒否する。
+    """
+    shards = OrderedDict()
+    seen = {}
+    for name, _, query in (entry.partition("=") for entry in value.split(";")):
+        name, query = name.strip(), query.strip()
+        if not name or not query:
+            continue
+        if not re.fullmatch(r"[A-Za-z0-9_]+", name):
+            raise EnvironmentError(f"SEARCH_SHARDS のシャード名は英数字と _ だけにしてください: {name}")
+        if name.upper() in seen:
+            raise EnvironmentError(f"SEARCH_SHARDS のシャード名が重複しています（大文字小文字は区別しません）: "
+                                   f"{seen[name.upper()]}, {name}")
+        seen[name.upper()] = name
+        shards[name] = query
+    return shards or OrderedDict([(DEFAULT_SEARCH_SHARD, default_query)])
+
+SEARCH_SHARDS = parse_search_shards(os.environ.get("SEARCH_SHARDS", ""))
+SEARCH_SHARD_CONCURRENCY = int(os.environ.get("SEARCH_SHARD_CONCURRENCY", "4"))
+
+# --- Metrics ---
+
+class Metrics:
+    """
+    ステージごとの処理時間と、件数のカウンタを集計する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._durations = defaultdict(list)  # stage -> 秒のリスト
+            self._counters = defaultdict(int)
+            self._started_at = time.time()
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self._durations[stage].append(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    @staticmethod
+    def _percentile(sorted_values, percentile):
+        index = max(0, math.ceil(len(sorted_values) * percentile / 100) - 1)
+        return sorted_values[index]
+
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for stage, values in self._durations.items():
+                ordered = sorted(values)
+                stages[stage] = {
+                    "count": len(ordered),
+                    "total_seconds": round(sum(ordered), 4),
+                    "p50_seconds": round(self._percentile(ordered, 50), 4),
+                    "p95_seconds": round(self._percentile(ordered, 95), 4),
+                    "max_seconds": round(ordered[-1], 4),
+                }
+            return {
+                "elapsed_seconds": round(time.time() - self._started_at, 3),
+                "stages": stages,
+                "counters": dict(self._counters),
+            }
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = [
+            "# TYPE scrapcast_stage_duration_seconds summary",
+        ]
+        for stage, values in summary["stages"].items():
+            lines.append(f'scrapcast_stage_duration_seconds{{stage="{stage}",quantile="0.5"}} {values["p50_seconds"]}')
+            lines.append(f'scrapcast_stage_duration_seconds{{stage="{stage}",quantile="0.95"}} {values["p95_seconds"]}')
+            lines.append(f'scrapcast_stage_duration_seconds_sum{{stage="{stage}"}} {values["total_seconds"]}')
+            lines.append(f'scrapcast_stage_duration_seconds_count{{stage="{stage}"}} {values["count"]}')
+        lines.append("# TYPE scrapcast_events_total counter")
+        for name, value in summary["counters"].items():
+            lines.append(f'scrapcast_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=METRICS_PATH, fmt=METRICS_FORMAT):
+        """集計結果をファイル（未指定なら標準出力）に書き出す"""
+        if fmt == "prometheus":
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2, ensure_ascii=False) + "\n"
+        if not path:
+            print("========== メトリクス ==========")
+            print(content, end="")
+            print("================================")
+            return
+        # node_exporterのtextfile collectorが途中の状態を読まないよう置き換えで書く
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        print(f"📊 メトリクスを {path} に書き出しました")
+
+metrics = Metrics()
+
+# --- HTTP Cassette ---
+
+class HttpCassette:
+    """
+    外部APIへのリクエストとレスポンスの組をJSONL（1行1組）で記録し、同じリクエストに記録順で応答する。
+    record: 実際に通信した最終的なレスポンス（再試行の後）を追記する。
+            タイムアウトや接続エラーで終わったリクエストは、例外の種類とメッセージを記録する
+    replay: 通信せずに記録から応答する（記録した例外は同じ種類で送出する）。記録のないリクエストはエラーにする
+    キーはメソッド・URL・クエリ・JSONボディから作り、認証ヘッダーやAPIキーは記録しない。
+    """
+
+    def __init__(self, mode=HTTP_CASSETTE_MODE, path=HTTP_CASSETTE_PATH, simulate_latency=HTTP_CASSETTE_LATENCY):
+        if mode not in ("", "record", "replay"):
+            raise ValueError(f"HTTP_CASSETTE_MODE は record / replay のどちらかです: {mode}")
+        self.mode = mode
+        self._path = path
+        self._simulate_latency = simulate_latency
+        self._entries = defaultdict(list)  # key -> 記録順のエントリ
+        self._served = defaultdict(int)    # key -> 再生した回数
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    @property
+    def recording(self):
+        return self.mode == "record"
+
+    def _load(self):
+        if not os.path.exists(self._path):
+            raise FileNotFoundError(f"カセットファイル {self._path} がありません。HTTP_CASSETTE_MODE=record で記録してください")
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]].append(entry)
+        print(f"📼 {self._path} から {sum(len(v) for v in self._entries.values())} 件のレスポンスを読み込みました")
+
+    @staticmethod
+    def _strip_query(url, params=None, excluded=HTTP_CASSETTE_SECRET_PARAMS):
+        parts = urlsplit(url)
+        query = {**dict(parse_qsl(parts.query)), **(params or {})}
+        query = [(k, v) for k, v in sorted(query.items()) if k not in excluded]
+        target = f"{parts.scheme}://{parts.netloc}{parts.path}"
+        if query:
+            target += "?" + "&".join(f"{k}={v}" for k, v in query)
+        return target
+
+    @classmethod
+    def _recorded_url(cls, url):
+        # 展開した短縮URLはそのまま残し、APIキーを含むURLだけ取り除いて組み立て直す
+        if any(k in HTTP_CASSETTE_SECRET_PARAMS for k, _ in parse_qsl(urlsplit(url).query)):
+            return cls._strip_query(url)
+        return url
+
+    @classmethod
+    def _request_key(cls, method, url, params=None, body=None):
+        key = f"{method} {cls._strip_query(url, params, HTTP_CASSETTE_SECRET_PARAMS | HTTP_CASSETTE_VOLATILE_PARAMS)}"
+        if body is not None:
+            canonical = json.dumps(body, sort_keys=True, ensure_ascii=False)
+            key += " " + hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+        return key
+
+    def key(self, method, url, kwargs):
+        return self._request_key(method, url, kwargs.get("params"), kwargs.get("json", kwargs.get("data")))
+
+    def record(self, key, response, elapsed, stream=False):
+        self._append({
+            "key": key,
+            "status": response.status_code,
+            "url": self._recorded_url(response.url),
+            "headers": {k.lower(): v for k, v in response.headers.items() if k.lower() in HTTP_CASSETTE_HEADERS},
+            # stream=True のリクエストはヘッダーだけを使うので本文は記録しない
+            "body": "" if stream else response.text,
+            "elapsed_ms": round(elapsed * 1000, 1),
+        })
+
+    def record_error(self, key, error, elapsed):
+        # 例外のメッセージにはリクエストURL（APIキーを含むことがある）が入るので、秘密のパラメーターを伏せる
+        message = re.sub(rf"\b({'|'.join(HTTP_CASSETTE_SECRET_PARAMS)})=[^&\s'\"]+", r"\1=***", str(error))
+        self._append({
+            "key": key,
+            "error": {"type": type(error).__name__, "message": message},
+            "elapsed_ms": round(elapsed * 1000, 1),
+        })
+
+    @staticmethod
+    def _error_class(name):
+        if name == DeadlineExceeded.__name__:
+            return DeadlineExceeded
+        error_class = getattr(requests.exceptions, name, None)
+        if isinstance(error_class, type) and issubclass(error_class, requests.RequestException):
+            return error_class
+        return requests.RequestException
+
+    def _append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            with open(self._path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def replay(self, key):
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise LookupError(f"カセットに記録がないリクエストです: {key}")
+            # 同じリクエストには記録順に応答し、使い切ったら最後のレスポンスを返し続ける
+            entry = entries[min(self._served[key], len(entries) - 1)]
+            self._served[key] += 1
+        metrics.increment("http_replays")
+        if self._simulate_latency:
+            time.sleep(entry["elapsed_ms"] / 1000)
+        if "error" in entry:
+            raise self._error_class(entry["error"]["type"])(entry["error"]["message"])
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.url = entry["url"]
+        response.headers.update(entry["headers"])
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        return response
+
+http_cassette = HttpCassette()
+
+# --- HTTP Client ---
+
+class DeadlineExceeded(requests.Timeout):
+    """再試行やレート制限の待ち時間が、呼び出し側の期限（deadline）までに収まらない"""
+
+class HttpClient:
+    """
+    ホストごとにコネクションプールを持つHTTPクライアント。
+    レート制限（429、GitHubの x-ratelimit-remaining: 0 の403）は処理されていないので、どのメソッドでも再試行する。
+    5xxと接続エラー・タイムアウトは処理済みかもしれないので、冪等なメソッドか
+    呼び出し側が idempotent=True を渡したリクエストだけをジッター付き指数バックオフで再試行する。
+    Retry-After や x-rate-limit-remaining / x-rate-limit-reset があればリセット時刻まで待つ。
+    deadline（time.monotonic() の時刻）を渡すと、タイムアウトと待ち時間をその時刻までに収め、
+    収まらない待ちはせずにその時点の結果を返す（レスポンスがなければ DeadlineExceeded）。
+    """
+
+    RETRY_STATUSES = {500, 502, 503, 504}
+    IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+    def __init__(self, timeout=HTTP_TIMEOUT, max_retries=HTTP_MAX_RETRIES, pool_size=HTTP_POOL_SIZE,
+                 backoff_base=1.0, backoff_max=60.0, cassette=http_cassette):
+        self._cassette = cassette
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._pool_size = pool_size
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._sessions = {}     # host -> requests.Session
+        self._rate_limits = {}  # host -> (remaining, reset_epoch)
+        self._lock = threading.Lock()
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[host] = session
+            return session
+
+    def rate_limit(self, host):
+        """直近のレスポンスから分かっている (残り回数, リセット時刻のepoch秒) を返す"""
+        with self._lock:
+            return self._rate_limits.get(host, (None, None))
+
+    def _record_rate_limit(self, host, response):
+        headers = response.headers
+        # Twitterは x-rate-limit-*、GitHubは x-ratelimit-*
+        remaining = headers.get("x-rate-limit-remaining", headers.get("x-ratelimit-remaining"))
+        reset = headers.get("x-rate-limit-reset", headers.get("x-ratelimit-reset"))
+        if remaining is None or reset is None:
+            return
+        try:
+            with self._lock:
+                self._rate_limits[host] = (int(remaining), int(reset))
+        except ValueError:
+            pass
+
+    def _wait_for_rate_limit(self, host, deadline=None):
+        remaining, reset = self.rate_limit(host)
+        if remaining != 0 or reset is None:
+            return
+        wait = reset - time.time()
+        if wait > 0:
+            wait = min(wait + 1, RATE_LIMIT_MAX_WAIT)
+            if not self._fits(wait, deadline):
+                raise DeadlineExceeded(f"{host} のレート制限のリセットまで {wait:.0f} 秒あり、期限までに収まりません")
+            print(f"⏳ {host} のレート制限に達しています。リセットまで {wait:.0f} 秒待ちます")
+            metrics.increment("rate_limit_waits")
+            time.sleep(wait)
+
+    @staticmethod
+    def _fits(wait, deadline):
+        return deadline is None or time.monotonic() + wait < deadline
+
+    def _backoff(self, attempt):
+        # Full jitter: 0 〜 base * 2^attempt の間でランダムに待つ
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _is_rate_limited(response):
+        if response.status_code == 429:
+            return True
+        # GitHubのプライマリレート制限は403で、残り回数が0になっている
+        remaining = response.headers.get("x-ratelimit-remaining", response.headers.get("x-rate-limit-remaining"))
+        return response.status_code == 403 and remaining == "0"
+
+    def _retry_delay(self, host, response, attempt):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), RATE_LIMIT_MAX_WAIT)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return min(max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds()), RATE_LIMIT_MAX_WAIT)
+                except (TypeError, ValueError):
+                    pass
+        remaining, reset = self.rate_limit(host)
+        if self._is_rate_limited(response) and remaining == 0 and reset:
+            # リセット時刻ちょうどまで待つ
+            return min(max(0.0, reset - time.time()) + 1, RATE_LIMIT_MAX_WAIT)
+        return self._backoff(attempt)
+
+    def request(self, method, url, idempotent=None, deadline=None, **kwargs):
+        """
+        idempotent: 5xxや接続エラーの後に送り直してよいか。省略時はメソッドで決める
+        （POST/PATCHは、同じ値を設定し直すだけのように呼び出し側が安全だと分かっているときだけTrueにする）
+        deadline: このリクエストに使える最後の時刻（time.monotonic()）。再試行を含めてこの時刻までに終える
+        """
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        if self._cassette.mode:
+            cassette_key = self._cassette.key(method, url, kwargs)
+            if self._cassette.replaying:
+                return self._cassette.replay(cassette_key)
+            started = time.perf_counter()
+            try:
+                response = self._request(method, url, idempotent, deadline, **kwargs)
+            except requests.RequestException as error:
+                self._cassette.record_error(cassette_key, error, time.perf_counter() - started)
+                raise
+            self._cassette.record(cassette_key, response, time.perf_counter() - started, kwargs.get("stream", False))
+            return response
+        return self._request(method, url, idempotent, deadline, **kwargs)
+
+    def _request(self, method, url, idempotent, deadline, **kwargs):
+        timeout = kwargs.pop("timeout", self._timeout)
+        host = urlsplit(url).netloc
+        session = self._session(host)
+
+        for attempt in range(self._max_retries + 1):
+            self._wait_for_rate_limit(host, deadline)
+            attempt_timeout = timeout
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise DeadlineExceeded(f"{host} へのリクエストの期限を過ぎました")
+                attempt_timeout = min(timeout, left)
+            try:
+                response = session.request(method, url, timeout=attempt_timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt == self._max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                if not self._fits(delay, deadline):
+                    raise
+                metrics.increment("http_retries")
+                print(f"⏳ {host} への接続に失敗しました ({e})。{delay:.1f} 秒後に再試行します ({attempt + 1}/{self._max_retries})")
+                time.sleep(delay)
+                continue
+
+            self._record_rate_limit(host, response)
+            retryable = self._is_rate_limited(response) or (idempotent and response.status_code in self.RETRY_STATUSES)
+            if not retryable or attempt == self._max_retries:
+                return response
+
+            delay = self._retry_delay(host, response, attempt)
+            if not self._fits(delay, deadline):
+                # 待つと期限を過ぎるので、呼び出し側に任せる（要約なら別のプロバイダに切り替える）
+                return response
+            metrics.increment("http_retries")
+            print(f"⏳ {host} から {response.status_code} が返りました。{delay:.1f} 秒後に再試行します ({attempt + 1}/{self._max_retries})")
+            time.sleep(delay)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+http_client = HttpClient()
 
 # --- Firebase Setup ---
+_firestore_client = None
+_firebase_lock = threading.Lock()
+
 def initialize_firebase():
-    """Initialize Firebase Admin SDK"""
+    """Initialize Firebase Admin SDK once and return the shared Firestore client"""
+    global _firestore_client
+    if _firestore_client is not None:
+        return _firestore_client
+    # パイプラインの複数スレッドから同時に呼ばれても初期化は1回だけにする
+    with _firebase_lock:
+        if _firestore_client is None:
+            _firestore_client = _create_firestore_client()
+    return _firestore_client
+
+def _create_firestore_client():
     if firebase_admin._apps:
         # Already initialized
         return firestore.client()
     
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        # Firestore emulator - credentials are not needed
+        project_id = os.environ.get("GOOGLE_CLOUD_PROJECT", "scrapcast-c94cc")
+        print(f"Firestoreエミュレーター ({os.environ['FIRESTORE_EMULATOR_HOST']}) に接続します。プロジェクトID: {project_id}")
+        firebase_admin.initialize_app(options={"projectId": project_id})
+        return firestore.client()
+    
     if IS_CI:
         # GitHub Actions environment - use service account from environment variable
         print("GitHub Actions環境を検出しました。環境変数からFirebase認証情報を読み込みます。")
@@ -74,60 +659,134 @@ def initialize_firebase():
     return firestore.client()
 
 # --- Firestore Operations ---
-def save_tweet_to_firestore(tweet, referenced_tweets, author_username):
+
+def build_tweet_document(tweet, author_username, durations_ms=None, summary=None, summary_usage=None,
+                         retry_payload=None):
+    """
+    Build a scrapcast_tweets document according to the schema
+    retry_payload: 要約に失敗したときに要約だけをやり直すための引用元ツイートの情報
+    """
+    tweet_id = tweet["id"]
+    tweet_url = f"https://twitter.com/i/web/status/{tweet_id}"
+    
+    # Find quoted tweet URL (there should be only one)
+    quoted_tweet_url = None
+    if tweet.get("referenced_tweets"):
+        for ref in tweet["referenced_tweets"]:
+            if ref["type"] == "quoted":
+                quoted_tweet_url = f"https://twitter.com/i/web/status/{ref['id']}"
+                break
+    
+    document = {
+        "id": tweet_id,
+        "url": tweet_url,
+        "author_username": author_username,
+        "quoted_tweet_url": quoted_tweet_url,
+        # AI要約（Markdownに追記する4行フォーマット）。失敗時はNone
+        "summary": summary,
+        "created_at": datetime.now(),
+        "processed": False,
+        "processing_status": {
+            "summarized": summary is not None,
+            # 要約したプロバイダ・モデル・レイテンシ（キャッシュから返した場合は cached: true）
+            "summary_usage": summary_usage,
+            "saved_to_github": False,
+            "replied": False,
+            # watcher側の各ステージ（search / dedup / url_resolve / analyze）の処理時間（ミリ秒）。
+            # 保存（firestore_write）はこのドキュメント自体の書き込みなので含められず、メトリクスにだけ残る
+            "durations_ms": durations_ms or {}
+        }
+    }
+    if summary is not None:
+        # GitHub保存はCloud Functionsのトリガーが実行する。トリガーが動かなかった・リースを取る前に落ちたときは
+        # 猶予（STAGE_GRACE_SECONDS）の後に再試行スケジューラーが拾う
+        document["processing_status"].update(scheduled_stage_status("github"))
+    elif retry_payload:
+        # 1回目の失敗として要約ステージの再試行を予約する
+        document["retry_payload"] = retry_payload
+        document["processing_status"].update({
+            "retry_stage": "summarize",
+            "retry_count": 1,
+            "next_retry_at": datetime.now(timezone.utc) + timedelta(seconds=retry_delay(1)),
+        })
+    return document
+
+def save_tweet_to_firestore(tweet, referenced_tweets, author_username, summary=None, summary_usage=None,
+                            retry_payload=None, durations_ms=None):
     """Save tweet data to Firestore according to scrapcast_tweets schema"""
     try:
         db = initialize_firebase()
         
-        tweet_id = tweet["id"]
-        tweet_url = f"https://twitter.com/i/web/status/{tweet_id}"
-        
-        # Find quoted tweet URL (there should be only one)
-        quoted_tweet_url = None
-        if tweet.get("referenced_tweets"):
-            for ref in tweet["referenced_tweets"]:
-                if ref["type"] == "quoted":
-                    quoted_tweet_url = f"https://twitter.com/i/web/status/{ref['id']}"
-                    break
-        
-        # Create document data according to schema
-        tweet_data = {
-            "id": tweet_id,
-            "url": tweet_url,
-            "author_username": author_username,
-            "quoted_tweet_url": quoted_tweet_url,
-            "created_at": datetime.now(),
-            "processed": False,
-            "processing_status": {
-                "summarized": False,
-                "saved_to_github": False,
-                "replied": False
-            }
-        }
+        tweet_data = build_tweet_document(tweet, author_username, durations_ms, summary=summary,
+                                          summary_usage=summary_usage, retry_payload=retry_payload)
+        tweet_id = tweet_data["id"]
         
-        # Save to Firestore
-        doc_ref = db.collection("scrapcast_tweets").document(tweet_id)
-        doc_ref.set(tweet_data)
+        # Save to Firestore（既に保存されているドキュメントは上書きしない）
+        doc_ref = db.collection("scrapcast_tweets").document(tweet_document_key(tweet_id))
+        try:
+            with metrics.timer("firestore_write"):
+                doc_ref.create(tweet_data)
+        except AlreadyExists:
+            print(f"⚠️  ツイート {tweet_id} は既にFirestoreに存在します")
+            return True
         
         print(f"✅ ツイート {tweet_id} をFirestoreに保存しました")
-        print(f"   引用ツイートURL: {tweet_url}")
-        if quoted_tweet_url:
-            print(f"   引用元URL: {quoted_tweet_url}")
+        print(f"   引用ツイートURL: {tweet_data['url']}")
+        if tweet_data["quoted_tweet_url"]:
+            print(f"   引用元URL: {tweet_data['quoted_tweet_url']}")
         
         return True
         
     except Exception as e:
         print(f"❌ Firestoreへの保存に失敗しました: {e}")
+        metrics.increment("errors")
         return False
 
+def save_tweets_to_firestore(documents):
+    """
+    複数のツイートドキュメントをWriteBatchでまとめて保存する
+    documents: build_tweet_document() で作ったドキュメントのリスト
+    戻り値: {tweet_id: 保存できたか}（既に保存されていたものも保存済みとしてTrue）
+    重複チェックが失敗して処理済みのツイートが混ざっても、create なので処理状況を上書きしない
+    """
+    results = {}
+    try:
+        db = initialize_firebase()
+    except Exception as e:
+        print(f"❌ Firestoreへの接続に失敗しました: {e}")
+        return {document["id"]: False for document in documents}
+    
+    collection = db.collection("scrapcast_tweets")
+    for start in range(0, len(documents), FIRESTORE_BATCH_LIMIT):
+        chunk = documents[start:start + FIRESTORE_BATCH_LIMIT]
+        batch = db.batch()
+        for document in chunk:
+            batch.create(collection.document(tweet_document_key(document["id"])), document)
+        try:
+            with metrics.timer("firestore_write"):
+                batch.commit()
+            print(f"✅ ツイート {len(chunk)} 件をFirestoreにまとめて保存しました")
+            results.update({document["id"]: True for document in chunk})
+        except Exception as e:
+            # バッチは全件失敗になるので、どのドキュメントが書けないのか1件ずつ確かめる
+            print(f"⚠️ Firestoreへの一括保存に失敗しました。1件ずつ保存し直します: {e}")
+            for document in chunk:
+                try:
+                    collection.document(tweet_document_key(document["id"])).create(document)
+                    results[document["id"]] = True
+                except AlreadyExists:
+                    print(f"⚠️  ツイート {document['id']} は既にFirestoreに存在します")
+                    results[document["id"]] = True
+                except Exception as e:
+                    print(f"❌ ツイート {document['id']} のFirestoreへの保存に失敗しました: {e}")
+                    metrics.increment("errors")
+                    results[document["id"]] = False
+    return results
+
 def check_tweet_exists_in_firestore(tweet_id):
     """Check if tweet already exists in Firestore to avoid duplicates"""
     try:
-        db = initialize_firebase()
-        doc_ref = db.collection("scrapcast_tweets").document(tweet_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
+        if find_existing_tweet_ids([tweet_id]):
             print(f"⚠️  ツイート {tweet_id} は既にFirestoreに存在します")
             return True
         return False
@@ -136,6 +795,101 @@ def check_tweet_exists_in_firestore(tweet_id):
         print(f"❌ Firestore重複チェックに失敗しました: {e}")
         return False
 
+def find_existing_tweet_ids(tweet_ids):
+    """
+    1回のget_allで、Firestoreに既に存在するツイートIDの集合を返す
+    （TWEET_KEY_LEGACY_LOOKUP の間は旧形式のキーも同じget_allで引く）
+    """
+    if not tweet_ids:
+        return set()
+    db = initialize_firebase()
+    collection = db.collection("scrapcast_tweets")
+    refs = [collection.document(tweet_document_key(tweet_id)) for tweet_id in tweet_ids]
+    if TWEET_KEY_LEGACY_LOOKUP:
+        refs += [collection.document(tweet_id) for tweet_id in tweet_ids]
+    with metrics.timer("dedup"):
+        return {tweet_id_from_document_key(doc.id) for doc in db.get_all(refs) if doc.exists}
+
+# --- Duplicate Detection ---
+
+class BloomFilter:
+    """
+    処理済みツイートIDのBloomフィルタ。
+    保存済みの全IDを読み込んでおけば、「含まれない」と判定したIDは未処理なのでFirestoreへの問い合わせを省ける。
+    「含まれる」は偽陽性がありうるので、get_allで確認する。
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self._size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self._hash_count = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:16], "big") | 1
+        return [(h1 + i * h2) % self._size for i in range(self._hash_count)]
+
+    def add(self, key):
+        with self._lock:
+            for position in self._positions(key):
+                self._bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(self._bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+seen_tweet_filter = None
+
+def warm_seen_tweet_filter(enabled=SEEN_FILTER):
+    """
+    保存済みの全ツイートIDでBloomフィルタを初期化する。
+    一部だけを読み込むと、読み込まなかった古いツイートを「未処理」と誤判定してしまうので必ず全件を読む。
+    ドキュメント本体は不要なのでキーだけを取得する。
+    """
+    global seen_tweet_filter
+    if not enabled:
+        return
+    try:
+        db = initialize_firebase()
+        query = db.collection("scrapcast_tweets").select(["__name__"])
+        tweet_ids = [tweet_id_from_document_key(doc.id) for doc in query.stream()]
+        # 起動後に保存する分も偽陽性率を保てるよう、余裕を持たせた容量にする
+        bloom = BloomFilter(capacity=max(len(tweet_ids) * 2, 1024))
+        for tweet_id in tweet_ids:
+            bloom.add(tweet_id)
+        seen_tweet_filter = bloom
+        print(f"✅ 処理済みツイートID {len(tweet_ids)} 件でBloomフィルタを初期化しました")
+    except Exception as e:
+        print(f"⚠️ Bloomフィルタの初期化に失敗しました。全件をFirestoreで重複チェックします: {e}")
+
+def filter_processed_tweet_ids(tweet_ids):
+    """
+    tweet_idsのうち処理済みのIDの集合を返す。
+    Bloomフィルタが使える場合は「含まれるかもしれない」IDだけをget_allで確認する。
+    """
+    candidates = list(tweet_ids)
+    if seen_tweet_filter is not None:
+        candidates = [tweet_id for tweet_id in candidates if tweet_id in seen_tweet_filter]
+    if not candidates:
+        return set()
+    try:
+        existing = find_existing_tweet_ids(candidates)
+    except Exception as e:
+        print(f"❌ Firestore重複チェックに失敗しました: {e}")
+        return set()
+    for tweet_id in existing:
+        print(f"⚠️  ツイート {tweet_id} は既にFirestoreに存在します")
+    return existing
+
+def mark_tweets_processed(tweet_ids):
+    """保存できたツイートIDをBloomフィルタに追加する"""
+    if seen_tweet_filter is None:
+        return
+    for tweet_id in tweet_ids:
+        seen_tweet_filter.add(tweet_id)
+
 # --- GitHub Variable Helpers ---
 
 def _get_github_api_headers():
@@ -148,23 +902,23 @@ def _get_github_api_headers():
         "X-GitHub-Api-Version": "2022-11-28"
     }
 
-def _get_variable_url():
+def _get_variable_url(var_name=LAST_TWEET_ID_VAR_NAME):
     if not GITHUB_REPOSITORY:
         # This error should only be raised in a CI environment
         raise EnvironmentError("GITHUB_REPOSITORY が環境変数に設定されていません")
-    return f"https://api.github.com/repos/{GITHUB_REPOSITORY}/actions/variables/{LAST_TWEET_ID_VAR_NAME}"
+    return f"https://api.github.com/repos/{GITHUB_REPOSITORY}/actions/variables/{var_name}"
 
-def _get_github_variable():
+def _get_github_variable(var_name=LAST_TWEET_ID_VAR_NAME):
     """Fetches the last tweet ID from GitHub repository variables."""
     print("GitHub Actions環境を検出しました。GitHub Variableからlast_tweet_idを読み込みます。")
     try:
-        response = requests.get(_get_variable_url(), headers=_get_github_api_headers())
+        response = http_client.get(_get_variable_url(var_name), headers=_get_github_api_headers())
         if response.status_code == 200:
             value = response.json().get("value")
-            print(f"GitHub Variable '{LAST_TWEET_ID_VAR_NAME}' からID {value} を取得しました。")
+            print(f"GitHub Variable '{var_name}' からID {value} を取得しました。")
             return value
         elif response.status_code == 404:
-            print(f"GitHub Variable '{LAST_TWEET_ID_VAR_NAME}' が見つかりません。最初からツイートを検索します。")
+            print(f"GitHub Variable '{var_name}' が見つかりません。最初からツイートを検索します。")
             return None
         else:
             response.raise_for_status()
@@ -172,76 +926,662 @@ def _get_github_variable():
         print(f"GitHub Variableの読み込みに失敗しました: {e}")
         return None
 
-def _set_github_variable(tweet_id):
+def _set_github_variable(tweet_id, var_name=LAST_TWEET_ID_VAR_NAME):
     """Creates or updates the last tweet ID in GitHub repository variables."""
-    print(f"GitHub Variable '{LAST_TWEET_ID_VAR_NAME}' にID {tweet_id} を保存します。")
+    print(f"GitHub Variable '{var_name}' にID {tweet_id} を保存します。")
     headers = _get_github_api_headers()
-    url = _get_variable_url()
+    url = _get_variable_url(var_name)
     data = {"value": str(tweet_id)}
 
     try:
         # First, try to update the variable
-        response = requests.patch(url, headers=headers, json=data)
+        # 同じ値を設定し直すだけなので、5xxの後に送り直しても副作用は増えない
+        response = http_client.patch(url, headers=headers, json=data, idempotent=True)
         if response.status_code == 204:
-            print(f"GitHub variable '{LAST_TWEET_ID_VAR_NAME}' を更新しました。")
-            return
+            print(f"GitHub variable '{var_name}' を更新しました。")
+            return True
 
         # If it doesn't exist (404), create it
         if response.status_code == 404:
             create_url = f"https://api.github.com/repos/{GITHUB_REPOSITORY}/actions/variables"
-            create_data = {"name": LAST_TWEET_ID_VAR_NAME, "value": str(tweet_id)}
-            create_response = requests.post(create_url, headers=headers, json=create_data)
+            create_data = {"name": var_name, "value": str(tweet_id)}
+            create_response = http_client.post(create_url, headers=headers, json=create_data)
             create_response.raise_for_status()
-            print(f"GitHub variable '{LAST_TWEET_ID_VAR_NAME}' を作成しました。")
-        else:
-            response.raise_for_status()
+            print(f"GitHub variable '{var_name}' を作成しました。")
+            return True
+        response.raise_for_status()
+        return False
     except Exception as e:
         print(f"GitHub Variableの更新に失敗しました: {e}")
+        return False
 
 # --- Tweet ID Persistence ---
 
-def load_last_tweet_id():
-    if IS_CI:
-        return _get_github_variable()
-    else:
-        print("ローカル環境を検出しました。ファイルからlast_tweet_idを読み込みます。")
+class CheckpointStore(ABC):
+    """
+    チェックポイント（ここまでは全て処理済みという低水位のツイートID）の保存先。
+    読み込み結果はプロセス内でキャッシュし、値が進むときだけ書き込む。
+    """
+
+    def __init__(self):
+        self._cached = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if not self._loaded:
+                self._cached = self._read()
+                self._loaded = True
+            return self._cached
+
+    def commit(self, tweet_id):
+        """tweet_idが現在のチェックポイントより新しいときだけ保存する。保存したらTrueを返す"""
+        tweet_id = str(tweet_id)
+        self.load()
+        with self._lock:
+            # 他のスレッドが先に進めているかもしれないので、ロックの中でキャッシュと比べる
+            current = self._cached
+            if current and int(tweet_id) <= int(current):
+                return False
+            with metrics.timer("checkpoint"):
+                stored = self._write(tweet_id)
+            if stored is None:
+                metrics.increment("errors")
+                return False
+            # 保存先が既に先へ進んでいたら、その値をキャッシュする（後退させない）
+            self._cached = max(stored, tweet_id, key=int)
+            return self._cached == tweet_id
+
+    @abstractmethod
+    def _read(self):
+        """保存されているツイートID（なければNone）"""
+
+    @abstractmethod
+    def _write(self, tweet_id):
+        """
+        tweet_idを保存し、保存先の値（他のプロセスが先に進めていればその値）を返す。
+        保存できなければNoneを返す。
+        """
+
+class FileCheckpointStore(CheckpointStore):
+    """ローカルファイルに保存する（一時ファイルからのrenameで原子的に置き換える）"""
+
+    def __init__(self, filename=LAST_TWEET_ID_FILENAME):
+        super().__init__()
+        self._filename = filename
+
+    def _read(self):
+        print(f"ファイル '{self._filename}' からlast_tweet_idを読み込みます。")
         try:
-            with open(LAST_TWEET_ID_FILENAME, 'r') as f:
+            with open(self._filename, 'r') as f:
                 content = f.read().strip()
                 return content if content else None
         except FileNotFoundError:
             return None
 
-def save_last_tweet_id(tweet_id):
-    if IS_CI:
-        _set_github_variable(tweet_id)
-    else:
-        print(f"ファイル '{LAST_TWEET_ID_FILENAME}' にID {tweet_id} を保存します。")
-        with open(LAST_TWEET_ID_FILENAME, 'w') as f:
-            f.write(str(tweet_id))
+    def _write(self, tweet_id):
+        print(f"ファイル '{self._filename}' にID {tweet_id} を保存します。")
+        tmp_filename = f"{self._filename}.tmp"
+        with open(tmp_filename, 'w') as f:
+            f.write(tweet_id)
+        os.replace(tmp_filename, self._filename)
+        return tweet_id
+
+class FirestoreCheckpointStore(CheckpointStore):
+    """Firestoreのドキュメントに保存する（トランザクションで後退しないように更新する）"""
+
+    def __init__(self, collection=CHECKPOINT_COLLECTION, document=CHECKPOINT_DOCUMENT):
+        super().__init__()
+        self._collection = collection
+        self._document = document
+
+    def _doc_ref(self):
+        return initialize_firebase().collection(self._collection).document(self._document)
+
+    def _read(self):
+        print(f"Firestore '{self._collection}/{self._document}' からlast_tweet_idを読み込みます。")
+        try:
+            doc = self._doc_ref().get()
+            return doc.to_dict().get("last_tweet_id") if doc.exists else None
+        except Exception as e:
+            print(f"Firestoreからのチェックポイント読み込みに失敗しました: {e}")
+            return None
+
+    def _write(self, tweet_id):
+        print(f"Firestore '{self._collection}/{self._document}' にID {tweet_id} を保存します。")
+        db = initialize_firebase()
+        doc_ref = self._doc_ref()
+
+        @firestore.transactional
+        def _advance(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            stored = snapshot.to_dict().get("last_tweet_id") if snapshot.exists else None
+            if stored and int(stored) >= int(tweet_id):
+                return stored
+            transaction.set(doc_ref, {"last_tweet_id": tweet_id, "updated_at": datetime.now(timezone.utc)})
+            return tweet_id
+
+        try:
+            return _advance(db.transaction())
+        except Exception as e:
+            print(f"Firestoreへのチェックポイント保存に失敗しました: {e}")
+            return None
+
+class GithubVariableCheckpointStore(CheckpointStore):
+    """GitHub Actionsのリポジトリ変数に保存する"""
+
+    def __init__(self, var_name=LAST_TWEET_ID_VAR_NAME):
+        super().__init__()
+        self._var_name = var_name
+
+    def _read(self):
+        return _get_github_variable(self._var_name)
+
+    def _write(self, tweet_id):
+        return tweet_id if _set_github_variable(tweet_id, self._var_name) else None
+
+CHECKPOINT_BACKENDS = {
+    "file": FileCheckpointStore,
+    "firestore": FirestoreCheckpointStore,
+    "github": GithubVariableCheckpointStore,
+}
+
+def create_checkpoint_store(backend=CHECKPOINT_BACKEND, shard=DEFAULT_SEARCH_SHARD):
+    """
+    シャードごとのチェックポイントの保存先。既定のシャードは従来の保存先をそのまま使い、
+    それ以外はファイル名・ドキュメント名・変数名にシャード名を付ける。
+    """
+    if backend not in CHECKPOINT_BACKENDS:
+        raise EnvironmentError(f"CHECKPOINT_BACKEND の値が不正です: {backend} (file / firestore / github)")
+    if shard == DEFAULT_SEARCH_SHARD:
+        return CHECKPOINT_BACKENDS[backend]()
+    if backend == "file":
+        stem, ext = os.path.splitext(LAST_TWEET_ID_FILENAME)
+        return FileCheckpointStore(f"{stem}.{shard}{ext}")
+    if backend == "firestore":
+        return FirestoreCheckpointStore(document=f"{CHECKPOINT_DOCUMENT}_{shard}")
+    return GithubVariableCheckpointStore(f"{LAST_TWEET_ID_VAR_NAME}_{shard.upper()}")
+
+checkpoint_stores = {shard: create_checkpoint_store(shard=shard) for shard in SEARCH_SHARDS}
+checkpoint_store = checkpoint_stores.get(DEFAULT_SEARCH_SHARD) or create_checkpoint_store()
+
+def load_last_tweet_id(shard=DEFAULT_SEARCH_SHARD):
+    return checkpoint_stores.get(shard, checkpoint_store).load()
+
+def save_last_tweet_id(tweet_id, shard=DEFAULT_SEARCH_SHARD):
+    return checkpoint_stores.get(shard, checkpoint_store).commit(tweet_id)
+
+# --- Shard Leases ---
+
+class ShardLeases:
+    """
+    シャードの担当を Firestore のリースで取り合う。
+    acquire で空いている（期限切れを含む）シャードと自分が持っているシャードをトランザクションで確保・延長し、
+    持っている間はバックグラウンドで延長し続ける。release で手放すと他のインスタンスがすぐに引き継げる。
+    """
+
+    def __init__(self, owner=WATCHER_ID, lease_seconds=WATCHER_LEASE_SECONDS):
+        self._owner = owner
+        self._lease_seconds = lease_seconds
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def _doc_ref(self, shard):
+        return initialize_firebase().collection(CHECKPOINT_COLLECTION).document(f"{WATCHER_LEASE_PREFIX}{shard}")
+
+    def _try_acquire(self, shard):
+        doc_ref = self._doc_ref(shard)
+
+        @firestore.transactional
+        def _acquire(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            lease = snapshot.to_dict() if snapshot.exists else {}
+            now = datetime.now(timezone.utc)
+            if lease.get("owner") not in (None, self._owner) and lease.get("expires_at") and lease["expires_at"] > now:
+                return False
+            transaction.set(doc_ref, {
+                "owner": self._owner,
+                "expires_at": now + timedelta(seconds=self._lease_seconds),
+                "renewed_at": now,
+            })
+            return True
+
+        try:
+            return _acquire(initialize_firebase().transaction())
+        except Exception as e:
+            print(f"⚠️ [{shard}] リースの取得に失敗しました: {e}")
+            return False
+
+    def _release_one(self, shard):
+        doc_ref = self._doc_ref(shard)
+
+        @firestore.transactional
+        def _release(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.to_dict().get("owner") == self._owner:
+                transaction.delete(doc_ref)
+
+        try:
+            _release(initialize_firebase().transaction())
+        except Exception as e:
+            print(f"⚠️ [{shard}] リースの解放に失敗しました: {e}")
+
+    def acquire(self, shards):
+        """shards（名前 -> クエリ）のうち、確保できたものだけを同じ形で返す"""
+        held = OrderedDict((shard, query) for shard, query in shards.items() if self._try_acquire(shard))
+        with self._lock:
+            gained = set(held) - self._held
+            lost = (self._held & set(shards)) - set(held)
+            self._held = (self._held - set(shards)) | set(held)
+        if gained:
+            print(f"🔒 シャード {', '.join(sorted(gained))} の担当になりました ({self._owner})")
+        if lost:
+            print(f"🔓 シャード {', '.join(sorted(lost))} は他のインスタンスに引き継がれました")
+        metrics.increment("shard_leases_lost", len(lost))
+        if self._renewer is None:
+            self._renewer = threading.Thread(target=self._renew_loop, name="lease-renewer", daemon=True)
+            self._renewer.start()
+        return held
+
+    def holds(self, shard):
+        with self._lock:
+            return shard in self._held
+
+    def _renew_loop(self):
+        # 期限の1/3ごとに延長するので、1回失敗しても期限切れにはならない
+        while not self._stop.wait(self._lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            for shard in held:
+                if not self._try_acquire(shard):
+                    print(f"🔓 シャード {shard} のリースを延長できませんでした")
+                    with self._lock:
+                        self._held.discard(shard)
+
+    def release(self):
+        """持っているリースをすべて手放す（終了時）"""
+        self._stop.set()
+        with self._lock:
+            held, self._held = self._held, set()
+        for shard in held:
+            self._release_one(shard)
+
+shard_leases = ShardLeases()
+
+# --- URL Resolution ---
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'\u3000]+')
+
+def extract_urls_from_tweet(tweet):
+    """
+    ツイートの entities.urls から展開済みのURLを取り出す
+    entitiesがない場合だけ本文を正規表現で走査する
+    """
+    entities = tweet.get("entities")
+    if entities is None:
+        return extract_urls_from_text(tweet.get("text", ""))
+    urls = []
+    for entity in entities.get("urls", []):
+        # 画像・動画の添付はリンクとして扱わない
+        if entity.get("media_key"):
+            continue
+        url = entity.get("unwound_url") or entity.get("expanded_url") or entity.get("url")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+def is_short_url(url):
+    return urlsplit(url).netloc.lower() in SHORT_URL_HOSTS
+
+def _url_cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+
+class UrlResolver:
+    """
+    短縮URLをリダイレクト先の最終URLに展開する。
+    展開はページ単位でまとめて並行実行し、結果はプロセス内とFirestoreにキャッシュする。
+    """
+
+    def __init__(self, concurrency=URL_RESOLVE_CONCURRENCY, timeout=URL_RESOLVE_TIMEOUT):
+        self._concurrency = concurrency
+        # 展開は失敗しても元のURLを使えばよいので、再試行は1回だけにする
+        self._client = HttpClient(timeout=timeout, max_retries=1, pool_size=concurrency)
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    def _load_cached(self, urls):
+        try:
+            db = initialize_firebase()
+            collection = db.collection(URL_CACHE_COLLECTION)
+            refs = [collection.document(_url_cache_key(url)) for url in urls]
+            found = {}
+            for doc in db.get_all(refs):
+                if doc.exists:
+                    data = doc.to_dict()
+                    found[data["url"]] = data["resolved_url"]
+            return found
+        except Exception as e:
+            print(f"⚠️ URLキャッシュの読み込みに失敗しました: {e}")
+            return {}
+
+    def _save_cached(self, resolved):
+        try:
+            db = initialize_firebase()
+        except Exception as e:
+            print(f"⚠️ URLキャッシュの保存に失敗しました: {e}")
+            return
+        collection = db.collection(URL_CACHE_COLLECTION)
+        items = list(resolved.items())
+        # 1バッチの書き込み上限ごとに分けて保存する（失敗したバッチの分は次回また展開する）
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for url, resolved_url in items[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(collection.document(_url_cache_key(url)), {
+                    "url": url,
+                    "resolved_url": resolved_url,
+                    "resolved_at": datetime.now(timezone.utc),
+                })
+            try:
+                batch.commit()
+            except Exception as e:
+                print(f"⚠️ URLキャッシュの保存に失敗しました: {e}")
+
+    def _resolve_one(self, url):
+        try:
+            response = self._client.head(url, allow_redirects=True)
+            if response.status_code in (403, 405):
+                # HEADを受け付けないサイトはGETでヘッダーだけ読む
+                response = self._client.get(url, allow_redirects=True, stream=True)
+                response.close()
+            return response.url or url
+        except Exception as e:
+            print(f"⚠️ 短縮URLの展開に失敗しました: {url} ({e})")
+            return None
+
+    def resolve_many(self, urls):
+        """{元のURL: 最終URL} を返す（短縮URL以外や展開に失敗したURLは元のまま）"""
+        short_urls = list(dict.fromkeys(url for url in urls if is_short_url(url)))
+        result = {url: url for url in urls}
+        if not short_urls:
+            return result
+
+        with self._lock:
+            misses = [url for url in short_urls if url not in self._resolved]
+        if misses:
+            cached = self._load_cached(misses)
+            with self._lock:
+                self._resolved.update(cached)
+            misses = [url for url in misses if url not in cached]
+        metrics.increment("url_cache_hits", len(short_urls) - len(misses))
+
+        if misses:
+            with metrics.timer("url_resolve"):
+                with ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix="resolve") as pool:
+                    resolved = dict(zip(misses, pool.map(self._resolve_one, misses)))
+            resolved = {url: resolved_url for url, resolved_url in resolved.items() if resolved_url}
+            print(f"🔗 短縮URL {len(resolved)}/{len(misses)} 件を展開しました")
+            with self._lock:
+                self._resolved.update(resolved)
+            self._save_cached(resolved)
+
+        with self._lock:
+            for url in short_urls:
+                result[url] = self._resolved.get(url, url)
+        return result
+
+url_resolver = UrlResolver()
+
+def resolve_context_urls(contexts):
+    """ページ内の全contextの引用元URLをまとめて展開し、quoted_urlsを置き換える"""
+    urls = [url for context in contexts for url in context["quoted_urls"]]
+    if not urls:
+        return
+    resolved = url_resolver.resolve_many(urls)
+    for context in contexts:
+        context["quoted_urls"] = list(dict.fromkeys(resolved[url] for url in context["quoted_urls"]))
+
+# --- Summary Providers ---
+
+# ヘッジがあるので要約リクエスト自体の再試行は1回まで（予算内に収める）
+summary_http_client = HttpClient(timeout=SUMMARY_LATENCY_BUDGET, max_retries=1)
+
+class SummaryProvider(ABC):
+    """
+    要約モデルの呼び出し口。成功したリクエストのレイテンシを覚えておき、ヘッジの基準になるp95を返す。
+    単体分析とJSONでのバッチ分析はレイテンシの分布が違うので別々に集計する。
+    再試行やレート制限の待ちも含めて timeout 秒以内に終え、収まらなければ待たずに失敗を返す。
+    """
+
+    name = None
+
+    def __init__(self, model, api_key, client=summary_http_client):
+        self.model = model
+        self._api_key = api_key
+        self._client = client
+        self._latencies = {False: deque(maxlen=SUMMARY_LATENCY_WINDOW), True: deque(maxlen=SUMMARY_LATENCY_WINDOW)}
+        self._lock = threading.Lock()
+
+    def available(self):
+        return bool(self._api_key)
+
+    def p95(self, json_mode=False):
+        """直近のレイテンシのp95（秒）。サンプルが少なければNone"""
+        with self._lock:
+            samples = sorted(self._latencies[json_mode])
+        if len(samples) < SUMMARY_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[max(0, math.ceil(len(samples) * 0.95) - 1)]
+
+    def generate(self, prompt, max_output_tokens, json_mode=False, timeout=SUMMARY_LATENCY_BUDGET):
+        """生成されたテキストを返す（失敗時はNone）"""
+        metrics.increment(f"{self.name}_requests")
+        start = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        with metrics.timer(self.name):
+            text = self._generate(prompt, max_output_tokens, json_mode, deadline)
+        if text is None:
+            metrics.increment("errors")
+        else:
+            with self._lock:
+                self._latencies[json_mode].append(time.perf_counter() - start)
+        return text
+
+    @abstractmethod
+    def _generate(self, prompt, max_output_tokens, json_mode, deadline):
+        """deadline（time.monotonic()）までに生成したテキストを返す（失敗時はNone）"""
+
+class GeminiProvider(SummaryProvider):
+    name = "gemini"
+
+    def _generate(self, prompt, max_output_tokens, json_mode, deadline):
+        headers = {
+            'Content-Type': 'application/json',
+            'x-goog-api-key': self._api_key,
+        }
+        
+        generation_config = {
+            'temperature': 0.3,
+            'topK': 40,
+            'topP': 0.95,
+            'maxOutputTokens': max_output_tokens,
+        }
+        if json_mode:
+            generation_config['responseMimeType'] = "application/json"
+        
+        data = {
+            'contents': [{
+                'parts': [{'text': prompt}]
+            }],
+            'generationConfig': generation_config
+        }
+        
+        response = self._client.post(GEMINI_URL, headers=headers, json=data, deadline=deadline)
+        if response.status_code != 200:
+            print(f"Gemini APIエラー: {response.status_code}, {response.text}")
+            return None
+        
+        result = response.json()
+        return result['candidates'][0]['content']['parts'][0]['text']
+
+class OpenAICompatibleProvider(SummaryProvider):
+    name = "openai"
+
+    def _generate(self, prompt, max_output_tokens, json_mode, deadline):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {self._api_key}',
+        }
+        # json_objectモードはトップレベルが配列の出力を許さないので、JSONはプロンプトで指示する
+        data = {
+            'model': self.model,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'temperature': 0.3,
+            'max_tokens': max_output_tokens,
+        }
+        
+        response = self._client.post(f"{OPENAI_API_BASE}/chat/completions", headers=headers, json=data,
+                                     deadline=deadline)
+        if response.status_code != 200:
+            print(f"OpenAI APIエラー: {response.status_code}, {response.text}")
+            return None
+        
+        text = response.json()['choices'][0]['message']['content']
+        if json_mode:
+            # ```json ... ``` で囲まれて返ることがあるので中身だけにする
+            text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text.strip())
+        return text
+
+SUMMARY_PROVIDER_CLASSES = {
+    "gemini": lambda: GeminiProvider(GEMINI_MODEL, GEMINI_API_KEY),
+    "openai": lambda: OpenAICompatibleProvider(OPENAI_MODEL, OPENAI_API_KEY),
+}
+
+class HedgedSummarizer:
+    """
+    先頭のプロバイダに送り、そのp95を超えても返ってこなければ次のプロバイダ（1つしかなければ同じもの）に
+    ヘッジを送る。先に成功した方を採用し、もう一方は取り消して結果を捨てる。
+    送信済みのHTTPリクエストは途中で止められないので、残った方は予算のタイムアウトで打ち切られる。
+    """
+
+    def __init__(self, providers, budget=SUMMARY_LATENCY_BUDGET, hedge_delay=SUMMARY_HEDGE_DELAY,
+                 max_workers=GEMINI_CONCURRENCY * 2):
+        self.providers = [provider for provider in providers if provider.available()]
+        if not self.providers:
+            raise EnvironmentError("利用できる要約プロバイダがありません（SUMMARY_PROVIDERS とAPIキーを確認してください）")
+        self._budget = budget
+        self._hedge_delay = hedge_delay
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summarize")
+
+    def generate(self, prompt, max_output_tokens, json_mode=False):
+        """
+        (生成されたテキスト, 使用状況) を返す。予算内に得られなければ (None, None)
+        使用状況: {provider, model, latency_ms, hedged}
+        """
+        primary = self.providers[0]
+        backup = self.providers[1] if len(self.providers) > 1 else primary
+        hedge_delay = primary.p95(json_mode) or self._hedge_delay
+        start = time.perf_counter()
+        deadline = start + self._budget
+        
+        futures = {self._pool.submit(primary.generate, prompt, max_output_tokens, json_mode, self._budget): (primary, False)}
+        hedged = False
+        while futures:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            timeout = deadline - now if hedged else max(0.0, min(deadline, start + hedge_delay) - now)
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider, is_hedge = futures.pop(future)
+                try:
+                    text = future.result()
+                except Exception as e:
+                    print(f"{provider.name} の要約リクエストでエラーが発生しました: {e}")
+                    text = None
+                if text is None:
+                    continue
+                for other in futures:
+                    other.cancel()
+                if futures:
+                    metrics.increment("summary_hedges_cancelled", len(futures))
+                if is_hedge:
+                    metrics.increment("summary_hedge_wins")
+                latency_ms = round((time.perf_counter() - start) * 1000)
+                return text, {"provider": provider.name, "model": provider.model,
+                              "latency_ms": latency_ms, "hedged": hedged}
+            
+            if not hedged and (done or time.perf_counter() - start >= hedge_delay):
+                # 先頭が失敗したか、p95を超えても返ってこない
+                hedged = True
+                metrics.increment("summary_hedges")
+                remaining = max(0.0, deadline - time.perf_counter())
+                reason = "失敗した" if done else f"{hedge_delay:.1f} 秒以内に応答がない"
+                print(f"⏱️ {primary.name} が{reason}ため、{backup.name} にもリクエストします")
+                futures[self._pool.submit(backup.generate, prompt, max_output_tokens, json_mode, remaining)] = (backup, True)
+        
+        for future in futures:
+            future.cancel()
+        metrics.increment("summary_timeouts" if futures else "summary_failures")
+        print(f"❌ {self._budget:.0f} 秒の予算内に要約を得られませんでした")
+        return None, None
+
+summarizer = HedgedSummarizer([SUMMARY_PROVIDER_CLASSES[name]() for name in SUMMARY_PROVIDERS
+                               if name in SUMMARY_PROVIDER_CLASSES])
 
 # --- AI Analysis Logic ---
 
 def extract_urls_from_text(text):
     """
-    テキストからURLを抽出
+    テキストからURLを抽出（entitiesがない場合のフォールバック）
     """
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-    urls = re.findall(url_pattern, text)
-    return urls
+    return URL_PATTERN.findall(text)
+
+def _format_jst(created_at):
+    """日時を日本時間の 'YYYY-MM-DD HH:MM' 形式に変換"""
+    jst_time = created_at.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=9)))
+    return jst_time.strftime('%Y-%m-%d %H:%M')
+
+def format_analysis(formatted_time, title, summary, tweet_url, urls):
+    """
+    分析結果を単体分析と同じ4行フォーマットに整形
+    """
+    lines = [f"### {formatted_time} {title}", summary, tweet_url]
+    lines.extend(urls)
+    return "\n".join(lines)
 
-def analyze_tweet_with_gemini(tweet_text, tweet_url, created_at):
+ANALYSIS_TIME_PREFIX = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}\s*')
+
+def parse_analysis(text):
+    """
+    4行フォーマットの分析結果を {title, summary, urls} に分解する（形式が違えばNone）
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    if len(lines) < 2 or not lines[0].startswith("### "):
+        return None
+    title = ANALYSIS_TIME_PREFIX.sub("", lines[0][4:]).strip()
+    summary = lines[1]
+    if not title or not summary:
+        return None
+    # 3行目はツイートURL（引用ごとに付け直す）、4行目以降がツイート内のURL
+    urls = [line for line in lines[3:] if line]
+    return {"title": title, "summary": summary, "urls": urls}
+
+def analyze_tweet(tweet_text, tweet_url, created_at, urls=None):
     """
-    Gemini FlashでツイートをAI分析
+    ツイートをAI分析（要約プロバイダはsummarizerが選ぶ）
+    urls: 展開済みのツイート内URL（Noneなら本文から抽出する）
+    戻り値: (分析結果, 使用状況)。失敗時は (None, None)
     """
     try:
         # URLを抽出
-        extracted_urls = extract_urls_from_text(tweet_text)
+        extracted_urls = urls if urls is not None else extract_urls_from_text(tweet_text)
         urls_text = '\n'.join(extracted_urls) if extracted_urls else ''
         
         # 日本時間に変換
-        jst_time = created_at.replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=9)))
-        formatted_time = jst_time.strftime('%Y-%m-%d %H:%M')
+        formatted_time = _format_jst(created_at)
         
         prompt = f"""以下のツイートを分析して、指定されたフォーマットで出力してください。
 
@@ -269,49 +1609,240 @@ Reactの新しいConcurrent Featuresにより、UIの応答性が大幅に改善
 https://twitter.com/username/status/1234567890
 https://react.dev/blog/react-18"""
 
-        # Gemini API呼び出し
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        data = {
-            'contents': [{
-                'parts': [{'text': prompt}]
-            }],
-            'generationConfig': {
-                'temperature': 0.3,
-                'topK': 40,
-                'topP': 0.95,
-                'maxOutputTokens': 200,
-            }
-        }
+        generated_text, usage = summarizer.generate(prompt, max_output_tokens=200)
+        if generated_text is None:
+            return None, None
         
-        response = requests.post(
-            f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={GEMINI_API_KEY}',
-            headers=headers,
-            json=data
-        )
-        
-        if response.status_code != 200:
-            print(f"Gemini APIエラー: {response.status_code}, {response.text}")
-            return None
-        
-        result = response.json()
-        generated_text = result['candidates'][0]['content']['parts'][0]['text']
-        
-        print("========== AI分析結果 ==========")
+        print(f"========== AI分析結果 ({usage['provider']}, {usage['latency_ms']} ms) ==========")
         print(generated_text)
         print("===============================")
         
-        return generated_text.strip()
+        return generated_text.strip(), usage
         
     except Exception as e:
         print(f"AI分析エラー: {e}")
+        return None, None
+
+def _validate_batch_item(item, count):
+    """バッチ分析のレスポンス要素を検証し、問題なければ (index, title, summary, urls) を返す"""
+    if not isinstance(item, dict):
+        return None
+    index = item.get("index")
+    title = item.get("title")
+    summary = item.get("summary")
+    urls = item.get("urls", [])
+    if not isinstance(index, int) or not 0 <= index < count:
+        return None
+    if not isinstance(title, str) or not title.strip():
         return None
+    if not isinstance(summary, str) or not summary.strip():
+        return None
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return None
+    return index, title.strip(), summary.strip(), [url.strip() for url in urls if url.strip()]
+
+def analyze_tweets_batch(items):
+    """
+    複数のツイートを1回のモデル呼び出しでまとめてAI分析する
+    items: (tweet_text, tweet_url, created_at, urls) のリスト（urlsがNoneなら本文から抽出する）
+    戻り値: itemsと同じ順番の (分析結果, 使用状況) のリスト
+    解析できたレスポンスの中で検証に失敗した要素だけ単体分析にフォールバックする。
+    呼び出し自体の失敗（タイムアウト・5xx・JSONとして読めない応答）では全件を失敗として返し、
+    要約の再試行ステージに任せる（障害中に1回の呼び出しをN+1回に増やさない）
+    """
+    if len(items) == 1:
+        return [analyze_tweet(*items[0])]
+    
+    results = [(None, None)] * len(items)
+    try:
+        entries = []
+        for index, (tweet_text, tweet_url, created_at, urls) in enumerate(items):
+            extracted_urls = urls if urls is not None else extract_urls_from_text(tweet_text)
+            entries.append(f"""[{index}]
+ツイート内容: {tweet_text}
+ツイートURL: {tweet_url}
+ツイート内のURL: {' '.join(extracted_urls)}""")
+        entries_text = "\n\n".join(entries)
+        
+        prompt = f"""以下の{len(items)}件のツイートをそれぞれ分析して、JSON配列で出力してください。
+
+{entries_text}
+
+出力フォーマット（JSON配列のみを出力）:
+[{{"index": 入力の番号, "title": "内容を要約した短いタイトル", "summary": "ツイート内容の要約", "urls": ["ツイート内のURL"]}}]
+
+注意事項:
+- 入力1件につき1要素、indexは入力の [番号] と同じ整数
+- タイトルは20文字以内で簡潔に
+- 要約は1行100文字以内で
+- urlsはツイート内のURLの配列、なければ空配列
+- 技術的な内容は正確に
+- 日本語で出力"""
+
+        generated_text, usage = summarizer.generate(
+            prompt,
+            max_output_tokens=min(200 * len(items), 8192),
+            json_mode=True
+        )
+        if not generated_text:
+            print("バッチAI分析エラー: 応答がありませんでした")
+            return results
+        parsed = json.loads(generated_text)
+        if not isinstance(parsed, list):
+            print("バッチAI分析エラー: 応答がJSON配列ではありません")
+            return results
+        
+        for item in parsed:
+            validated = _validate_batch_item(item, len(items))
+            if not validated:
+                continue
+            index, title, summary, urls = validated
+            _, tweet_url, created_at, _ = items[index]
+            results[index] = (format_analysis(_format_jst(created_at), title, summary, tweet_url, urls), usage)
+    except Exception as e:
+        print(f"バッチAI分析エラー: {e}")
+        return [(None, None)] * len(items)
+    
+    # 検証に失敗した要素だけ単体で分析し直す
+    failed = [index for index, (result, _) in enumerate(results) if result is None]
+    if failed:
+        print(f"⚠️ バッチ分析で {len(failed)}/{len(items)} 件の結果が得られなかったため、単体で分析します")
+    for index in failed:
+        results[index] = analyze_tweet(*items[index])
+    
+    return results
+
+# --- Summary Cache ---
+
+def summary_cache_version(provider, model):
+    """要約を作ったプロバイダとモデル、プロンプトのバージョンから要約キャッシュのバージョンハッシュを作る"""
+    source = f"{provider}:{model}:{ANALYSIS_PROMPT_VERSION}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+class SummaryCache:
+    """
+    引用元ツイートIDをキーにした要約キャッシュ。
+    プロセス内のLRUを1段目、Firestoreコレクションを2段目として使う。
+    値は {title, summary, urls, usage} で、投稿日時とツイートURLは引用ごとに付け直す。
+    要約は作ったプロバイダとモデルのバージョンで保存し、読み込むのは先頭のプロバイダ（version）のものだけにする。
+    ヘッジで別のプロバイダが作った要約は、そのプロバイダが先頭になったときに使われる。
+    """
+
+    def __init__(self, version, max_entries=SUMMARY_CACHE_SIZE, ttl_days=SUMMARY_CACHE_TTL_DAYS):
+        self.version = version
+        self._max_entries = max_entries
+        self._ttl = timedelta(days=ttl_days)
+        self._entries = OrderedDict()  # quoted_tweet_id -> (値, 有効期限)
+        self._lock = threading.Lock()
+
+    def _doc_id(self, quoted_tweet_id, version=None):
+        return f"{quoted_tweet_id}_{version or self.version}"
+
+    def _version_of(self, value):
+        usage = value.get("usage") or {}
+        if usage.get("provider") and usage.get("model"):
+            return summary_cache_version(usage["provider"], usage["model"])
+        return self.version
+
+    def _remember(self, quoted_tweet_id, value, expires_at):
+        with self._lock:
+            self._entries[quoted_tweet_id] = (value, expires_at)
+            self._entries.move_to_end(quoted_tweet_id)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def get_many(self, quoted_tweet_ids):
+        """キャッシュ済みの要約を {quoted_tweet_id: 値} で返す（LRUになければFirestoreを1回で引く）"""
+        now = datetime.now(timezone.utc)
+        found = {}
+        misses = []
+        with self._lock:
+            for quoted_tweet_id in quoted_tweet_ids:
+                entry = self._entries.get(quoted_tweet_id)
+                if entry and entry[1] > now:
+                    self._entries.move_to_end(quoted_tweet_id)
+                    found[quoted_tweet_id] = entry[0]
+                else:
+                    self._entries.pop(quoted_tweet_id, None)
+                    misses.append(quoted_tweet_id)
+
+        if not misses:
+            return found
+
+        try:
+            db = initialize_firebase()
+            collection = db.collection(SUMMARY_CACHE_COLLECTION)
+            refs = [collection.document(self._doc_id(quoted_tweet_id)) for quoted_tweet_id in misses]
+            for doc in db.get_all(refs):
+                if not doc.exists:
+                    continue
+                data = doc.to_dict()
+                expires_at = data.get("expires_at")
+                if not expires_at or expires_at <= now:
+                    continue
+                value = {"title": data["title"], "summary": data["summary"], "urls": data.get("urls", []),
+                         "usage": data.get("usage")}
+                found[data["quoted_tweet_id"]] = value
+                self._remember(data["quoted_tweet_id"], value, expires_at)
+        except Exception as e:
+            print(f"⚠️ 要約キャッシュの読み込みに失敗しました: {e}")
+
+        return found
+
+    def put_many(self, values):
+        """{quoted_tweet_id: 値} をLRUとFirestoreの両方に保存する"""
+        if not values:
+            return
+        now = datetime.now(timezone.utc)
+        expires_at = now + self._ttl
+        versions = {quoted_tweet_id: self._version_of(value) for quoted_tweet_id, value in values.items()}
+        for quoted_tweet_id, value in values.items():
+            if versions[quoted_tweet_id] == self.version:
+                self._remember(quoted_tweet_id, value, expires_at)
+
+        try:
+            db = initialize_firebase()
+            collection = db.collection(SUMMARY_CACHE_COLLECTION)
+            batch = db.batch()
+            for quoted_tweet_id, value in values.items():
+                version = versions[quoted_tweet_id]
+                batch.set(collection.document(self._doc_id(quoted_tweet_id, version)), {
+                    "quoted_tweet_id": quoted_tweet_id,
+                    "version": version,
+                    "title": value["title"],
+                    "summary": value["summary"],
+                    "urls": value["urls"],
+                    "usage": value.get("usage"),
+                    "created_at": now,
+                    "expires_at": expires_at,
+                })
+            batch.commit()
+        except Exception as e:
+            print(f"⚠️ 要約キャッシュの保存に失敗しました: {e}")
+
+    def invalidate(self, quoted_tweet_id):
+        """指定した引用元ツイートの要約をLRUとFirestoreから削除する（どのプロバイダが作ったものも消す）"""
+        with self._lock:
+            self._entries.pop(quoted_tweet_id, None)
+        try:
+            db = initialize_firebase()
+            query = db.collection(SUMMARY_CACHE_COLLECTION).where(
+                filter=firestore.FieldFilter("quoted_tweet_id", "==", quoted_tweet_id))
+            for doc in query.stream():
+                doc.reference.delete()
+            print(f"🗑️ 引用元ツイート {quoted_tweet_id} の要約キャッシュを削除しました")
+        except Exception as e:
+            print(f"⚠️ 要約キャッシュの削除に失敗しました: {e}")
+
+summary_cache = SummaryCache(summary_cache_version(summarizer.providers[0].name, summarizer.providers[0].model))
 
 # --- Twitter API Logic ---
 
-def validate_tweet_id_age(tweet_id, max_age_days=7):
+def tweet_id_datetime(tweet_id):
+    """Twitter Snowflake IDから投稿日時を算出する"""
+    return datetime.fromtimestamp(((int(tweet_id) >> 22) + TWITTER_EPOCH_MS) / 1000, tz=timezone.utc)
+
+def validate_tweet_id_age(tweet_id, max_age_days=SEARCH_WINDOW_DAYS):
     """
     Tweet IDが有効期間内かチェック（7日以内）
     """
@@ -319,9 +1850,7 @@ def validate_tweet_id_age(tweet_id, max_age_days=7):
         return False
     
     try:
-        # Twitter Snowflake IDから日時を算出
-        timestamp = ((int(tweet_id) >> 22) + 1288834974657) / 1000
-        tweet_date = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        tweet_date = tweet_id_datetime(tweet_id)
         cutoff_date = datetime.now(timezone.utc) - timedelta(days=max_age_days)
         
         is_valid = tweet_date >= cutoff_date
@@ -344,57 +1873,178 @@ def bearer_oauth(r):
     r.headers["User-Agent"] = "TweetWatcher"
     return r
 
-def search_recent_tweets():
-    last_tweet_id = load_last_tweet_id()
-    
-    # since_idの事前検証
-    if last_tweet_id and not validate_tweet_id_age(last_tweet_id):
-        print("🔄 since_idが古いため、リセットして最新から検索します")
-        last_tweet_id = None
-    
+def format_search_time(value):
+    """start_time / end_time 用の RFC 3339 形式（秒単位のUTC）"""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def fetch_tweet_pages(since_id=None, start_time=None, end_time=None, query=SEARCH_QUERY):
+    """
+    next_tokenをたどって検索結果をページ単位で取得するジェネレータ
+    since_idまたはstart_timeがある場合は、範囲の終わりまで（next_tokenがなくなるまで）全ページを返す
+    """
     params = {
-        "query": SEARCH_QUERY,
-        "max_results": 10,
-        "tweet.fields": "created_at,text,author_id,referenced_tweets",
+        "query": query,
+        "max_results": SEARCH_MAX_RESULTS,
+        "tweet.fields": "created_at,text,author_id,referenced_tweets,entities",
         "expansions": "referenced_tweets.id,author_id",
         "user.fields": "username"
     }
-    
-    if last_tweet_id:
-        params["since_id"] = last_tweet_id
-        print(f"検索クエリ: {params['query']}, since_id: {last_tweet_id} (検証済み)")
+    if since_id:
+        params["since_id"] = since_id
+    if start_time:
+        params["start_time"] = format_search_time(start_time)
+    if end_time:
+        params["end_time"] = format_search_time(end_time)
+
+    page_count = 0
+    while True:
+        metrics.increment("search_requests")
+        with metrics.timer("search"):
+            response = http_client.get(SEARCH_URL, auth=bearer_oauth, params=params)
+
+        if response.status_code != 200:
+            raise Exception(f"Twitter APIエラー: {response.status_code}, {response.text}")
+
+        data = response.json()
+        page_count += 1
+
+        # デバッグ用: レスポンスデータの表示（LOG_LEVEL=DEBUG のときだけシリアライズする）
+        if DEBUG:
+            print(f"========== Twitter API レスポンス (ページ {page_count}) ==========")
+            print(json.dumps(data, indent=2, ensure_ascii=False))
+            print("==========================================")
+
+        tweets = data.get("data", [])
+        includes = data.get("includes", {})
+        referenced_tweets = {tweet["id"]: tweet for tweet in includes.get("tweets", [])}
+        users = {user["id"]: user for user in includes.get("users", [])}
+
+        if tweets:
+            yield tweets, referenced_tweets, users
+
+        next_token = data.get("meta", {}).get("next_token")
+        if not next_token:
+            break
+        if not since_id and not start_time and page_count >= MAX_PAGES_WITHOUT_SINCE_ID:
+            print(f"since_idがないため、{page_count} ページで取得を打ち切ります")
+            break
+        params["pagination_token"] = next_token
+
+def submit_shard_pages(pipeline, fetchers, concurrency=SEARCH_SHARD_CONCURRENCY):
+    """
+    fetchers の (シャード名, ページを返すジェネレータ関数) を並行に実行し、届いたページから順に
+    ツイートIDで重複を除いてパイプラインへ流す。レート制限は全シャードで共有する http_client が守る。
+    (重複を除いた取得件数, シャード名 -> 取得順のツイートIDリスト, シャード名 -> 取得エラー) を返す。
+    """
+    pages = queue.Queue()
+
+    def _fetch(index, fetch):
+        try:
+            # 次のページを受け取るまでの時間を、そのページの検索時間としてパイプラインに渡す
+            start = time.perf_counter()
+            for page in fetch():
+                pages.put((index, page, elapsed_ms(start)))
+                start = time.perf_counter()
+        finally:
+            pages.put((index, None, None))
+
+    fetched_ids = [[] for _ in fetchers]
+    submitted = set()
+    total_count = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="search") as fetch_pool:
+        futures = [fetch_pool.submit(_fetch, index, fetch) for index, (_, fetch) in enumerate(fetchers)]
+        remaining = len(futures)
+        while remaining:
+            index, page, search_ms = pages.get()
+            if page is None:
+                remaining -= 1
+                continue
+            tweets, referenced_tweets, users = page
+            fetched_ids[index].extend(tweet["id"] for tweet in tweets)
+            # 複数のシャードにヒットしたツイートは最初に届いたものだけを処理する
+            new_tweets = [tweet for tweet in tweets if tweet["id"] not in submitted]
+            metrics.increment("tweets_deduped", len(tweets) - len(new_tweets))
+            if not new_tweets:
+                continue
+            submitted.update(tweet["id"] for tweet in new_tweets)
+            total_count += len(new_tweets)
+            print(f"[{fetchers[index][0]}] ツイートを {len(new_tweets)} 件取得しました（累計 {total_count} 件）")
+            pipeline.submit_page(new_tweets, referenced_tweets, users, search_ms)
+
+    shard_ids = OrderedDict()
+    failed = {}
+    for (shard, _), tweet_ids, future in zip(fetchers, fetched_ids, futures):
+        shard_ids.setdefault(shard, []).extend(tweet_ids)
+        error = future.exception()
+        if error is not None:
+            print(f"❌ [{shard}] の検索に失敗しました: {error}")
+            metrics.increment("errors")
+            failed.setdefault(shard, error)
+    return total_count, shard_ids, failed
+
+def search_recent_tweets(shards=None):
+    # シャードを指定しなければ、リースを確保できたシャードだけを検索する
+    leased = shards is None and WATCHER_LEASES
+    if leased:
+        shards = shard_leases.acquire(SEARCH_SHARDS)
+        if not shards:
+            print("⏸️  全シャードを他のインスタンスが担当しているため、検索をスキップします")
+            return 0
+    shards = shards or SEARCH_SHARDS
+    fetchers = []
+    for shard, query in shards.items():
+        last_tweet_id = load_last_tweet_id(shard)
+
+        # since_idの事前検証
+        if last_tweet_id and not validate_tweet_id_age(last_tweet_id):
+            # 今回の検索でチェックポイントは最新のIDに進むので、--backfill の既定の起点からは取りこぼしを遡れない。
+            # 古いチェックポイントは検索できる7日間より前なので、7日間全体を --hours で指定してもらう
+            print(f"🔄 [{shard}] since_idが古いため、リセットして最新から検索します")
+            print(f"   取りこぼした期間は --backfill --hours {SEARCH_WINDOW_DAYS * 24} で取り込めます")
+            last_tweet_id = None
+
+        if last_tweet_id:
+            print(f"[{shard}] 検索クエリ: {query}, since_id: {last_tweet_id} (検証済み)")
+        else:
+            print(f"[{shard}] 検索クエリ: {query}, since_id: なし (最新から検索)")
+        fetchers.append((shard, partial(fetch_tweet_pages, last_tweet_id, query=query)))
+
+    # 全シャードを並行に検索し、ページを受け取るたびにパイプラインへ流して次のページの取得と並行して処理する
+    with TweetPipeline() as pipeline:
+        total_count, shard_ids, failed = submit_shard_pages(pipeline, fetchers)
+        results = pipeline.drain()
+
+    if results:
+        failed_count = sum(1 for _, success in results if not success)
+        metrics.increment("tweets_failed", failed_count)
+        print(f"新着ツイートを合計 {total_count} 件処理しました（失敗 {failed_count} 件）。")
     else:
-        print(f"検索クエリ: {params['query']}, since_id: なし (最新から検索)")
-    
-    response = requests.get(SEARCH_URL, auth=bearer_oauth, params=params)
-    
-    if response.status_code != 200:
-        raise Exception(f"Twitter APIエラー: {response.status_code}, {response.text}")
-    
-    data = response.json()
-    
-    # デバッグ用: レスポンスデータの表示
-    print("========== Twitter API レスポンス ==========")
-    print(json.dumps(data, indent=2, ensure_ascii=False))
-    print("==========================================")
-    
-    tweets = data.get("data", [])
-    includes = data.get("includes", {})
-    referenced_tweets = {tweet["id"]: tweet for tweet in includes.get("tweets", [])}
-    users = {user["id"]: user for user in includes.get("users", [])}
-    
-    if not tweets:
         print("新着ツイートはありません。")
-        return
-    
-    newest_tweet_id = tweets[0]["id"]
-    print(f"新着ツイートを {len(tweets)} 件見つけました。最新のID: {newest_tweet_id}")
-    save_last_tweet_id(newest_tweet_id)
-    
-    for tweet in tweets:
-        process_tweet(tweet, referenced_tweets, users)
 
-def process_tweet(tweet, referenced_tweets=None, users=None):
+    # 古い側から途切れずに成功したところまでを低水位として、シャードごとに全ページの処理後に1回だけ保存する
+    success = dict(results)
+    for shard, tweet_ids in shard_ids.items():
+        if shard in failed or not tweet_ids:
+            continue
+        if leased and not shard_leases.holds(shard):
+            # 処理中にリースを失ったシャードのチェックポイントは、引き継いだインスタンスに任せる
+            print(f"⚠️  [{shard}] リースを失ったため、チェックポイントを保存しません")
+            continue
+        checkpoint = newest_contiguous_success([(tweet_id, success.get(tweet_id, False)) for tweet_id in tweet_ids])
+        if checkpoint:
+            save_last_tweet_id(checkpoint, shard)
+        if checkpoint != tweet_ids[0]:
+            print(f"⚠️  [{shard}] 処理に失敗したツイートがあるため、チェックポイントを {checkpoint or '据え置き'} にします")
+
+    if failed:
+        # 検索に失敗したシャードはチェックポイントを進めず、次回のポーリングでやり直す
+        raise next(iter(failed.values()))
+    return total_count
+
+def build_tweet_context(tweet, referenced_tweets=None, users=None):
+    """
+    ツイート1件の処理に必要な情報をまとめる
+    """
     text = tweet["text"]
     tweet_id = tweet["id"]
     tweet_url = f"https://twitter.com/i/web/status/{tweet_id}"
@@ -413,12 +2063,16 @@ def process_tweet(tweet, referenced_tweets=None, users=None):
     print(f"投稿日時: {created_at}")
     
     # 引用元ツイートの情報を取得
+    quoted_tweet_id = None
     quoted_tweet_text = ""
     quoted_tweet_url = ""
+    quoted_urls = []
     
     for ref in tweet.get("referenced_tweets", []):
         if ref["type"] == "quoted" and referenced_tweets and ref["id"] in referenced_tweets:
             quoted_tweet = referenced_tweets[ref["id"]]
+            quoted_tweet_id = ref["id"]
+            quoted_urls = extract_urls_from_tweet(quoted_tweet)
             quoted_tweet_text = quoted_tweet.get('text', '')
             quoted_tweet_url = f"https://twitter.com/i/web/status/{ref['id']}"
             print("---------- 引用元ツイート ----------")
@@ -427,35 +2081,501 @@ def process_tweet(tweet, referenced_tweets=None, users=None):
     
     print("=====================================")
     
-    # 引用元ツイートをAI分析
-    if quoted_tweet_text and quoted_tweet_url:
-        print("🤖 引用元ツイートをAI分析中...")
-        ai_analysis = analyze_tweet_with_gemini(quoted_tweet_text, quoted_tweet_url, created_at)
-        
-        if ai_analysis:
-            print("✅ AI分析完了")
-            print("\n========== AI分析結果（最終出力） ==========")
-            print(ai_analysis)
-            print("==========================================\n")
+    return {
+        "tweet": tweet,
+        "tweet_id": tweet_id,
+        "tweet_url": tweet_url,
+        "created_at": created_at,
+        "author_username": author_username,
+        "referenced_tweets": referenced_tweets,
+        "quoted_tweet_id": quoted_tweet_id,
+        "quoted_tweet_text": quoted_tweet_text,
+        "quoted_tweet_url": quoted_tweet_url,
+        "quoted_urls": quoted_urls,
+        "ai_analysis": None,
+        "summary_usage": None,
+        "durations_ms": {},
+    }
+
+def elapsed_ms(start):
+    """time.perf_counter() の start からの経過時間（ミリ秒）"""
+    return round((time.perf_counter() - start) * 1000)
+
+def analyze_tweet_contexts(contexts):
+    """
+    引用元ツイートをまとめてAI分析し、結果を各contextに格納する
+    同じ引用元ツイートは1回だけ分析し、要約キャッシュにあればモデルを呼ばない
+    """
+    start = time.perf_counter()
+    _analyze_tweet_contexts(contexts)
+    elapsed = time.perf_counter() - start
+    metrics.observe("analyze", elapsed)
+    for context in contexts:
+        context["durations_ms"]["analyze"] = round(elapsed * 1000)
+    return contexts
+
+def _analyze_tweet_contexts(contexts):
+    targets = OrderedDict()  # quoted_tweet_id -> そのツイートを引用しているcontextのリスト
+    for context in contexts:
+        if context["quoted_tweet_id"] and context["quoted_tweet_text"]:
+            targets.setdefault(context["quoted_tweet_id"], []).append(context)
         else:
-            print("❌ AI分析に失敗しました")
-    else:
-        print("⚠️ 引用元ツイートが見つかりません")
+            print(f"⚠️ ツイート {context['tweet_id']}: 引用元ツイートが見つかりません")
+    
+    if not targets:
+        return contexts
     
-    # 重複チェック（コメントアウト）
-    # if check_tweet_exists_in_firestore(tweet_id):
-    #     print(f"スキップ: ツイート {tweet_id} は既に処理済みです")
-    #     return
+    values = summary_cache.get_many(list(targets))
+    metrics.increment("cache_hits", len(values))
+    metrics.increment("cache_misses", len(targets) - len(values))
+    if values:
+        print(f"♻️ 引用元ツイート {len(values)} 件の要約をキャッシュから取得しました")
+    
+    misses = [quoted_tweet_id for quoted_tweet_id in targets if quoted_tweet_id not in values]
+    new_values = {}
+    if misses:
+        print(f"🤖 引用元ツイート {len(misses)} 件をAI分析中...")
+        analyses = analyze_tweets_batch([
+            (targets[quoted_tweet_id][0]["quoted_tweet_text"],
+             targets[quoted_tweet_id][0]["quoted_tweet_url"],
+             targets[quoted_tweet_id][0]["created_at"],
+             targets[quoted_tweet_id][0]["quoted_urls"])
+            for quoted_tweet_id in misses
+        ])
+        for quoted_tweet_id, (ai_analysis, usage) in zip(misses, analyses):
+            value = parse_analysis(ai_analysis) if ai_analysis else None
+            if value:
+                value["usage"] = usage
+                # URLはモデルの出力ではなく展開済みのものを使う
+                value["urls"] = targets[quoted_tweet_id][0]["quoted_urls"] or value["urls"]
+                new_values[quoted_tweet_id] = value
+        summary_cache.put_many(new_values)
+        values.update(new_values)
+    
+    for quoted_tweet_id, quoting_contexts in targets.items():
+        value = values.get(quoted_tweet_id)
+        if value:
+            # どのプロバイダの要約で、そのときに何ミリ秒かかったか（キャッシュから返したかも残す）
+            usage = dict(value.get("usage") or {}, cached=quoted_tweet_id not in new_values)
+        for context in quoting_contexts:
+            tweet_id = context["tweet_id"]
+            if value:
+                ai_analysis = format_analysis(
+                    _format_jst(context["created_at"]), value["title"], value["summary"],
+                    context["quoted_tweet_url"], value["urls"]
+                )
+                print(f"✅ ツイート {tweet_id}: AI分析完了")
+                print("\n========== AI分析結果（最終出力） ==========")
+                print(ai_analysis)
+                print("==========================================\n")
+            else:
+                ai_analysis = None
+                metrics.increment("analysis_failures")
+                print(f"❌ ツイート {tweet_id}: AI分析に失敗しました")
+            context["ai_analysis"] = ai_analysis
+            context["summary_usage"] = usage if value else None
+    
+    return contexts
+
+def persist_tweet_context(context):
+    """
+    ツイートをFirestoreに保存し、成否を返す
+    """
+    tweet_id = context["tweet_id"]
+    author_username = context["author_username"]
     
     # Firestoreに保存
-    success = save_tweet_to_firestore(tweet, referenced_tweets, author_username)
+    success = save_tweet_to_firestore(
+        context["tweet"], context["referenced_tweets"], author_username, summary=context["ai_analysis"],
+        summary_usage=context["summary_usage"], retry_payload=build_retry_payload(context),
+        durations_ms=context["durations_ms"]
+    )
     
     if success:
+        mark_tweets_processed([tweet_id])
         print(f"🎉 ツイート {tweet_id} (@{author_username}) の処理が完了しました")
     else:
         print(f"⚠️  ツイート {tweet_id} の保存に失敗しました")
+    return success
+
+def persist_tweet_contexts(contexts):
+    """
+    複数のツイートをまとめてFirestoreに保存し、{tweet_id: 成否} を返す
+    """
+    documents = [
+        build_tweet_document(
+            context["tweet"], context["author_username"], context["durations_ms"], context["ai_analysis"],
+            context["summary_usage"], build_retry_payload(context)
+        )
+        for context in contexts
+    ]
+    results = save_tweets_to_firestore(documents)
+    saved_ids = [tweet_id for tweet_id, success in results.items() if success]
+    metrics.increment("tweets_saved", len(saved_ids))
+    mark_tweets_processed(saved_ids)
+    
+    for context in contexts:
+        tweet_id = context["tweet_id"]
+        if results.get(tweet_id):
+            print(f"🎉 ツイート {tweet_id} (@{context['author_username']}) の処理が完了しました")
+        else:
+            print(f"⚠️  ツイート {tweet_id} の保存に失敗しました")
+    return results
+
+def build_retry_payload(context):
+    """要約に失敗したcontextから、要約ステージだけをやり直すのに必要な情報を取り出す（不要ならNone）"""
+    if context["ai_analysis"] is not None or not context["quoted_tweet_text"]:
+        return None
+    return {
+        "tweet_created_at": context["created_at"].isoformat(),
+        "quoted_tweet_id": context["quoted_tweet_id"],
+        "quoted_tweet_text": context["quoted_tweet_text"],
+        "quoted_tweet_url": context["quoted_tweet_url"],
+        "quoted_urls": context["quoted_urls"],
+    }
+
+def retry_failed_summaries(limit=RETRY_BATCH_SIZE):
+    """
+    要約ステージが再試行時刻を過ぎたツイートの要約だけをやり直す。
+    成功したらGitHub保存ステージをすぐに実行するよう予約し、上限を超えたらデッドレターに移す。
+    戻り値: 再試行した件数
+    """
+    db = initialize_firebase()
+    now = datetime.now(timezone.utc)
+    query = (db.collection("scrapcast_tweets")
+             .where(filter=firestore.FieldFilter("processing_status.retry_stage", "==", "summarize"))
+             .where(filter=firestore.FieldFilter("processing_status.next_retry_at", "<=", now))
+             .order_by("processing_status.next_retry_at")
+             .limit(limit))
+    snapshots = [snapshot for snapshot in query.stream() if snapshot.to_dict().get("retry_payload")]
+    if not snapshots:
+        return 0
+    
+    # 同時に動いている別のプロセスが同じツイートを拾わないよう、1件ずつトランザクションで確保する
+    # （関数側の再試行と同じ retry_policy.claim_stage。確保している間は next_retry_at がリースの期限になる）
+    snapshots = [claimed for claimed in (claim_stage(db, snapshot.reference, "summarize", WATCHER_ID)
+                                         for snapshot in snapshots) if claimed]
+    if not snapshots:
+        return 0
+    print(f"🔁 要約に失敗したツイート {len(snapshots)} 件の要約を再試行します")
+    
+    contexts = []
+    for snapshot in snapshots:
+        payload = snapshot.to_dict()["retry_payload"]
+        contexts.append({
+            "tweet_id": tweet_id_from_document_key(snapshot.id),
+            "created_at": datetime.fromisoformat(payload["tweet_created_at"]),
+            "quoted_tweet_id": payload["quoted_tweet_id"],
+            "quoted_tweet_text": payload["quoted_tweet_text"],
+            "quoted_tweet_url": payload["quoted_tweet_url"],
+            "quoted_urls": payload.get("quoted_urls", []),
+            "ai_analysis": None,
+            "summary_usage": None,
+            "durations_ms": {},
+        })
+    analyze_tweet_contexts(contexts)
+    
+    # 結果はリースを持っている間だけ書き込む（期限切れで他のプロセスに引き継がれたものは任せる）
+    completed = {
+        snapshot.id: {
+            "summary": context["ai_analysis"],
+            "retry_payload": firestore.DELETE_FIELD,
+            "processing_status.summarized": True,
+            "processing_status.summary_usage": context["summary_usage"],
+            # 後続のGitHub保存ステージをすぐに実行させる
+            **stage_completed_fields(next_stage="github"),
+        }
+        for snapshot, context in zip(snapshots, contexts) if context["ai_analysis"]
+    }
+    written = complete_stage(db, completed, "summarize", WATCHER_ID) if completed else set()
+    metrics.increment("summary_retries_succeeded", len(written))
+    failed = [snapshot.id for snapshot in snapshots if snapshot.id not in completed]
+    failures = record_stage_failures(db, failed, "summarize", "要約を生成できませんでした", WATCHER_ID) if failed else {}
+    for doc_id, failure in failures.items():
+        tweet_id = tweet_id_from_document_key(doc_id)
+        if failure.dead_letter:
+            metrics.increment("dead_letters")
+            print(f"☠️ ツイート {tweet_id} の要約が {failure.failures} 回失敗したため、デッドレターに移しました")
+        else:
+            print(f"🔁 ツイート {tweet_id} の要約を {failure.delay:.0f} 秒後に再試行します ({failure.failures}/{RETRY_MAX_ATTEMPTS})")
+    lost = len(snapshots) - len(written) - len(failures)
+    if lost:
+        print(f"⚠️  リースを失った {lost} 件の結果は書き込みません（引き継いだプロセスに任せます）")
+    return len(snapshots)
+
+def process_tweet(tweet, referenced_tweets=None, users=None):
+    """
+    ツイート1件を順番に（重複チェック → 分析 → 保存）処理する
+    """
+    start = time.perf_counter()
+    if check_tweet_exists_in_firestore(tweet["id"]):
+        print(f"スキップ: ツイート {tweet['id']} は既に処理済みです")
+        return True
+    dedup_ms = elapsed_ms(start)
+    
+    context = build_tweet_context(tweet, referenced_tweets, users)
+    context["durations_ms"]["dedup"] = dedup_ms
+    start = time.perf_counter()
+    resolve_context_urls([context])
+    context["durations_ms"]["url_resolve"] = elapsed_ms(start)
+    analyze_tweet_contexts([context])
+    return persist_tweet_context(context)
+
+# --- Processing Pipeline ---
+
+class TweetPipeline:
+    """
+    fetch → analyze → persist の各ステージを別々のワーカープールで並行実行する。
+    プールのワーカー数がそのまま外部サービス（Gemini / Firestore）ごとの同時実行数の上限になる。
+    """
+
+    def __init__(self, analyze_workers=GEMINI_CONCURRENCY, persist_workers=FIRESTORE_CONCURRENCY,
+                 batch_size=GEMINI_BATCH_SIZE):
+        self._batch_size = max(1, batch_size)
+        self._analyze_pool = ThreadPoolExecutor(max_workers=analyze_workers, thread_name_prefix="analyze")
+        self._persist_pool = ThreadPoolExecutor(max_workers=persist_workers, thread_name_prefix="persist")
+        self._pending = []  # (ページのtweet_idリスト, 保存ステージのFuture) を取得順に保持
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def submit_page(self, tweets, referenced_tweets=None, users=None, search_ms=None):
+        """
+        1ページ分のツイートを分析ステージへ投入する（完了は待たない）
+        search_ms: このページの検索にかかった時間（ミリ秒）。各ツイートの durations_ms に残す
+        """
+        page_tweet_ids = [tweet["id"] for tweet in tweets]
+        durations_ms = {} if search_ms is None else {"search": search_ms}
+        
+        # 処理済みのツイートはAI分析の前に除外する（スキップしたものは成功扱い）
+        start = time.perf_counter()
+        processed = filter_processed_tweet_ids(page_tweet_ids)
+        durations_ms["dedup"] = elapsed_ms(start)
+        metrics.increment("tweets_fetched", len(page_tweet_ids))
+        metrics.increment("tweets_skipped", len(processed))
+        if processed:
+            print(f"スキップ: 処理済みのツイート {len(processed)} 件")
+        skipped = {tweet_id: True for tweet_id in processed}
+        tweets = [tweet for tweet in tweets if tweet["id"] not in processed]
+        if not tweets:
+            done = Future()
+            done.set_result(skipped)
+            self._pending.append((page_tweet_ids, done))
+            return
+        
+        contexts = [build_tweet_context(tweet, referenced_tweets, users) for tweet in tweets]
+        # ページ内の短縮URLを並行してまとめて展開してから分析に回す
+        start = time.perf_counter()
+        resolve_context_urls(contexts)
+        durations_ms["url_resolve"] = elapsed_ms(start)
+        for context in contexts:
+            context["durations_ms"].update(durations_ms)
+        # 同じ引用元ツイートを引用しているものは同じ分析リクエストに入れる
+        groups = OrderedDict()
+        for context in contexts:
+            groups.setdefault(context["quoted_tweet_id"] or context["tweet_id"], []).append(context)
+        group_list = list(groups.values())
+        
+        analyzed = []
+        # 引用元 batch_size件ずつを1回のGemini呼び出しにまとめる
+        for start in range(0, len(group_list), self._batch_size):
+            chunk = [context for group in group_list[start:start + self._batch_size] for context in group]
+            analyzed.append(self._analyze_pool.submit(analyze_tweet_contexts, chunk))
+        
+        # ページ単位で1回の一括書き込みにする
+        persisted = self._persist_pool.submit(self._persist_when_analyzed, contexts, analyzed, skipped)
+        self._pending.append((page_tweet_ids, persisted))
+
+    @staticmethod
+    def _persist_when_analyzed(contexts, analyzed, skipped):
+        # 保存ステージは分析ステージの完了を待ってから実行する
+        for future in analyzed:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ AI分析ステージでエラーが発生しました: {e}")
+        results = dict(skipped)
+        results.update(persist_tweet_contexts(contexts))
+        return results
+
+    def drain(self):
+        """投入済みの全ツイートの完了を待ち、取得順の (tweet_id, 成否) のリストを返す"""
+        results = []
+        for tweet_ids, future in self._pending:
+            try:
+                page_results = future.result()
+            except Exception as e:
+                print(f"❌ ツイート {len(tweet_ids)} 件の処理中にエラーが発生しました: {e}")
+                page_results = {}
+            results.extend((tweet_id, page_results.get(tweet_id, False)) for tweet_id in tweet_ids)
+        self._pending = []
+        return results
+
+    def shutdown(self):
+        self._analyze_pool.shutdown(wait=True)
+        self._persist_pool.shutdown(wait=True)
+
+def newest_contiguous_success(results):
+    """
+    取得順（新しい順）の処理結果から、古い側から途切れずに成功している最新のIDを返す。
+    途中に失敗があれば、それ以降のツイートは次回の検索で再取得される。
+    """
+    checkpoint = None
+    for tweet_id, success in reversed(results):
+        if not success:
+            break
+        checkpoint = tweet_id
+    return checkpoint
+
+# --- Backfill Mode ---
+
+def backfill_time_slices(start, end, slice_hours=BACKFILL_SLICE_HOURS):
+    """[start, end) を slice_hours ごとの (start_time, end_time) に分割する（新しい区間から順に返す）"""
+    step = timedelta(hours=slice_hours)
+    slices = []
+    slice_end = end
+    while slice_end > start:
+        slice_start = max(start, slice_end - step)
+        slices.append((slice_start, slice_end))
+        slice_end = slice_start
+    return slices
+
+def backfill_start_time(since_id=None, hours=None, shard=DEFAULT_SEARCH_SHARD):
+    """
+    取り込みを始める時刻。--hours があればその時間だけ遡り、なければ since_id（既定はシャードのチェックポイント）の
+    Snowflake IDの日時から始める。どちらも recent search の7日間に収める。
+    """
+    now = datetime.now(timezone.utc)
+    oldest = now - timedelta(days=SEARCH_WINDOW_DAYS) + BACKFILL_START_MARGIN
+    if hours:
+        start = now - timedelta(hours=hours)
+    else:
+        since_id = since_id or load_last_tweet_id(shard)
+        start = tweet_id_datetime(since_id) if since_id else oldest
+    return max(start, oldest)
+
+def backfill_tweets(since_id=None, hours=None, slice_hours=BACKFILL_SLICE_HOURS, concurrency=BACKFILL_CONCURRENCY,
+                    shards=None):
+    """
+    取りこぼした期間をシャードごとに時間区間に分けて並行に検索し、通常と同じパイプラインで処理する。
+    区間の取得は concurrency 本まで同時に行い、レート制限は http_client がリセットまで待って守る。
+    処理済みのツイートはパイプラインの重複チェックで除外されるので、何度実行してもよい。
+    シャードを指定しなければ、通常の検索と同じくリースを確保できたシャードだけを取り込む。
+    """
+    leased = shards is None and WATCHER_LEASES
+    if leased:
+        shards = shard_leases.acquire(SEARCH_SHARDS)
+        if not shards:
+            print("⏸️  全シャードを他のインスタンスが担当しているため、取り込みをスキップします")
+            return 0
+    shards = shards or SEARCH_SHARDS
+    end = datetime.now(timezone.utc) - BACKFILL_END_MARGIN
+    fetchers = []
+    for shard, query in shards.items():
+        start = backfill_start_time(since_id, hours, shard)
+        slices = backfill_time_slices(start, end, slice_hours)
+        if slices:
+            print(f"⏪ [{shard}] {format_search_time(start)} 〜 {format_search_time(end)} を {len(slices)} 区間に分けて取り込みます")
+        fetchers.extend((shard, partial(fetch_tweet_pages, start_time=slice_start, end_time=slice_end, query=query))
+                        for slice_start, slice_end in slices)
+    if not fetchers:
+        print("取り込む期間がありません。")
+        return 0
+    metrics.increment("backfill_slices", len(fetchers))
+
+    with TweetPipeline() as pipeline:
+        total_count, shard_ids, failed = submit_shard_pages(pipeline, fetchers, concurrency)
+        results = pipeline.drain()
+
+    failed_count = sum(1 for _, success in results if not success)
+    metrics.increment("tweets_failed", failed_count)
+    print(f"⏪ 過去のツイートを合計 {total_count} 件処理しました（失敗 {failed_count} 件、取得失敗 {len(failed)} シャード）")
+
+    # 全区間を取りこぼしなく処理できたシャードだけ、チェックポイントを取り込んだ最新のIDまで進める
+    success = dict(results)
+    for shard, tweet_ids in shard_ids.items():
+        if shard in failed or not all(success.get(tweet_id, False) for tweet_id in tweet_ids):
+            print(f"⚠️  [{shard}] 失敗があるため、チェックポイントは据え置きます。もう一度 --backfill を実行してください")
+            continue
+        if not tweet_ids:
+            continue
+        if leased and not shard_leases.holds(shard):
+            # 取り込み中にリースを失ったシャードのチェックポイントは、引き継いだインスタンスに任せる
+            print(f"⚠️  [{shard}] リースを失ったため、チェックポイントを保存しません")
+            continue
+        newest_tweet_id = max(tweet_ids, key=int)
+        last_tweet_id = load_last_tweet_id(shard)
+        if not last_tweet_id or int(newest_tweet_id) > int(last_tweet_id):
+            save_last_tweet_id(newest_tweet_id, shard)
+    return total_count
+
+# --- Daemon Mode ---
+
+def _rate_limited_interval():
+    """
+    検索APIの残り回数をリセットまでの時間に均等に割り振ったときのポーリング間隔
+    1回のポーリングでシャードの数だけ検索するので、その分だけ間隔を空ける
+    """
+    remaining, reset = http_client.rate_limit(urlsplit(SEARCH_URL).netloc)
+    if remaining is None or reset is None:
+        return 0.0
+    return max(0.0, reset - time.time()) / max(remaining, 1) * len(SEARCH_SHARDS)
+
+def run_daemon(min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+    """
+    常駐してポーリングを続ける。
+    新着があれば min_interval で、なければ max_interval まで間隔を延ばしながら検索する。
+    SIGTERM / SIGINT を受けたら実行中のポーリング（チェックポイントの保存まで）を終えてから停止する。
+    """
+    stop_event = threading.Event()
+    
+    def _request_stop(signum, frame):
+        print(f"🛑 シグナル {signal.Signals(signum).name} を受信しました。現在の処理が終わり次第停止します")
+        stop_event.set()
+    
+    signal.signal(signal.SIGTERM, _request_stop)
+    signal.signal(signal.SIGINT, _request_stop)
+    
+    print(f"🚀 デーモンモードで起動しました（間隔 {min_interval:.0f}〜{max_interval:.0f} 秒）")
+    interval = min_interval
+    while not stop_event.is_set():
+        try:
+            new_count = search_recent_tweets()
+            retry_failed_summaries()
+        except Exception as e:
+            print(f"❌ ポーリング中にエラーが発生しました: {e}")
+            metrics.increment("errors")
+            new_count = 0
+        
+        # ポーリングごとにメトリクスを書き出してリセットする
+        metrics.export()
+        metrics.reset()
+        
+        if new_count:
+            interval = min_interval
+        else:
+            interval = min(max_interval, interval * POLL_BACKOFF_FACTOR)
+        
+        # レート制限のウィンドウ内に収まるよう、間隔の下限を残り回数から決める
+        wait = max(interval, _rate_limited_interval())
+        if not stop_event.is_set():
+            print(f"💤 次のポーリングまで {wait:.0f} 秒待機します")
+        stop_event.wait(wait)
+    
+    shard_leases.release()
+    print("👋 デーモンを停止しました")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ScrapCast tweet watcher")
+    parser.add_argument("--daemon", action="store_true", help="常駐して適応的な間隔でポーリングを続ける")
+    parser.add_argument("--backfill", action="store_true", help="チェックポイント以降（最大7日前まで）のツイートを区間に分けて並行に取り込む")
+    parser.add_argument("--since-id", help="--backfill で遡る起点のツイートID（既定はチェックポイント）")
+    parser.add_argument("--hours", type=float, help="--backfill で遡る時間（指定するとチェックポイントより優先）")
+    args = parser.parse_args()
+    
     # デバッグ用: Firebase接続テスト
     print("========== Firebase接続テスト ==========")
     try:
@@ -466,4 +2586,20 @@ if __name__ == "__main__":
         print(f"❌ Firebase接続失敗: {e}")
     print("=====================================")
     
-    search_recent_tweets()
+    warm_seen_tweet_filter()
+    if args.backfill:
+        try:
+            backfill_tweets(since_id=args.since_id, hours=args.hours)
+            retry_failed_summaries()
+        finally:
+            shard_leases.release()
+            metrics.export()
+    elif args.daemon:
+        run_daemon()
+    else:
+        try:
+            search_recent_tweets()
+            retry_failed_summaries()
+        finally:
+            shard_leases.release()
+            metrics.export()